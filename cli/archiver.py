@@ -0,0 +1,2486 @@
+"""Archiving: the DB schema, and scraping and saving tweets, users,
+media and webpages. Run through main.py, which calls connect() first.
+"""
+import collections
+import contextlib
+import itertools
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from hashlib import sha512
+from itertools import zip_longest
+
+import snscrape.modules.twitter as sntwitter
+import tabulate
+from loguru import logger
+from sqlalchemy import (BLOB, BigInteger, Column, DateTime, Float, ForeignKey,
+                        Index, Integer, MetaData, String, and_,
+                        create_engine, event, literal, or_, text)
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.types import TypeDecorator
+
+from modules import legacy, simhash, snapshots
+from modules.budget import ByteBudget, estimate_size
+from modules.compression import (codec, register_sqlite_functions,
+                                 train_dictionary)
+from modules.events import EventSink, open_output
+from modules.jobqueue import JobQueue, PermanentError, Worker
+from modules.jsonl_import import parse_chunk, read_chunks
+from modules.journal import Journal, journal_files, read_journal
+from modules.rows import edge_rows, metric_row, tweet_row, user_row
+from modules.scheduler import FairScheduler, load_accounts
+from modules.throttle import MAX_RETRIES, ConcurrencyController, is_throttled
+from modules.urls import canonicalize, is_short_url, resolve
+from modules.variants import VariantPolicy
+from modules.webpages import WebpageArchiver
+from modules.windows import (SNOWFLAKE_START, WindowPlanner, search_time,
+                             snowflake_datetime)
+
+lock = threading.Lock()
+start_time = datetime.now()
+
+meta = MetaData()
+Base = declarative_base()
+base_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(base_dir, "archives", "twitter_archive.db")
+
+# set by connect()
+engine = None
+db_session = None
+journal_dir = None
+db_path = None
+# set by initialize_database()
+job_queue = None
+
+
+def connect(path=DEFAULT_DB):
+    """Binds engine and db_session to an archive. Call it before
+    anything that touches the DB.
+
+    Args:
+        path (str, optional): Archive DB file. Defaults to DEFAULT_DB.
+    """
+    global engine, db_session, journal_dir, db_path
+    db_path = os.path.abspath(path)
+    engine = create_engine(f"sqlite:///{os.path.abspath(path)}?check_same_thread=False",  # noqa
+                           echo=False,
+                           future=True,
+                           poolclass=QueuePool
+                           )
+    event.listen(engine, "connect", _on_connect)
+    db_session = scoped_session(sessionmaker(autocommit=False,
+                                             autoflush=False,
+                                             bind=engine))
+    journal_dir = JOURNAL_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), "journal")  # noqa
+
+
+def _on_connect(dbapi_connection, connection_record):
+    register_sqlite_functions(dbapi_connection)
+
+
+class CompressedText(TypeDecorator):
+    """String column that's transparently compressed with codec
+    (see modules/compression.py)
+    """
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return codec.compress(value)
+
+    def process_result_value(self, value, dialect):
+        return codec.decompress(value)
+
+
+def grouper(iterable, n, fillvalue=None):
+    """Enables global counts
+    """
+    args = [iter(iterable)] * n
+    return zip_longest(*args, fillvalue=fillvalue)
+
+
+class TweetTable(Base):
+    __tablename__ = "tweets"
+    id = Column('id', Integer, primary_key=True, unique=True)
+    content = Column('content', CompressedText)
+    creation_datetime = Column('creation_datetime', DateTime)
+    conversation_id = Column('conversation_id', Integer)
+    hashtags = Column('hashtags', String)
+    language = Column('language', String)
+    latitude = Column('latitude', Float)
+    longitude = Column('longitude', Float)
+    like_count = Column('like_count', BigInteger)
+    links = Column('links', String)
+    mentioned_users = Column('mentioned_users', String)
+    place_country = Column('place_country', String)
+    place_country_code = Column('place_country_code', String)
+    place_full_name = Column('place_full_name', String)
+    place_name = Column('place_name', String)
+    place_type = Column('place_type', String)
+    quote_count = Column('quote_count', BigInteger)
+    reply_count = Column('reply_count', BigInteger)
+    recount = Column('recount', Integer)
+    replied_to_id = Column('replied_to_id', Integer, ForeignKey('tweets.id'))
+    source_app = Column('source_app', String)
+    url = Column('url', String)
+    user_id = Column("user_id", Integer, ForeignKey('users.id'))
+    username = Column('username', String)
+    vibe = Column('vibe', String)
+    view_count = Column("view_count", BigInteger)
+    # keyset pagination on (creation_datetime, id), see modules/reader.py
+    __table_args__ = (
+        Index("ix_tweets_user_created", "user_id", "creation_datetime", "id"),  # noqa
+        Index("ix_tweets_conversation_created", "conversation_id", "creation_datetime", "id"),  # noqa
+        Index("ix_tweets_created", "creation_datetime", "id"),
+    )
+
+
+# Engagement counts of a tweet over time, written by refresh_metrics().
+# The tweets row holds the counts when the tweet was first archived
+class TweetMetricsTable(Base):
+    __tablename__ = "tweet_metrics"
+    tweet_id = Column("tweet_id", Integer, ForeignKey("tweets.id"), primary_key=True)  # noqa
+    observed_datetime = Column("observed_datetime", DateTime, primary_key=True)  # noqa
+    like_count = Column("like_count", BigInteger)
+    reply_count = Column("reply_count", BigInteger)
+    quote_count = Column("quote_count", BigInteger)
+    recount = Column("recount", Integer)
+    view_count = Column("view_count", BigInteger)
+
+
+class UserTable(Base):
+    __tablename__ = "users"
+    id = Column('id', Integer, primary_key=True, unique=True)
+    account_url = Column('account_url', String)
+    creation_datetime = Column('creation_datetime', DateTime)
+    description = Column('description', CompressedText)
+    description_links = Column('description_links', String)
+    display_name = Column('display_name', String)
+    favorites_count = Column('favorites_count', Integer)
+    followers_count = Column('followers_count', Integer)
+    friends_count = Column('friends_count', Integer)
+    label = Column('label', String)
+    links = Column('links', String)
+    listed_count = Column('listed_count', Integer)
+    location = Column('location', String)
+    protected_account = Column('protected_account', String)
+    status_count = Column('status_count', Integer)
+    url = Column('url', String)
+    username = Column('username', String)
+    verified = Column('verified', String)
+
+
+# Changes to user profiles after they were first archived; see
+# modules/snapshots.py
+class UserSnapshotTable(Base):
+    __tablename__ = "user_snapshots"
+    user_id = Column("user_id", Integer, ForeignKey("users.id"), primary_key=True)  # noqa
+    observed_datetime = Column("observed_datetime", DateTime, primary_key=True)  # noqa
+    changes = Column("changes", String)
+
+
+class MediaTable(Base):
+    __tablename__ = "media"
+    id = Column('id', String, primary_key=True, unique=True)
+    content_blob = Column('content_blob', BLOB)
+    alt_text = Column('alt_text', String)
+    duration = Column('duration', Float)
+    url = Column('url', String)
+    views = Column('views', Integer)
+    thumbnail_id = Column('thumbnail_id', String, ForeignKey('media.id'))
+    bitrate = Column('bitrate', Integer)
+
+
+class MediaTweetsTable(Base):
+    __tablename__ = "media_tweets"
+    media_id = Column("media_id",
+                      ForeignKey("media.id"),
+                      primary_key=True
+                      )
+    tweet_id = Column("tweet_id", ForeignKey("tweets.id"), primary_key=True)
+    __table_args__ = (Index("ix_media_tweets_tweet", "tweet_id"),)
+
+
+class MediaUsersTable(Base):
+    __tablename__ = "media_users"
+    media_id = Column("media_id",
+                      ForeignKey("media.id"),
+                      primary_key=True
+                      )
+    user_id = Column("user_id", ForeignKey("users.id"), primary_key=True)
+    __table_args__ = (Index("ix_media_users_user", "user_id"),)
+
+
+class WebPagesTable(Base):
+    __tablename__ = "web_pages"
+    id = Column(String, primary_key=True)
+    url = Column("url", String)
+    warc = Column("warc", BLOB)
+    html = Column("html", CompressedText)
+    plaintext = Column("plaintext", CompressedText)
+    pdf = Column("pdf", BLOB)
+    internet_archive_link = Column("internet_archive_link", String)
+    archive_today_link = Column("archive_today_link", String)
+    # SimHash of the plaintext (signed), see modules/simhash.py. Near
+    # duplicates of another capture store no warc, html or plaintext,
+    # only the ID of that capture in duplicate_of
+    simhash = Column("simhash", Integer)
+    duplicate_of = Column("duplicate_of", String, ForeignKey("web_pages.id"))  # noqa
+
+
+# Bands of the SimHash of each web_pages capture that isn't a duplicate,
+# for finding near duplicates by index
+class WebPageSimhashBandTable(Base):
+    __tablename__ = "web_page_simhash_bands"
+    band = Column("band", Integer, primary_key=True)
+    value = Column("value", Integer, primary_key=True)
+    webpage_id = Column("webpage_id", String, ForeignKey("web_pages.id"), primary_key=True)  # noqa
+
+
+class WebpagesTweetsTable(Base):
+    __tablename__ = "webpages_tweets"
+    webpage_id = Column("webpage_id",
+                        ForeignKey("web_pages.id"),
+                        primary_key=True
+                        )
+    tweet_id = Column("tweet_id", ForeignKey("tweets.id"), primary_key=True)
+
+
+class WebpagesUsersTable(Base):
+    __tablename__ = "webpages_users"
+    webpage_id = Column("webpage_id",
+                        ForeignKey("web_pages.id"),
+                        primary_key=True
+                        )
+    user_id = Column("user_id", ForeignKey("users.id"), primary_key=True)
+
+
+# Reply, quote and retweet edges. Parents aren't foreign keys, as the
+# tweet replied to or quoted may not be archived (e.g. it was deleted)
+class TweetEdgeTable(Base):
+    __tablename__ = "tweet_edges"
+    child_id = Column("child_id", Integer, primary_key=True)
+    parent_id = Column("parent_id", Integer, primary_key=True)
+    kind = Column("kind", String, primary_key=True)
+    __table_args__ = (Index("ix_tweet_edges_parent", "parent_id"),)
+
+
+# Transitive closure of tweet_edges: one row per (ancestor, descendant)
+# pair, including each tweet with itself at depth 0. A tweet's whole
+# subtree is WHERE ancestor_id = ?, its ancestors WHERE descendant_id = ?
+# Where a tweet is reachable along several paths (e.g. it replies to one
+# tweet of a thread and quotes another), depth is that of the first one
+class TweetClosureTable(Base):
+    __tablename__ = "tweet_closure"
+    ancestor_id = Column("ancestor_id", Integer, primary_key=True)
+    descendant_id = Column("descendant_id", Integer, primary_key=True)
+    depth = Column("depth", Integer)
+    __table_args__ = (Index("ix_tweet_closure_descendant", "descendant_id", "ancestor_id"),)  # noqa
+
+
+class UrlRedirectTable(Base):
+    __tablename__ = "url_redirects"
+    url = Column("url", String, primary_key=True)
+    canonical_url = Column("canonical_url", String)
+    resolved_datetime = Column("resolved_datetime", DateTime)
+
+
+class UnavailableTable(Base):
+    __tablename__ = "unavailable"
+    kind = Column("kind", String, primary_key=True)
+    key = Column("key", String, primary_key=True)
+    reason = Column("reason", String)
+    attempts = Column("attempts", Integer)
+    first_failure_datetime = Column("first_failure_datetime", DateTime)
+    last_failure_datetime = Column("last_failure_datetime", DateTime)
+    next_check_datetime = Column("next_check_datetime", DateTime)
+
+
+class ZstdDictionaryTable(Base):
+    __tablename__ = "zstd_dictionaries"
+    id = Column("id", Integer, primary_key=True)
+    dictionary = Column("dictionary", BLOB)
+    sample_count = Column("sample_count", Integer)
+    creation_datetime = Column("creation_datetime", DateTime)
+
+
+# (table, columns) compressed with the archive's zstd dictionary
+COMPRESSED_COLUMNS = [
+    (TweetTable, ["content"]),
+    (UserTable, ["description"]),
+    (WebPagesTable, ["html", "plaintext"]),
+]
+
+TWITTER_ACCOUNTS = ["example1", "example2"]
+
+# Per-account priorities and weights. If this file exists, it replaces
+# TWITTER_ACCOUNTS; see accounts.example.toml and modules/scheduler.py
+ACCOUNTS_FILE = os.path.join(base_dir, "accounts.toml")
+
+# Pages of search results fetched and saved at once, shared fairly
+# between accounts by scheduler. Actual request concurrency is set by
+# controller, which adapts to how much the remote side will take
+ACCOUNT_WORKERS = 12
+MAX_ACCOUNT_THREADS = 256
+
+# Accounts with more tweets than this are split into time windows,
+# WINDOW_WORKERS of which are searched at once (1 disables splitting)
+LARGE_ACCOUNT_TWEETS = 20000
+WINDOW_WORKERS = 8
+
+# Tweets, media and webpages that couldn't be retrieved (e.g. deleted)
+# are skipped until they're re-checked. The interval starts at
+# UNAVAILABLE_TTL and doubles after every failed re-check, up to
+# UNAVAILABLE_MAX_TTL
+UNAVAILABLE_TTL = timedelta(days=1)
+UNAVAILABLE_MAX_TTL = timedelta(days=180)
+# Webpages whose fetch was throttled are re-checked the same way, but
+# starting at THROTTLED_WEBPAGE_TTL, so a site that throttles every
+# attempt is tried less and less often instead of on every run
+THROTTLED_WEBPAGE_TTL = timedelta(hours=1)
+
+# `python main.py refresh` re-reads the engagement counts of tweets
+# from the last REFRESH_DAYS days into tweet_metrics, searching
+# REFRESH_WORKERS accounts at once and writing METRICS_BATCH_SIZE rows
+# per transaction
+REFRESH_DAYS = 30
+REFRESH_WORKERS = 8
+METRICS_BATCH_SIZE = 500
+
+# Every newly scraped tweet is also written, as returned by snscrape, to
+# a compressed journal. `python main.py replay` rebuilds the archive
+# from it without any network access. JOURNAL_DIR defaults to journal/
+# next to the DB
+JOURNAL = True
+JOURNAL_DIR = None
+REPLAY_WORKERS = 8
+IMPORT_WORKERS = os.cpu_count() or 4
+
+journal = None
+offline = False
+
+# Account crawls can also run from the jobs table (modules/jobqueue.py):
+# `python main.py enqueue` queues the accounts, and any number of
+# `python main.py work` processes share them. Tweet lookups and media
+# downloads that are rate limited are queued there for a retry in every
+# mode. JOB_WORKERS jobs run at once per work process
+JOB_WORKERS = 12
+SEARCH_PAGE_SIZE = 20
+
+controller = ConcurrencyController()
+scheduler = FairScheduler(ACCOUNT_WORKERS)
+
+# Bytes that media and webpage downloads may hold in memory at once.
+# Downloads wait for their expected size (Content-Length, or bitrate x
+# duration for videos) to fit. Objects above LARGE_OBJECT_BYTES also
+# wait for one of LARGE_OBJECT_LANES, so big videos download a few at a
+# time without blocking everything else
+MAX_INFLIGHT_BYTES = 512 * 1024 * 1024
+LARGE_OBJECT_BYTES = 64 * 1024 * 1024
+LARGE_OBJECT_LANES = 1
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+byte_budget = ByteBudget(MAX_INFLIGHT_BYTES, LARGE_OBJECT_BYTES, LARGE_OBJECT_LANES)  # noqa
+
+# Which variant of a video or GIF to download: direct MP4 over HLS, the
+# highest bitrate within max_bitrate (bits per second) and max_height
+# (pixels), and none at all if every variant is estimated to be larger
+# than max_bytes. Accounts can override these in ACCOUNTS_FILE; see
+# modules/variants.py
+MEDIA_POLICY = dict(prefer_mp4=True, max_bitrate=None, max_height=None,
+                    max_bytes=None)
+
+media_policy = VariantPolicy(**MEDIA_POLICY)
+media_policies = {}
+
+# Profiles of recently seen users, so checking a sighting for changes
+# needs no DB access. Least recently seen users are evicted first
+PROFILE_CACHE_SIZE = 100000
+
+profiles = collections.OrderedDict()
+profiles_lock = threading.Lock()
+
+# Text is extracted from captured HTML in EXTRACT_PROCESSES processes
+# (0 extracts on the fetching threads). A page whose text is within
+# NEAR_DUPLICATE_DISTANCE bits (SimHash, out of 64) of an earlier
+# capture is stored as a reference to it; -1 stores every page in full
+EXTRACT_PROCESSES = min(4, os.cpu_count() or 1)
+NEAR_DUPLICATE_DISTANCE = 3
+
+near_duplicate_lock = threading.Lock()
+
+# Stream each tweet, user, media file and webpage as an NDJSON line to
+# EVENT_SINK once committed, while archiving or working jobs: "stdout",
+# "file:PATH" (rotated at EVENT_FILE_MAX_BYTES, keeping
+# EVENT_FILE_BACKUPS old files) or "unix:PATH" (a socket consumers
+# connect to). None turns it off. Up to EVENT_BUFFER events wait to be
+# written; beyond that they're dropped and counted rather than slowing
+# down the archiver. See modules/events.py
+EVENT_SINK = None
+EVENT_BUFFER = 10000
+EVENT_FILE_MAX_BYTES = 100 * 1024 * 1024
+EVENT_FILE_BACKUPS = 5
+
+event_sink = None
+
+# Compress tweet content, user descriptions and webpages with a zstd
+# dictionary trained from the archive. Requires `pip install zstandard`
+COMPRESS_TEXT = False
+
+# The dictionary is trained on at most DICTIONARY_SAMPLE_BYTES of text,
+# with values cut to DICTIONARY_SAMPLE_LENGTH characters. Archive runs
+# only compress the rows they write, and never VACUUM, since it rewrites
+# the whole file: `python main.py compress --vacuum` compresses older
+# rows, and vacuums once at least VACUUM_MIN_FREE_BYTES are free
+DICTIONARY_SAMPLE_BYTES = 64 * 1024 * 1024
+DICTIONARY_SAMPLE_LENGTH = 4096
+VACUUM_MIN_FREE_BYTES = 256 * 1024 * 1024
+
+
+class Counter:
+    def __init__(self):
+        self._incs = itertools.count()
+        self._accesses = itertools.count()
+
+    def increment(self):
+        next(self._incs)
+
+    def value(self):
+        return next(self._incs) - next(self._accesses)
+
+
+class CounterExists:
+    def __init__(self):
+        self._incs = itertools.count()
+        self._accesses = itertools.count()
+
+    def increment(self):
+        next(self._incs)
+
+    def value(self):
+        return next(self._incs) - next(self._accesses)
+
+
+tweet_exists_counter = CounterExists()
+user_exists_counter = CounterExists()
+media_exists_counter = CounterExists()
+tweet_counter = Counter()
+user_counter = Counter()
+media_counter = Counter()
+webpage_counter = Counter()
+webpage_exists_counter = Counter()
+near_duplicate_counter = Counter()
+
+
+def get_datetime(dt=None, string_conversion=False, save_file=False):
+    """Standardizes datetime by converting all datetime
+    values to UTC. If no datetime object is inputted,
+    the current datetime is returned.
+
+    Args:
+        dt (datetime, optional): Convert an existing
+        dt object. Defaults to None.
+        string_conversion (bool, optional): Convert
+        datetime to string. Defaults to False.
+
+    Returns:
+        datetime, str: Depending on the options chosen, will return
+        either a datetime or string object
+    """
+    if dt is None:
+        dt = datetime.now(timezone.utc)
+    else:
+        if dt.tzinfo != timezone.utc:
+            dt.replace(tzinfo=timezone.utc).timestamp()
+
+    if save_file is True:
+        dt = dt.strftime("%Y%m%d.%H%M%S-utc")
+    elif string_conversion is True:
+        dt = dt.strftime("%Y.%m.%d %H:%M:%S")
+
+    return dt
+
+
+class ProgramStats:
+    def __init__(self,
+                 tweet=None,
+                 user=None,
+                 media_id=None,
+                 ):
+        self.tweet = tweet
+        self.user = user
+        self.id = None
+        self.dt = None
+        self.username = None
+        self.obj_type = None
+        self.conversation_id = None
+        if tweet is not None:
+            self.username = tweet.user.username
+            self.dt = get_datetime(dt=tweet.date, string_conversion=True)
+            self.id = tweet.id
+            self.obj_type = "Tweet"
+            self.conversation_id = tweet.conversationId
+        elif user is not None:
+            self.username = user.username
+            self.dt = get_datetime(dt=user.created, string_conversion=True)
+            self.id = user.id
+            self.obj_type = "User"
+        elif media_id is not None:
+            self.id = str(media_id)[:15]
+            self.obj_type = "Media"
+
+        self.tweets_saved = tweet_counter.value()
+        self.users_saved = user_counter.value()
+        self.medias_saved = media_counter.value()
+        self.webpage_saved = webpage_counter.value()
+
+        self.tweets_skipped = tweet_exists_counter.value()
+        self.users_skipped = user_exists_counter.value()
+        self.medias_skipped = media_exists_counter.value()
+        self.webpage_skipped = webpage_exists_counter.value()
+        self.webpage_duplicates = near_duplicate_counter.value()
+
+        self.tweets_total = self.tweets_saved + self.tweets_skipped
+        self.users_total = self.users_saved + self.users_skipped
+        self.medias_total = self.medias_saved + self.medias_skipped
+        self.webpage_total = self.webpage_saved + self.webpage_skipped
+
+        self.total_skipped = self.tweets_skipped + self.users_skipped + self.medias_skipped + self.webpage_skipped  # noqa
+        self.total_saved = self.tweets_saved + self.users_saved + self.medias_saved + self.webpage_skipped  # noqa
+        self.total_total = self.tweets_total + self.users_total + self.medias_total + self.webpage_total  # noqa
+
+        elapsed_time = datetime.now() - start_time
+        et_float = elapsed_time.total_seconds()
+        self.elapsed_time = elapsed_time
+        self.elapsed_time = datetime.now() - start_time
+
+        self.tweet_saves_sec = round((self.tweets_saved/ et_float), 1)  # noqa
+        self.tweet_skips_sec = round((self.tweets_skipped / et_float), 1)
+        self.tweet_ops_sec = round(((self.tweets_total) / et_float), 1)
+
+        self.user_saves_sec = round((self.users_saved / et_float), 1)
+        self.user_skips_sec = round((self.users_skipped / et_float), 1)
+        self.user_ops_sec = round(((self.user_saves_sec + self.user_skips_sec) / et_float), 1)  # noqa
+
+        self.media_saves_sec = round((self.medias_saved / et_float), 1)
+        self.media_skips_sec = round((self.medias_skipped / et_float), 1)
+        self.media_ops_sec = round(((self.medias_total) / et_float), 1)
+
+        self.webpage_saves_sec = round((self.webpage_saved / et_float), 1)
+        self.webpage_skips_sec = round((self.webpage_skipped / et_float), 1)
+        self.webpage_ops_sec = round(((self.webpage_total) / et_float), 1)
+
+        self.total_saves_sec = round((self.total_saved / et_float), 1)
+        self.total_skips_sec = round((self.total_skipped / et_float), 1)
+        self.total_ops_sec = round(((self.total_total) / et_float), 1)
+
+    def print_stats(self):
+        table = [
+                ["Current Time", get_datetime(datetime.now(), string_conversion=True), "", ""],  # noqa
+                ["Elapsed Time", self.elapsed_time, "", ""],
+                ["", "", "", ""],
+                ["Saving", self.obj_type, "", ""],
+                ["Username", f"@{self.username}", "", ""],
+                ["Datetime", self.dt, "", ""],
+                ["ID", self.id, "", ""],
+                ["Conversation ID", self.conversation_id, "", ""],
+                ["", "", "", ""],
+                ["", "", "", ""],
+                ["", "Saved", "Skipped", "Total"],
+                ["Saves", "", "", ""],
+                ["  Tweets",
+                 "{:,}".format(self.tweets_saved),
+                 "{:,}".format(self.tweets_skipped),
+                 "{:,}".format(self.tweets_total),
+                 ],
+                ["  Users",
+                 "{:,}".format(self.users_saved),
+                 "{:,}".format(self.users_skipped),
+                 "{:,}".format(self.users_total),
+                 ],
+                ["  Media",
+                 "{:,}".format(self.medias_saved),
+                 "{:,}".format(self.medias_skipped),
+                 "{:,}".format(self.medias_total),
+                 ],
+                 ["  Webpages",
+                  "{:,}".format(self.webpage_saved),
+                  "{:,}".format(self.webpage_skipped),
+                  "{:,}".format(self.webpage_total),
+                  ],
+                ["    Near duplicates",
+                 "{:,}".format(self.webpage_duplicates),
+                 "", ""],
+                ["Total",
+                 "{:,}".format(self.total_saved),
+                 "{:,}".format(self.total_skipped),
+                 "{:,}".format(self.total_total),
+                 ],
+                ["", "", "", ""],
+                ["Ops/sec", "", "", ""],
+                ["  Tweets",
+                 "{:,}".format(self.tweet_saves_sec),
+                 "{:,}".format(self.tweet_skips_sec),
+                 "{:,}".format(self.tweet_ops_sec),
+                 ],
+                ["  Users",
+                 "{:,}".format(self.user_saves_sec),
+                 "{:,}".format(self.user_skips_sec),
+                 "{:,}".format(self.user_ops_sec),
+                 ],
+                ["  Media",
+                 "{:,}".format(self.media_saves_sec),
+                 "{:,}".format(self.media_skips_sec),
+                 "{:,}".format(self.media_ops_sec),
+                 ],
+                 ["  Webpages",
+                  "{:,}".format(self.webpage_saves_sec),
+                  "{:,}".format(self.webpage_skips_sec),
+                  "{:,}".format(self.media_ops_sec),
+                  ],
+                ["Total",
+                 "{:,}".format(self.total_saves_sec),
+                 "{:,}".format(self.total_skips_sec),
+                 "{:,}".format(self.total_ops_sec),
+                 ],
+                ["", "", "", ""],
+                ["Concurrency", "Limit", "Rate", "Throttled"],
+                ]
+        for name, limit, in_flight, rate, throttled in controller.stats():
+            table.append([f"  {name}",
+                          f"{limit} ({in_flight} in flight)",
+                          f"{rate}/sec",
+                          "{:,}".format(throttled),
+                          ])
+        table.append(["  Download memory",
+                      "{:,} MB".format(MAX_INFLIGHT_BYTES // 2**20),
+                      "{:,} MB in use".format(byte_budget.in_use // 2**20),
+                      "",
+                      ])
+        if event_sink is not None:
+            sent, dropped = event_sink.stats()
+            table.append(["  Events",
+                          "{:,} sent".format(sent),
+                          "{:,} dropped".format(dropped),
+                          "",
+                          ])
+        accounts = scheduler.stats()
+        if accounts:
+            table.append(["", "", "", ""])
+            table.append(["Accounts", "Tweets", "Done", "ETA"])
+        for name, seen, expected, percent, eta in accounts:
+            table.append([f"  @{name}",
+                          "{:,}/{:,}".format(seen, expected) if expected else "{:,}".format(seen),  # noqa
+                          f"{percent:.0f}%" if percent is not None else "",
+                          str(timedelta(seconds=int(eta))) if eta is not None else "",  # noqa
+                          ])
+        headers = ["Value", "Stats", "", ""]  # noqa
+        tabulate.PRESERVE_WHITESPACE = True
+        # events streamed to stdout get it to themselves
+        out = sys.stderr if event_sink is not None and EVENT_SINK == "stdout" else sys.stdout  # noqa
+        print(tabulate.tabulate(table, headers, tablefmt="presto", numalign="left", stralign="left",), file=out)  # noqa
+        print("\n", file=out)
+
+
+def download(url, estimate=None):
+    """Downloads a media file, waiting for room in byte_budget before
+    reading its body
+
+    Args:
+        url (str): Media URL
+        estimate (int, optional): Expected size in bytes, used when the
+        response has no Content-Length
+
+    Returns:
+        content_blob (bytearray): File contents, not copied into bytes
+        so that they're only held once
+        reservation (modules.budget.Reservation): Release once
+        content_blob has been stored
+    """
+    with urllib.request.urlopen(url, timeout=60) as response:
+        length = response.headers.get("Content-Length", "")
+        reservation = byte_budget.reserve(int(length) if length.isdigit() else estimate)  # noqa
+        try:
+            content = bytearray()
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                reservation.grow(len(content) + len(chunk))
+                content += chunk
+            return content, reservation
+        except Exception:
+            reservation.release()
+            raise
+
+
+def convert_m3u8(url, id, estimate=None):
+    """Converts m3u8 video URLs to
+    mp4. Twitter recently started
+    encoding at least some of their
+    videos in m3u8 playlist format.
+    Waits for room in byte_budget
+    before converting.
+
+    Args:
+        url (string): m3u8 playlist url
+        id (int): Tweet or User ID
+        estimate (int, optional): Expected size in bytes
+
+    Returns:
+        content_blob (BLOB): Binary version of mp4 file
+        fn (string): Filename, to be deleted later
+        reservation (modules.budget.Reservation): Release once
+        content_blob has been stored
+    """
+    random.seed(id)
+    r = random.randint(0, id)
+    n = datetime.now().strftime("%M%S%f")
+    random_seed = str(r) + str(n)
+    fn = base_dir + "/m3u8/" + str(id) + random_seed + ".mp4"
+    content_blob = None
+    reservation = byte_budget.reserve(estimate)
+    try:
+        try:
+            subprocess.run(['ffmpeg', '-i', url, '-bsf:a', 'aac_adtstoasc', '-vcodec', 'copy', '-c', 'copy', '-crf', '50', fn], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)  # noqa
+        except Exception as e:
+            logger.error(e)
+            return None
+        try:
+            size = os.path.getsize(fn)
+        except Exception as e:
+            logger.error(e)
+            return None
+        reservation.grow(size)
+        with open(fn, 'rb') as file:
+            content_blob = file.read()
+        return content_blob, fn, reservation
+    finally:
+        if content_blob is None:
+            reservation.release()
+
+
+def save_media(media, tweet_or_user_id: int, username: str, url: str, policy=None):  # noqa
+    """Saves media objects. Assigns each
+    a unique ID (which is a sha256 hash)
+    to avoid duplicates.
+
+    Args:
+        media (snscrape.Tweet.Media): Media object
+        tweet_or_user_id (int): Tweet or User ID
+        username (str): Username
+        url (str): Media object's URL
+        policy (VariantPolicy, optional): Picks the video/GIF variant.
+        Defaults to media_policy.
+
+    Returns:
+        int: Media object ID
+    """
+    thread_session = db_session()
+    # logger.debug(f"Getting media from tweet or user id {tweet_or_user_id}")
+    content_blob = None
+    duration = None
+    views = None
+    alt_text = None
+    thumbnail_id = None
+    bitrate = None
+    estimate = None
+    reservation = None
+    policy = policy or media_policy
+
+    '''For gifs/videos, Twitter can, but does not always,
+    save the file in more than one format and/or quality
+    level. ("variant" in snscrape). The policy picks one, or
+    none if they're all too large'''
+    if media is not None:
+        media_type = str(type(media))
+        alt_text = media.altText
+        if "Video" in media_type or "Gif" in media_type:
+            if "Video" in media_type:
+                duration = media.duration
+                views = media.views
+                if media.thumbnailUrl is not None:
+                    thumbnail_id = save_media(None,
+                                              tweet_or_user_id,
+                                              None,
+                                              media.thumbnailUrl)
+            variant = policy.choose(media.variants, duration)
+            if variant is None:
+                logger.info(f"Skipping media of {tweet_or_user_id}: no variant within the size limits")  # noqa
+                thread_session.close()
+                return
+            url = variant.url
+            bitrate = variant.bitrate
+            estimate = estimate_size(bitrate, duration)
+        elif "Photo" in media_type:
+            url = media.fullUrl
+
+    if url is not None:
+        exists = thread_session.query(MediaTable).filter(MediaTable.url == url)  # noqa
+        exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+        if exists is True:
+            media_exists_counter.increment()
+            thread_session.close()
+            return
+        if offline or is_unavailable("media", url) is True:
+            media_exists_counter.increment()
+            thread_session.close()
+            return
+        # logger.debug(f"Downloading media at {url}")
+        if ".m3u8" in url:
+            converted = convert_m3u8(url, tweet_or_user_id, estimate)
+            if converted is not None:
+                content_blob, fn, reservation = converted
+                try:
+                    os.remove(fn)
+                except Exception as e:
+                    logger.error(e)
+        else:
+            try:
+                content_blob, reservation = controller["media"].call(
+                    download, url, estimate)
+            except Exception as e:  # noqa
+                logger.error(e)
+                if not is_throttled(e):
+                    record_unavailable("media", url, e)
+                else:
+                    enqueue_job("media", url, dict(
+                        url=url, estimate=estimate,
+                        tweet_or_user_id=tweet_or_user_id,
+                        username=username, alt_text=alt_text,
+                        duration=duration, views=views,
+                        thumbnail_id=thumbnail_id, bitrate=bitrate))
+
+    try:
+        return store_media(thread_session, content_blob, tweet_or_user_id,
+                           username, alt_text, duration, url, views,
+                           thumbnail_id, bitrate)
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+
+def emit_event(kind, data):
+    """Streams a committed item to EVENT_SINK, if there's one. Never
+    blocks: see modules/events.py
+    """
+    if event_sink is not None:
+        event_sink.emit(kind, data)
+
+
+def open_event_sink():
+    global event_sink
+    if EVENT_SINK:
+        event_sink = EventSink(open_output(EVENT_SINK, EVENT_FILE_MAX_BYTES,
+                                           EVENT_FILE_BACKUPS),
+                               buffer=EVENT_BUFFER)
+
+
+def close_event_sink():
+    global event_sink
+    if event_sink is not None:
+        event_sink.close()
+        event_sink = None
+
+
+def store_media(thread_session, content_blob, tweet_or_user_id, username,
+                alt_text, duration, url, views, thumbnail_id, bitrate=None):
+    """Writes a downloaded media file and links it to its
+    tweet or user
+
+    Returns:
+        int: Media object ID
+    """
+    id = None
+    if content_blob is not None:
+        id = sha512(content_blob).hexdigest()
+        exists = thread_session.query(MediaTable).filter(MediaTable.id == id)  # noqa
+        exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+        if exists is True:
+            media_exists_counter.increment()
+        else:
+            try:
+                thread_session.add_all([MediaTable(
+                        id=id,
+                        content_blob=content_blob,
+                        alt_text=alt_text,
+                        duration=duration,
+                        url=url,
+                        views=views,
+                        thumbnail_id=thumbnail_id,
+                        bitrate=bitrate,
+                    )])
+            except Exception as e:  # noqa
+                # logger.error(e)
+                pass
+        try:
+            if username is None:
+                thread_session.add_all([MediaTweetsTable(
+                    media_id=id,
+                    tweet_id=tweet_or_user_id,
+                )])
+            else:
+                thread_session.add_all([MediaUsersTable(
+                        media_id=id,
+                        user_id=tweet_or_user_id,
+                    )])
+        except Exception as e:  # noqa
+            # logger.error(e)
+            pass
+        try:
+            thread_session.commit()
+            # logger.debug(f"Saved Media ID: {id}")
+            link = "user_id" if username is not None else "tweet_id"
+            emit_event("media", {"id": id, link: tweet_or_user_id,
+                                 "url": url, "alt_text": alt_text,
+                                 "duration": duration, "views": views,
+                                 "thumbnail_id": thumbnail_id,
+                                 "bitrate": bitrate,
+                                 "size": len(content_blob)})
+        except Exception as e:
+            if "UNIQUE constraint" not in str(e):
+                logger.error(e)
+                media_exists_counter.increment()
+                thread_session.close()
+                return id
+        media_counter.increment()
+    thread_session.close()
+    ProgramStats(media_id=id).print_stats()
+    return id
+
+
+def is_unavailable(kind, key):
+    """Checks the negative cache for an item that
+    couldn't be retrieved on an earlier attempt
+
+    Args:
+        kind (str): "tweet", "media" or "webpage"
+        key (str): Tweet ID or URL
+
+    Returns:
+        bool: True if the item should be skipped for now
+    """
+    thread_session = db_session()
+    next_check = thread_session.query(UnavailableTable.next_check_datetime).filter(UnavailableTable.kind == kind, UnavailableTable.key == str(key)).scalar()  # noqa
+    thread_session.close()
+    if next_check is None:
+        return False
+    return next_check > get_datetime().replace(tzinfo=None)
+
+
+def record_unavailable(kind, key, reason, ttl=None):
+    """Adds an item that couldn't be retrieved to the
+    negative cache, or pushes back its next re-check
+
+    Args:
+        kind (str): "tweet", "media" or "webpage"
+        key (str): Tweet ID or URL
+        reason (str): Why it couldn't be retrieved
+        ttl (timedelta, optional): First re-check interval, doubled
+        after every failed re-check. Defaults to UNAVAILABLE_TTL.
+    """
+    now = get_datetime().replace(tzinfo=None)
+    thread_session = db_session()
+    try:
+        row = thread_session.get(UnavailableTable, (kind, str(key)))
+        if row is None:
+            row = UnavailableTable(kind=kind,
+                                   key=str(key),
+                                   attempts=0,
+                                   first_failure_datetime=now)
+            thread_session.add(row)
+        row.attempts += 1
+        row.reason = str(reason)[:500]
+        row.last_failure_datetime = now
+        row.next_check_datetime = now + min(UNAVAILABLE_MAX_TTL,
+                                            (ttl or UNAVAILABLE_TTL) * 2 ** (row.attempts - 1))  # noqa
+        thread_session.commit()
+    except Exception as e:
+        logger.error(e)
+        thread_session.rollback()
+    thread_session.close()
+
+
+def clear_unavailable(kind, key):
+    """Removes an item from the negative cache once
+    it's been retrieved
+
+    Args:
+        kind (str): "tweet", "media" or "webpage"
+        key (str): Tweet ID or URL
+    """
+    thread_session = db_session()
+    thread_session.query(UnavailableTable).filter(UnavailableTable.kind == kind, UnavailableTable.key == str(key)).delete()  # noqa
+    thread_session.commit()
+    thread_session.close()
+
+
+def find_near_duplicate(thread_session, fingerprint, webpage_id):
+    """Looks for a stored capture whose text is within
+    NEAR_DUPLICATE_DISTANCE bits of a fingerprint
+
+    Returns:
+        str: ID of the closest such capture, or None
+    """
+    bands = simhash.bands(fingerprint)
+    candidates = thread_session.query(WebPagesTable.id, WebPagesTable.simhash).join(  # noqa
+        WebPageSimhashBandTable, WebPageSimhashBandTable.webpage_id == WebPagesTable.id).filter(  # noqa
+        or_(*[and_(WebPageSimhashBandTable.band == band, WebPageSimhashBandTable.value == value)  # noqa
+              for band, value in enumerate(bands)]),
+        WebPagesTable.id != webpage_id).distinct().all()
+    best = None
+    for candidate_id, candidate in candidates:
+        d = simhash.distance(fingerprint, candidate)
+        if d <= NEAR_DUPLICATE_DISTANCE and (best is None or d < best[0]):
+            best = (d, candidate_id)
+    return best[1] if best else None
+
+
+def store_webpage_capture(webpage_id, capture):
+    """Saves a page fetched by webpage_archiver to its
+    web_pages row, or a reference to an earlier capture
+    if it's a near duplicate of one
+
+    Args:
+        webpage_id (str): Webpage ID
+        capture (modules.webpages.Capture): Fetched page
+    """
+    thread_session = db_session()
+    fingerprint = capture.simhash
+    if NEAR_DUPLICATE_DISTANCE < 0:
+        fingerprint = None
+    try:
+        # serialized, so two copies of a page captured at once can't
+        # both miss each other
+        with near_duplicate_lock if fingerprint is not None else contextlib.nullcontext():  # noqa
+            original = None
+            if fingerprint is not None:
+                original = find_near_duplicate(thread_session, fingerprint, webpage_id)  # noqa
+            if original is not None:
+                values = {
+                    WebPagesTable.simhash: simhash.to_signed(fingerprint),
+                    WebPagesTable.duplicate_of: original,
+                }
+                near_duplicate_counter.increment()
+            else:
+                values = {
+                    WebPagesTable.warc: capture.warc,
+                    WebPagesTable.html: capture.html,
+                    WebPagesTable.plaintext: capture.plaintext,
+                    WebPagesTable.pdf: capture.pdf,
+                }
+                if fingerprint is not None:
+                    values[WebPagesTable.simhash] = simhash.to_signed(fingerprint)  # noqa
+                    thread_session.execute(WebPageSimhashBandTable.__table__.insert().prefix_with("OR IGNORE"), [  # noqa
+                        dict(band=band, value=value, webpage_id=webpage_id)
+                        for band, value in enumerate(simhash.bands(fingerprint))])  # noqa
+            thread_session.query(WebPagesTable).filter(WebPagesTable.id == webpage_id).update(  # noqa
+                values, synchronize_session=False)
+            # re-checks of a page that was throttled before
+            thread_session.query(UnavailableTable).filter(UnavailableTable.kind == "webpage", UnavailableTable.key == str(capture.url)).delete()  # noqa
+            thread_session.commit()
+        emit_event("webpage", {"id": webpage_id, "url": capture.url,
+                               "status": capture.status,
+                               "content_type": capture.content_type,
+                               "duplicate_of": original})
+    except Exception as e:
+        logger.error(e)
+        thread_session.rollback()
+    thread_session.close()
+
+
+def store_webpage_failure(webpage_id, url, e):
+    if is_throttled(e):
+        record_unavailable("webpage", url, e, ttl=THROTTLED_WEBPAGE_TTL)
+    else:
+        record_unavailable("webpage", url, e)
+
+
+webpage_archiver = None
+webpage_archiver_lock = threading.Lock()
+
+
+def get_webpage_archiver():
+    """Creates webpage_archiver on first use, so commands that never
+    capture pages don't set up its threads and process pool
+    """
+    global webpage_archiver
+    with webpage_archiver_lock:
+        if webpage_archiver is None:
+            webpage_archiver = WebpageArchiver(on_capture=store_webpage_capture,  # noqa
+                                               on_error=store_webpage_failure,  # noqa
+                                               limiter=controller["webpage"],  # noqa
+                                               budget=byte_budget,
+                                               extract_processes=EXTRACT_PROCESSES)  # noqa
+        return webpage_archiver
+
+
+def stop_webpage_archiver():
+    """Waits for the queued captures, if any were queued
+    """
+    global webpage_archiver
+    with webpage_archiver_lock:
+        stopping, webpage_archiver = webpage_archiver, None
+    if stopping is not None:
+        stopping.shutdown()
+
+
+def queue_pending_webpages():
+    """Queues webpages saved by earlier runs that were never
+    captured, e.g. because the program was stopped
+    """
+    thread_session = db_session()
+    pending = thread_session.query(WebPagesTable.id, WebPagesTable.url).filter(WebPagesTable.warc.is_(None), WebPagesTable.duplicate_of.is_(None)).all()  # noqa
+    thread_session.close()
+    for webpage_id, url in pending:
+        if is_unavailable("webpage", url) is False:
+            get_webpage_archiver().submit(webpage_id, url)
+
+
+url_redirects = {}
+
+
+def canonical_url(url):
+    """Returns a URL's canonical form. Short links are expanded
+    once and cached in url_redirects, so repeat links never need
+    another network round trip.
+
+    Args:
+        url (str): URL, e.g. a tweet's link
+
+    Returns:
+        str: Canonical URL
+    """
+    url = str(url)
+    if not is_short_url(url):
+        return canonicalize(url)
+    if url in url_redirects:
+        return url_redirects[url]
+
+    thread_session = db_session()
+    cached = thread_session.query(UrlRedirectTable.canonical_url).filter(UrlRedirectTable.url == url).scalar()  # noqa
+    if cached is None and offline:
+        thread_session.close()
+        return canonicalize(url)
+    if cached is None:
+        try:
+            cached = resolve(url)
+        except Exception as e:
+            # logger.debug(f"Could not expand {url}: {e}")
+            thread_session.close()
+            return canonicalize(url)
+        try:
+            thread_session.merge(UrlRedirectTable(
+                url=url,
+                canonical_url=cached,
+                resolved_datetime=get_datetime(),
+            ))
+            thread_session.commit()
+        except Exception as e:  # noqa
+            thread_session.rollback()
+    thread_session.close()
+    url_redirects[url] = cached
+    return cached
+
+
+def save_webpage(url, twitter_id, type):
+    thread_session = db_session()
+    url = canonical_url(url)
+    webpage_id = sha512(str(url).encode('utf-8')).hexdigest()
+
+    def check_exists(webpage_id, twitter_id, table):
+        exists = False
+        if table == WebPagesTable:
+            exists = thread_session.query(WebPagesTable).filter(WebPagesTable.id == str(webpage_id))  # noqa
+            exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+        elif table == WebpagesTweetsTable:
+            exists_tweet = thread_session.query(WebpagesTweetsTable).filter(WebpagesTweetsTable.tweet_id == str(twitter_id))  # noqa
+            exists_tweet = thread_session.query(literal(True)).filter(exists_tweet.exists()).scalar()  # noqa
+            exists_webpage = thread_session.query(WebpagesTweetsTable).filter(WebpagesTweetsTable.webpage_id == str(webpage_id))  # noqa
+            exists_webpage = thread_session.query(literal(True)).filter(exists_webpage.exists()).scalar()  # noqa
+            if exists_tweet is True and exists_webpage is True:
+                exists = True
+            else:
+                exists = False
+        elif table == WebpagesUsersTable:
+            exists_user = thread_session.query(WebpagesUsersTable).filter(WebpagesUsersTable.user_id == str(twitter_id))  # noqa
+            exists_user = thread_session.query(literal(True)).filter(exists_user.exists()).scalar()  # noqa
+            exists_webpage = thread_session.query(WebpagesUsersTable).filter(WebpagesUsersTable.webpage_id == str(webpage_id))  # noqa
+            exists_webpage = thread_session.query(literal(True)).filter(exists_webpage.exists()).scalar()  # noqa
+            if exists_user is True and exists_webpage is True:
+                exists = True
+            else:
+                exists = False
+        else:
+            exists = False
+        if exists is None:
+            exists = False
+        return exists
+
+    if type == TweetTable:
+        table = WebpagesTweetsTable
+    elif type == UserTable:
+        table = WebpagesUsersTable
+
+    if check_exists(webpage_id, twitter_id, table) is True:
+        webpage_exists_counter.increment()
+        return  # TODO increment stats
+    else:
+        try:
+            if table == WebpagesTweetsTable:
+                thread_session.add_all([table(
+                            webpage_id=webpage_id,
+                            tweet_id=twitter_id,
+                        )])
+            elif table == WebpagesUsersTable:
+                thread_session.add_all([table(
+                            webpage_id=webpage_id,
+                            user_id=twitter_id,
+                        )])
+            new_webpage = False
+            if check_exists(webpage_id, None, WebPagesTable) is True:
+                webpage_exists_counter.increment()
+            else:
+                # The page itself is captured in the background by
+                # webpage_archiver once this row is committed
+                # TODO: upload to the Internet Archive/archive.today
+                warc = None
+                html = None
+                plaintext = None
+                pdf = None
+                internet_archive_link = None
+                archive_today_link = None
+                thread_session.add_all([WebPagesTable(
+                                id=webpage_id,
+                                url=url,
+                                warc=warc,
+                                html=html,
+                                plaintext=plaintext,
+                                pdf=pdf,
+                                internet_archive_link=internet_archive_link,
+                                archive_today_link=archive_today_link,
+                            )])
+                new_webpage = True
+                webpage_counter.increment()
+            thread_session.commit()
+            if new_webpage and not offline:
+                get_webpage_archiver().submit(webpage_id, url)
+        except Exception as e:  # noqa
+            if "UNIQUE constraint" not in str(e):
+                # logger.error(e)
+                pass
+        thread_session.close()
+
+
+def save_user(user):
+    """Saves a user/twitter account profile
+
+    Args:
+        user (snscrape.Tweet.User): User object
+    """
+    thread_session = db_session()
+    row = user_row(user)
+
+    if row["description_links"] is not None:
+        save_webpage(row["description_links"], user.id, UserTable)
+
+    if row["links"] is not None:
+        save_webpage(row["links"], user.id, UserTable)
+
+    url = user.profileImageUrl
+    if url is not None:
+        save_media(None, user.id, user.username, url)
+        pass
+
+    if user.profileBannerUrl is not None:
+        save_media(None, user.id, user.username, user.profileBannerUrl)
+        pass
+
+    try:
+        thread_session.add_all([UserTable(**row)])
+    except Exception as e:  # noqa
+        logger.error(e)
+        thread_session.close()
+        return
+
+    try:
+        thread_session.commit()
+        emit_event("user", row)
+    except Exception as e:
+        if "UNIQUE constraint" not in str(e):
+            # logger.error(e)
+            user_exists_counter.increment()
+            thread_session.close()
+            return
+    # logger.debug(f"Saved Username: {user.username}")
+    user_counter.increment()
+    thread_session.close()
+    ProgramStats(user=user).print_stats()
+
+
+def known_profile(thread_session, user_id):
+    """Reconstructs a user's latest archived profile
+
+    Returns:
+        dict: Tracked fields (see modules/snapshots.py), or None if the
+        user isn't archived
+    """
+    user = thread_session.query(UserTable).filter(UserTable.id == user_id).first()  # noqa
+    if user is None:
+        return None
+    deltas = thread_session.query(UserSnapshotTable.changes).filter(UserSnapshotTable.user_id == user_id).order_by(UserSnapshotTable.observed_datetime)  # noqa
+    base = {name: getattr(user, name) for name in snapshots.TRACKED}
+    return snapshots.apply(snapshots.profile(base), (row.changes for row in deltas))  # noqa
+
+
+def profile_changes(thread_session, user_id, observed):
+    """Compares an observed profile with the user's latest known one,
+    from profiles or the DB
+
+    Args:
+        thread_session: Session to read the DB with
+        user_id (int): User ID
+        observed (dict): snapshots.profile() of the observation
+
+    Returns:
+        tuple: (latest profile including the changes, changed fields),
+        or None if the user isn't archived
+    """
+    with profiles_lock:
+        known = profiles.get(user_id)
+        if known is not None:
+            profiles.move_to_end(user_id)
+    if known is None:
+        known = known_profile(thread_session, user_id)
+        if known is None:
+            return None
+    delta = snapshots.changes(known, observed)
+    return snapshots.apply(known, [delta]), delta
+
+
+def cache_profile(user_id, profile):
+    with profiles_lock:
+        profiles[user_id] = profile
+        profiles.move_to_end(user_id)
+        while len(profiles) > PROFILE_CACHE_SIZE:
+            profiles.popitem(last=False)
+
+
+def record_user_snapshot(user):
+    """Records how an archived user's profile changed since it was last
+    seen, if it did. Users that aren't archived yet are left to
+    save_user.
+
+    Args:
+        user (snscrape.User): User object, as just observed
+    """
+    if not isinstance(user, sntwitter.User):
+        return
+    thread_session = db_session()
+    try:
+        found = profile_changes(thread_session, user.id,
+                                snapshots.profile(user_row(user)))
+        if found is None:
+            return
+        profile, delta = found
+        if delta:
+            thread_session.add(UserSnapshotTable(
+                user_id=user.id,
+                observed_datetime=get_datetime(),
+                changes=snapshots.encode(delta),
+            ))
+            thread_session.commit()
+        cache_profile(user.id, profile)
+    except Exception as e:
+        logger.error(f"Snapshot of @{user.username}: {e}")
+    finally:
+        thread_session.close()
+
+
+def get_tweet_by_id(new_tweet_id: int):
+    """Archives a tweet given a tweet's ID
+
+    Args:
+        new_tweet_id (int): New tweet to be archived (e.g., a
+        reply tweet)
+    """
+    thread_session = db_session()
+    exists = thread_session.query(TweetTable).filter(TweetTable.id == new_tweet_id)  # noqa
+    exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+    if exists is True:
+        tweet_exists_counter.increment()
+        thread_session.close()
+        return
+
+    thread_session.close()
+    if offline or is_unavailable("tweet", new_tweet_id) is True:
+        return
+
+    try:
+        single_tweet = controller["tweet"].call(
+            lambda: next(iter(sntwitter.TwitterTweetScraper(str(
+                                new_tweet_id)).get_items()), None))
+    except Exception as e:
+        # logger.debug(f'''Tweet could not be retrieved. It's most likely been deleted. Tweet ID: {new_tweet_id}''')  # noqa
+        if not is_throttled(e):
+            record_unavailable("tweet", new_tweet_id, e)
+        else:
+            enqueue_job("tweet", new_tweet_id, dict(id=new_tweet_id))
+        return
+
+    if not isinstance(single_tweet, sntwitter.Tweet):
+        record_unavailable("tweet", new_tweet_id, repr(single_tweet))
+        return
+    clear_unavailable("tweet", new_tweet_id)
+    return single_tweet
+
+
+def link_tweets(conn, edges):
+    """Adds edges to tweet_edges and updates tweet_closure. Tweets can
+    be linked in any order: linking a child to its parent connects
+    every ancestor of the parent to every descendant of the child.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): Connection, in a transaction
+        edges (list[dict]): TweetEdgeTable rows, see modules.rows.edge_rows
+    """
+    for edge in edges:
+        child_id, parent_id = edge["child_id"], edge["parent_id"]
+        if child_id == parent_id:
+            continue
+        inserted = conn.execute(TweetEdgeTable.__table__.insert().prefix_with("OR IGNORE"), edge).rowcount  # noqa
+        if not inserted:
+            continue
+        # an edge closing a cycle would make tweets their own ancestors
+        cycle = conn.execute(text("SELECT 1 FROM tweet_closure WHERE ancestor_id = :child AND descendant_id = :parent"), {"child": child_id, "parent": parent_id}).first()  # noqa
+        if cycle is not None:
+            continue
+        conn.execute(text("INSERT OR IGNORE INTO tweet_closure (ancestor_id, descendant_id, depth) VALUES (:parent, :parent, 0), (:child, :child, 0)"), {"child": child_id, "parent": parent_id})  # noqa
+        conn.execute(text("""
+            INSERT OR IGNORE INTO tweet_closure (ancestor_id, descendant_id, depth)
+            SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM tweet_closure a, tweet_closure d
+            WHERE a.descendant_id = :parent AND d.ancestor_id = :child
+            """), {"child": child_id, "parent": parent_id})  # noqa
+
+
+def backfill_tweet_edges(batch_size=1000):
+    """Builds tweet_edges/tweet_closure for archives created before
+    they existed. Only reply edges can be recovered from the tweets
+    table; quotes and retweets are added as tweets are re-saved (e.g.
+    by `python main.py replay` into a new DB).
+    """
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT 1 FROM tweet_edges LIMIT 1")).first() is not None:  # noqa
+            return
+    last = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text("SELECT id, replied_to_id FROM tweets WHERE replied_to_id IS NOT NULL AND id > :last ORDER BY id LIMIT :limit"), {"last": last, "limit": batch_size}).all()  # noqa
+            if not rows:
+                return
+            link_tweets(conn, [dict(child_id=id, parent_id=parent_id, kind="reply") for id, parent_id in rows])  # noqa
+        last = rows[-1][0]
+        logger.info(f"Linked replies up to tweet {last}")
+
+
+def save_tweet(tweet, policy=None):
+    """Saves a tweet and its metadata. If applicable,
+    links tweets together.
+
+    Args:
+        tweet (snscrape.Tweet): Tweet object
+        policy (VariantPolicy, optional): Picks the video/GIF variants
+        of this tweet and the ones it links to
+    """
+    if type(tweet) is sntwitter.TweetRef:
+        tweet = get_tweet_by_id(tweet.id)
+        if tweet is None:
+            return
+
+    thread_session = db_session()
+
+    def check_exists(term, table):
+        exists = False
+        if table is TweetTable:
+            exists = thread_session.query(TweetTable).filter(TweetTable.id == str(term))  # noqa
+            exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+        elif table is UserTable:
+            exists = thread_session.query(UserTable).filter(UserTable.username == str(term))  # noqa
+            exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+        if exists is None:
+            exists = False
+        return exists
+
+    # profiles are compared even on tweets already archived, so a
+    # re-crawl records changes without any new tweets
+    if not offline:
+        record_user_snapshot(tweet.user)
+
+    if check_exists(tweet.id, TweetTable) is True:
+        tweet_exists_counter.increment()
+        thread_session.close()
+        return
+
+    if journal is not None:
+        journal.write("tweet", tweet)
+
+    if check_exists(tweet.user.username, UserTable) is True:
+        user_exists_counter.increment()
+    else:
+        try:
+            save_user(tweet.user)
+        except Exception as e:  # noqa
+            pass
+            # logger.error(e)
+            pass
+
+    row = tweet_row(tweet)
+    conversation_id = row["conversation_id"]
+    replied_to_id = row["replied_to_id"]
+
+    if row["links"] is not None:
+        save_webpage(row["links"], tweet.id, TweetTable)
+    if tweet.media is not None:
+        for media in tweet.media:
+            save_media(media, tweet.id, None, None, policy)
+    if tweet.mentionedUsers is not None:
+        for user in tweet.mentionedUsers:
+            if check_exists(user.username, UserTable) is True:
+                user_exists_counter.increment()
+            else:
+                save_user(user)
+
+    try:
+        thread_session.add_all([TweetTable(**row)])
+    except Exception as e:  # noqa
+        # logger.error(e)
+        pass
+
+    try:
+        thread_session.commit()
+        tweet_counter.increment()
+        emit_event("tweet", row)
+    except Exception as e:
+        if "UNIQUE constraint" not in str(e):
+            # logger.error(e)
+            tweet_exists_counter.increment()
+    thread_session.close()
+
+    edges = edge_rows(tweet)
+    if edges:
+        try:
+            with engine.begin() as conn:
+                link_tweets(conn, edges)
+        except Exception as e:
+            logger.error(f"Linking tweet {tweet.id}: {e}")
+
+    ProgramStats(tweet=tweet).print_stats()
+
+    if tweet.quotedTweet is not None:
+        if check_exists(tweet.quotedTweet.id, TweetTable) is True:
+            tweet_exists_counter.increment()
+        else:
+            save_tweet(tweet.quotedTweet, policy)
+    if tweet.retweetedTweet is not None:
+        if check_exists(tweet.retweetedTweet.id, TweetTable) is True:
+            tweet_exists_counter.increment()
+        else:
+            save_tweet(tweet.retweetedTweet, policy)
+    if replied_to_id is not None:
+        rp_tweet = get_tweet_by_id(replied_to_id)
+        if rp_tweet is not None:
+            if check_exists(rp_tweet.id, TweetTable) is True:
+                tweet_exists_counter.increment()
+            else:
+                save_tweet(rp_tweet, policy)
+
+    if conversation_id is not None and not offline:
+        try:
+            for c_tweet in controller["search"].iterate(sntwitter.TwitterSearchScraper(f'''
+                    conversation_id:{conversation_id}
+                    -filter:unsafe (filter:safe OR -filter:safe)"
+                    ''').get_items(), page_size=SEARCH_PAGE_SIZE):  # noqa
+                if c_tweet is not None:
+                    if check_exists(c_tweet.id, TweetTable) is True:
+                        tweet_exists_counter.increment()
+                    else:
+                        save_tweet(c_tweet, policy)
+        except Exception as e:
+            logger.error(f"Conversation {conversation_id}: {e}")
+
+
+class SearchAbandoned(Exception):
+    """Raised by scrape_search when it gives up on a search partway
+    through
+
+    Args:
+        message (str): Error
+        count (int): Tweets seen before it did
+        last_id (int): ID of the last tweet seen, or None
+    """
+    def __init__(self, message, count, last_id):
+        super().__init__(message)
+        self.count = count
+        self.last_id = last_id
+
+
+def scrape_search(query, label, account):
+    """Saves every tweet a search returns, a page at a time as the
+    scheduler gives the account turns. If the search is throttled,
+    it's resumed after a backoff from the last tweet seen.
+
+    Args:
+        query (str): Twitter search query
+        label (str): Names the search in error messages
+        account (str): Account the search's turns are charged to
+
+    Returns:
+        int: Tweets seen
+
+    Raises:
+        SearchAbandoned: If the search fails for good, or stays
+        throttled after MAX_RETRIES backoffs
+    """
+    max_id = ""
+    attempt = 0
+    count = 0
+    last_id = None
+    policy = media_policies.get(account, media_policy)
+    while True:
+        try:
+            tweets = controller["search"].iterate(sntwitter.TwitterSearchScraper(f'''
+                                            {query}
+                                            {max_id}
+                                            ''').get_items(), page_size=SEARCH_PAGE_SIZE)  # noqa
+            page_full = True
+            while page_full:
+                with scheduler.turn(account):
+                    page = 0
+                    for tweet in itertools.islice(tweets, SEARCH_PAGE_SIZE):
+                        max_id = f"max_id:{tweet.id - 1}"
+                        last_id = tweet.id
+                        count += 1
+                        page += 1
+                        attempt = 0
+                        with ThreadPoolExecutor() as ex:
+                            ex.submit(save_tweet, tweet, policy)
+                        # save_tweet(tweet)
+                    scheduler.count(account, page)
+                    page_full = page == SEARCH_PAGE_SIZE
+            return count
+        except Exception as e:
+            attempt += 1
+            if not is_throttled(e) or attempt > MAX_RETRIES:
+                logger.error(f"{label}: {e}")
+                raise SearchAbandoned(f"{label}: {e}", count, last_id) from e  # noqa
+            controller["search"].backoff(attempt)
+
+
+def lookup_account(account):
+    """Fetches an account's profile
+
+    Returns:
+        snscrape.User: User object, or None if it can't be fetched
+    """
+    try:
+        return controller["search"].call(
+            lambda: sntwitter.TwitterUserScraper(account).entity)
+    except Exception as e:
+        logger.error(f"@{account}: {e}")
+        return None
+
+
+def archive_accounts(account):
+    """Archives the tweets of a given twitter
+    user/account. Accounts with more than LARGE_ACCOUNT_TWEETS
+    tweets are split into time windows searched in parallel.
+
+    Args:
+        account (str): Twitter user/account handle, added to scheduler
+
+    Raises:
+        SearchAbandoned: If part of the account's history couldn't be
+        searched, so a job crawling it is retried
+    """
+    user = lookup_account(account)
+    if user is not None:
+        scheduler.expect(account, user.statusesCount)
+    try:
+        if WINDOW_WORKERS > 1 and user is not None and (user.statusesCount or 0) > LARGE_ACCOUNT_TWEETS:  # noqa
+            archive_account_windows(account, user)
+        else:
+            scrape_search(f"""
+                          from:{account}
+                          include:nativeretweets
+                          """, f"@{account}", account)
+    finally:
+        scheduler.finish(account)
+
+
+def archive_account_windows(account, user, workers=None):
+    """Archives an account's tweets by searching since:/until:
+    windows of its history concurrently, newest first. Window widths
+    adapt to the tweet density observed; see modules/windows.py.
+    Tweets found by more than one window are deduped by save_tweet.
+    Whatever part of a window its search didn't cover before being
+    abandoned is searched again.
+
+    Args:
+        account (str): Twitter user/account handle
+        user (snscrape.User): The account's profile
+        workers (int, optional): Windows searched at once. Defaults to
+        WINDOW_WORKERS.
+
+    Raises:
+        SearchAbandoned: If some windows still couldn't be searched
+        after MAX_REQUEUES attempts
+    """
+    now = datetime.now(timezone.utc)
+    created = user.created or SNOWFLAKE_START
+    age = max((now - created).total_seconds(), 1)
+    planner = WindowPlanner(created, now, density=user.statusesCount / age)  # noqa
+
+    def search_windows():
+        while True:
+            window = planner.next()
+            if window is None:
+                return
+            since, until = window
+            try:
+                count = scrape_search(f"""
+                                      from:{account}
+                                      include:nativeretweets
+                                      since:{search_time(since)}
+                                      until:{search_time(until)}
+                                      """, f"@{account} {since:%Y-%m-%d}..{until:%Y-%m-%d}", account)  # noqa
+            except SearchAbandoned as e:
+                # results are newest first, so [since, last tweet seen)
+                # wasn't covered
+                stopped = snowflake_datetime(e.last_id) if e.last_id is not None else None  # noqa
+                if stopped is None or stopped <= since:
+                    planner.requeue(since, until)
+                    continue
+                planner.requeue(since, stopped)
+                planner.observe(stopped, until, e.count)
+                continue
+            planner.observe(since, until, count)
+
+    workers = workers or WINDOW_WORKERS
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix=f"@{account}") as executor:
+        for _ in range(workers):
+            executor.submit(search_windows)
+    logger.info(f"@{account}: {planner.tweets:,} tweets in {planner.windows:,} windows")  # noqa
+    if planner.abandoned:
+        for since, until in planner.abandoned:
+            logger.warning(f"@{account}: gave up on {since:%Y-%m-%d %H:%M}..{until:%Y-%m-%d %H:%M}")  # noqa
+        raise SearchAbandoned(f"@{account}: {len(planner.abandoned):,} windows couldn't be searched", planner.tweets, None)  # noqa
+
+
+def create_text_views():
+    """(Re)creates the *_text views, which expose the compressed
+    tables with their text columns decompressed. Readers can query
+    e.g. tweets_text exactly like tweets.
+    """
+    with engine.begin() as conn:
+        for table, columns in COMPRESSED_COLUMNS:
+            name = table.__tablename__
+            select = []
+            for column in table.__table__.columns:
+                if column.name in columns:
+                    select.append(f"zstd_decompress({column.name}) AS {column.name}")  # noqa
+                else:
+                    select.append(column.name)
+            conn.execute(text(f"DROP VIEW IF EXISTS {name}_text"))
+            conn.execute(text(f"CREATE VIEW {name}_text AS SELECT {', '.join(select)} FROM {name}"))  # noqa
+
+
+def load_text_dictionaries():
+    """Loads the archive's zstd dictionaries and activates the newest
+    one for compressing new rows
+
+    Returns:
+        bool: True if a dictionary was activated
+    """
+    thread_session = db_session()
+    rows = thread_session.query(ZstdDictionaryTable).order_by(ZstdDictionaryTable.creation_datetime).all()  # noqa
+    thread_session.close()
+    for row in rows:
+        codec.load(row.id, row.dictionary, activate=COMPRESS_TEXT)
+    return COMPRESS_TEXT and len(rows) > 0
+
+
+def train_text_dictionary(max_samples=100000,
+                          max_bytes=DICTIONARY_SAMPLE_BYTES):
+    """Trains a zstd dictionary from the text columns already in the
+    archive and stores it in zstd_dictionaries
+
+    Args:
+        max_samples (int, optional): Max values sampled per column.
+        Defaults to 100000.
+        max_bytes (int, optional): Max characters sampled in all,
+        shared evenly between the columns
+
+    Returns:
+        bool: True if a dictionary was trained
+    """
+    # webpage HTML is mostly markup, and a few large pages would take
+    # up the whole sample; their plaintext is sampled instead
+    sampled = [(table.__tablename__, column)
+               for table, columns in COMPRESSED_COLUMNS
+               for column in columns
+               if (table.__tablename__, column) != ("web_pages", "html")]
+    budget = max_bytes // len(sampled)
+    samples = []
+    with engine.connect() as conn:
+        for name, column in sampled:
+            rows = conn.execute(text(f"""
+                SELECT substr({column}, 1, :length) FROM {name}
+                WHERE typeof({column}) = 'text'
+                ORDER BY random() LIMIT :limit"""),
+                {"length": DICTIONARY_SAMPLE_LENGTH, "limit": max_samples})  # noqa
+            size = 0
+            for row in rows:
+                samples.append(row[0])
+                size += len(row[0])
+                if size >= budget:
+                    break
+            rows.close()
+    trained = train_dictionary(samples)
+    if trained is None:
+        logger.info(f"Not enough text to train a zstd dictionary yet ({len(samples)} samples)")  # noqa
+        return False
+    dict_id, data = trained
+    thread_session = db_session()
+    thread_session.merge(ZstdDictionaryTable(
+        id=dict_id,
+        dictionary=data,
+        sample_count=len(samples),
+        creation_datetime=get_datetime(),
+    ))
+    thread_session.commit()
+    thread_session.close()
+    codec.load(dict_id, data, activate=True)
+    logger.info(f"Trained zstd dictionary {dict_id} from {len(samples):,} samples")  # noqa
+    return True
+
+
+def compress_archive(batch_size=1000, vacuum=False):
+    """Compresses the text columns of rows saved before a dictionary
+    existed. Trains a dictionary first if the archive has none. Scans
+    every table, so it's only run by `python main.py compress`.
+
+    Args:
+        batch_size (int, optional): Rows rewritten per transaction.
+        Defaults to 1000.
+        vacuum (bool, optional): VACUUM afterwards, so the freed pages
+        are returned to the filesystem, if at least
+        VACUUM_MIN_FREE_BYTES are free. VACUUM rewrites the whole file,
+        needs as much free disk space again and blocks other
+        connections while it runs. Freed pages are reused for new rows
+        either way. Defaults to False.
+    """
+    if not codec.enabled and train_text_dictionary() is False:
+        return
+    for table, columns in COMPRESSED_COLUMNS:
+        name = table.__tablename__
+        for column in columns:
+            last_rowid = 0
+            compressed = 0
+            while True:
+                with engine.begin() as conn:
+                    rows = conn.execute(text(f"""
+                        SELECT rowid, {column} FROM {name}
+                        WHERE rowid > :last AND typeof({column}) = 'text'
+                        ORDER BY rowid LIMIT :limit"""),
+                        {"last": last_rowid, "limit": batch_size}).all()
+                    if len(rows) == 0:
+                        break
+                    last_rowid = rows[-1][0]
+                    updates = []
+                    for rowid, value in rows:
+                        value = codec.compress(value)
+                        if isinstance(value, bytes):
+                            updates.append({"rowid": rowid, "value": value})  # noqa
+                    if len(updates) > 0:
+                        conn.execute(text(f"UPDATE {name} SET {column} = :value WHERE rowid = :rowid"), updates)  # noqa
+                    compressed += len(updates)
+            logger.info(f"Compressed {compressed:,} values in {name}.{column}")  # noqa
+    if vacuum:
+        with engine.connect() as conn:
+            free = conn.exec_driver_sql("PRAGMA freelist_count").scalar() * conn.exec_driver_sql("PRAGMA page_size").scalar()  # noqa
+            if free < VACUUM_MIN_FREE_BYTES:
+                logger.info(f"Not vacuuming: only {free / 2**20:,.0f} MB free")  # noqa
+                return
+            logger.info(f"Vacuuming to return {free / 2**20:,.0f} MB")
+            conn.exec_driver_sql("VACUUM")
+
+
+def compress(vacuum=False):
+    """Compresses the archive's text now, whether or not COMPRESS_TEXT
+    is on, for `python main.py compress`. See compress_archive()
+    """
+    global COMPRESS_TEXT
+    COMPRESS_TEXT = True
+    initialize_database()
+    compress_archive(vacuum=vacuum)
+    db_session.close()
+
+
+def add_missing_columns():
+    """Adds columns introduced since the archive was created, e.g.
+    media.bitrate. create_all doesn't alter existing tables. New columns
+    are nullable, so old rows read as NULL.
+    """
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}  # noqa
+            for column in table.columns:
+                if column.name not in existing:
+                    logger.info(f"Adding column {table.name}.{column.name}")  # noqa
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=engine.dialect)}')  # noqa
+
+
+def refresh_metrics(days=REFRESH_DAYS, user=None, workers=REFRESH_WORKERS):  # noqa
+    """Records the current like, reply, quote, retweet and view counts
+    of recent archived tweets in tweet_metrics. Nothing else is saved:
+    no media, webpages or conversations.
+
+    There's no batch lookup by ID, so each account's tweets are re-read
+    with one search over the time span they cover, a page of tweets per
+    request, stopping once all of them have been seen. Tweets the search
+    doesn't return (deleted, or the account was renamed) are counted as
+    missing.
+
+    Args:
+        days (int, optional): Tweets created in the last this many days
+        user (str, optional): Only this account's tweets
+        workers (int, optional): Accounts searched at once
+    """
+    initialize_database()
+    since = get_datetime() - timedelta(days=days)
+    thread_session = db_session()
+    query = thread_session.query(TweetTable.username, TweetTable.id, TweetTable.creation_datetime).filter(TweetTable.creation_datetime >= since, TweetTable.username.isnot(None))  # noqa
+    if user is not None:
+        query = query.filter(TweetTable.username == user.lstrip("@"))
+    selected = collections.defaultdict(dict)
+    for username, tweet_id, created in query.yield_per(10000):
+        selected[username][tweet_id] = created
+    thread_session.close()
+    observed = get_datetime()
+    total = sum(len(tweets) for tweets in selected.values())
+    refreshed = Counter()
+    logger.info(f"Refreshing {total:,} tweets of {len(selected):,} accounts")  # noqa
+
+    def write(rows):
+        with engine.begin() as conn:
+            conn.execute(TweetMetricsTable.__table__.insert().prefix_with("OR REPLACE"), rows)  # noqa
+        for _ in rows:
+            refreshed.increment()
+
+    def refresh_account(username, tweets):
+        start = min(tweets.values()).replace(tzinfo=timezone.utc)
+        end = max(tweets.values()).replace(tzinfo=timezone.utc) + timedelta(seconds=1)  # noqa
+        remaining = set(tweets)
+        rows = []
+        max_id = ""
+        attempt = 0
+        while remaining:
+            try:
+                for tweet in controller["search"].iterate(sntwitter.TwitterSearchScraper(f"""
+                        from:{username}
+                        include:nativeretweets
+                        since:{search_time(start)}
+                        until:{search_time(end)}
+                        {max_id}
+                        """).get_items(), page_size=SEARCH_PAGE_SIZE):  # noqa
+                    max_id = f"max_id:{tweet.id - 1}"
+                    attempt = 0
+                    if tweet.id not in remaining:
+                        continue
+                    remaining.discard(tweet.id)
+                    rows.append(dict(metric_row(tweet), observed_datetime=observed))  # noqa
+                    if len(rows) >= METRICS_BATCH_SIZE:
+                        write(rows)
+                        rows = []
+                    if not remaining:
+                        break
+                break
+            except Exception as e:
+                attempt += 1
+                if not is_throttled(e) or attempt > MAX_RETRIES:
+                    logger.error(f"@{username}: {e}")
+                    break
+                controller["search"].backoff(attempt)
+        if rows:
+            write(rows)
+        if remaining:
+            logger.info(f"@{username}: {len(remaining):,} of {len(tweets):,} tweets not found")  # noqa
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for username, tweets in selected.items():
+            executor.submit(refresh_account, username, tweets)
+    db_session.close()
+    logger.info(f"Refreshed {refreshed.value():,} of {total:,} tweets")
+
+
+def enqueue_job(kind, key, payload, **options):
+    """Queues work for `python main.py work`, e.g. a retry after rate
+    limiting. Does nothing if the queue isn't open.
+    """
+    if job_queue is None:
+        return
+    try:
+        job_queue.enqueue(kind, key, payload, **options)
+    except Exception as e:
+        logger.error(f"Queueing {kind} {key}: {e}")
+
+
+def run_account_job(payload):
+    """Job handler: crawls an account, as archive() does. Raises
+    SearchAbandoned if part of its history couldn't be searched, so
+    the queue retries the job after a backoff
+    """
+    name = payload["name"]
+    scheduler.add(name, payload.get("priority", 0), payload.get("weight", 1.0))  # noqa
+    if payload.get("media"):
+        media_policies[name] = VariantPolicy(**{**MEDIA_POLICY, **payload["media"]})  # noqa
+    archive_accounts(name)
+
+
+def run_tweet_job(payload):
+    """Job handler: archives a tweet by ID. Raises if the lookup fails,
+    so the queue retries or dead-letters it
+    """
+    tweet_id = payload["id"]
+    thread_session = db_session()
+    exists = thread_session.query(TweetTable).filter(TweetTable.id == tweet_id)  # noqa
+    exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+    thread_session.close()
+    if exists is True:
+        return
+    tweet = controller["tweet"].call(
+        lambda: next(iter(sntwitter.TwitterTweetScraper(str(
+                            tweet_id)).get_items()), None))
+    if not isinstance(tweet, sntwitter.Tweet):
+        record_unavailable("tweet", tweet_id, repr(tweet))
+        raise PermanentError(f"Tweet {tweet_id} unavailable: {tweet!r}")
+    clear_unavailable("tweet", tweet_id)
+    save_tweet(tweet)
+
+
+def download_media(url, tweet_or_user_id, estimate=None):
+    """Downloads a media file for a job, converting HLS playlists
+
+    Returns:
+        tuple: (content, modules.budget.Reservation)
+
+    Raises:
+        Exception: If the download or conversion fails
+    """
+    if ".m3u8" not in url:
+        return controller["media"].call(download, url, estimate)
+    converted = convert_m3u8(url, tweet_or_user_id, estimate)
+    if converted is None:
+        raise RuntimeError(f"Couldn't convert {url}")
+    content_blob, fn, reservation = converted
+    try:
+        os.remove(fn)
+    except Exception as e:
+        logger.error(e)
+    return content_blob, reservation
+
+
+def run_media_job(payload):
+    """Job handler: downloads a media file whose download was rate
+    limited. Raises if it fails again.
+    """
+    url = payload["url"]
+    thread_session = db_session()
+    exists = thread_session.query(MediaTable).filter(MediaTable.url == url)  # noqa
+    exists = thread_session.query(literal(True)).filter(exists.exists()).scalar()  # noqa
+    if exists is True:
+        thread_session.close()
+        return
+    try:
+        content_blob, reservation = download_media(
+            url, payload["tweet_or_user_id"], payload["estimate"])
+    except Exception:
+        thread_session.close()
+        raise
+    try:
+        store_media(thread_session, content_blob,
+                    payload["tweet_or_user_id"], payload["username"],
+                    payload["alt_text"], payload["duration"], url,
+                    payload["views"], payload["thumbnail_id"],
+                    payload["bitrate"])
+    finally:
+        reservation.release()
+
+
+def run_media_repair_job(payload):
+    """Job handler: re-downloads a media file whose content no longer
+    matches its ID (queued by `python main.py verify --repair`). If the
+    file is unchanged upstream, the content is fixed in place. Otherwise
+    the row is re-keyed to the new content's ID, and its links follow.
+    """
+    old_id = payload["media_id"]
+    media = MediaTable.__table__
+    with engine.connect() as conn:
+        row = conn.execute(media.select().where(media.c.id == old_id)).mappings().first()  # noqa
+    if row is None:
+        return
+    if row["content_blob"] is not None and sha512(row["content_blob"]).hexdigest() == old_id:  # noqa
+        return
+    if not row["url"]:
+        raise PermanentError(f"Media {old_id} has no URL to download")
+    # convert_m3u8 only uses the ID to name its temp file
+    content_blob, reservation = download_media(row["url"], int(old_id[:12], 16))  # noqa
+    try:
+        new_id = sha512(content_blob).hexdigest()
+        with engine.begin() as conn:
+            if new_id == old_id:
+                conn.execute(media.update().where(media.c.id == old_id).values(content_blob=content_blob))  # noqa
+                return
+            conn.execute(media.insert().prefix_with("OR IGNORE"),
+                         dict(row, id=new_id, content_blob=content_blob))
+            for table in (MediaTweetsTable.__table__, MediaUsersTable.__table__):  # noqa
+                conn.execute(table.update().prefix_with("OR IGNORE").where(table.c.media_id == old_id).values(media_id=new_id))  # noqa
+                conn.execute(table.delete().where(table.c.media_id == old_id))  # noqa
+            conn.execute(media.update().where(media.c.thumbnail_id == old_id).values(thumbnail_id=new_id))  # noqa
+            conn.execute(media.delete().where(media.c.id == old_id))
+        logger.info(f"Media {old_id} changed upstream; replaced by {new_id}")  # noqa
+    finally:
+        reservation.release()
+
+
+JOB_HANDLERS = {
+    "account": run_account_job,
+    "tweet": run_tweet_job,
+    "media": run_media_job,
+    "media-repair": run_media_repair_job,
+}
+
+
+def enqueue_accounts(accounts=None):
+    """Queues a crawl of each account for `python main.py work`.
+    Accounts already queued are left as they are; finished ones are
+    queued again.
+
+    Args:
+        accounts (list[str], optional): Defaults to the accounts in
+        ACCOUNTS_FILE or, without one, TWITTER_ACCOUNTS.
+    """
+    if accounts:
+        accounts = load_accounts(None, accounts)
+    else:
+        accounts = load_accounts(ACCOUNTS_FILE, TWITTER_ACCOUNTS)
+    initialize_database()
+    added = sum(job_queue.enqueue("account", account["name"], account,
+                                  priority=account["priority"], again=True)
+                for account in accounts)
+    logger.info(f"Queued {added:,} of {len(accounts):,} accounts")
+
+
+def work(workers=JOB_WORKERS, forever=False, kinds=None):
+    """Runs queued jobs until there are none left to claim, or until
+    interrupted if forever. Other processes, on this host or others
+    sharing the DB file, can work the same queue.
+
+    Args:
+        workers (int, optional): Jobs run at once
+        forever (bool, optional): Keep polling for new jobs
+        kinds (list[str], optional): Only these kinds of JOB_HANDLERS
+    """
+    global journal
+    initialize_database()
+    if JOURNAL:
+        journal = Journal(journal_dir, get_datetime(save_file=True))
+    open_event_sink()
+    handlers = {kind: handler for kind, handler in JOB_HANDLERS.items()
+                if not kinds or kind in kinds}
+    # handlers raise PermanentError for what retrying can't fix;
+    # everything else is retried with a backoff
+    worker = Worker(job_queue, handlers, threads=workers)
+    worker.run(forever=forever)
+    stop_webpage_archiver()
+    if journal is not None:
+        journal.close()
+    close_event_sink()
+    db_session.close()
+    logger.info(f"Finished {worker.done:,} jobs, {worker.failed:,} failed")
+
+
+def initialize_database():
+    # logger.debug("Initializing database")
+    Base.metadata.create_all(engine, checkfirst=True)
+    add_missing_columns()
+    # create_all skips the indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    create_text_views()
+    backfill_tweet_edges()
+    global job_queue
+    job_queue = JobQueue(db_path)
+    load_text_dictionaries()
+
+
+def replay(paths=None, workers=REPLAY_WORKERS):
+    """Rebuilds or upgrades the archive from the journal, through
+    the normal save pipeline but without any network access: replied
+    to tweets, conversations and media aren't fetched, and webpages are
+    left to be captured by the next normal run. Tweets already in the
+    DB are skipped, so to rebuild, move the old DB out of the way first.
+
+    Args:
+        paths (list[str], optional): Journal files to replay. Defaults
+        to every file in the journal directory, oldest first.
+        workers (int, optional): Tweets saved in parallel.
+    """
+    global offline
+    offline = True
+    initialize_database()
+    if not paths:
+        paths = journal_files(journal_dir)
+    # bounds the tweets decoded but not yet saved
+    slots = threading.BoundedSemaphore(workers * 4)
+
+    def replay_tweet(tweet):
+        try:
+            save_tweet(tweet)
+        except Exception as e:
+            logger.error(f"Tweet {getattr(tweet, 'id', None)}: {e}")
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for kind, item in read_journal(paths, sntwitter):
+            if kind == "tweet":
+                slots.acquire()
+                executor.submit(replay_tweet, item)
+    db_session.close()
+    logger.info(f"Finished replaying {len(paths)} journal file(s)")
+
+
+def write_import_chunk(result):
+    """Writes the rows parsed from one chunk of a dump in a
+    single transaction. Existing tweets and users are kept: users rows
+    are the profiles as first seen, so how the dump's profiles differ
+    from archived users' latest ones is recorded in user_snapshots, as
+    observed now, like any other sighting.
+
+    Args:
+        result (dict): Output of modules.jsonl_import.parse_chunk
+    """
+    thread_session = db_session()
+    ids = [row["id"] for row in result["authors"]]
+    existing = set()
+    for start in range(0, len(ids), 500):
+        existing.update(row.id for row in thread_session.query(UserTable.id).filter(UserTable.id.in_(ids[start:start + 500])))  # noqa
+    thread_session.close()
+    with engine.begin() as conn:
+        if result["authors"]:
+            conn.execute(UserTable.__table__.insert().prefix_with("OR IGNORE"), result["authors"])  # noqa
+        if result["mentions"]:
+            conn.execute(UserTable.__table__.insert().prefix_with("OR IGNORE"), result["mentions"])  # noqa
+        if result["tweets"]:
+            conn.execute(TweetTable.__table__.insert().prefix_with("OR IGNORE"), result["tweets"])  # noqa
+        link_tweets(conn, result["edges"])
+    if existing:
+        record_import_snapshots([row for row in result["authors"] if row["id"] in existing])  # noqa
+    for _ in range(len(result["tweets"])):
+        tweet_counter.increment()
+    for _ in range(len(result["authors"]) - len(existing) + len(result["mentions"])):  # noqa
+        user_counter.increment()
+
+
+def record_import_snapshots(rows):
+    """Records the changes of imported profiles of archived users
+
+    Args:
+        rows (list[dict]): user_row() dicts
+    """
+    thread_session = db_session()
+    cached = []
+    try:
+        for row in rows:
+            found = profile_changes(thread_session, row["id"],
+                                    snapshots.profile(row))
+            if found is None:
+                continue
+            profile, delta = found
+            if delta:
+                thread_session.add(UserSnapshotTable(
+                    user_id=row["id"],
+                    observed_datetime=get_datetime(),
+                    changes=snapshots.encode(delta),
+                ))
+            cached.append((row["id"], profile))
+        thread_session.commit()
+        for user_id, profile in cached:
+            cache_profile(user_id, profile)
+    except Exception as e:
+        logger.error(f"Snapshots of imported users: {e}")
+        thread_session.rollback()
+    finally:
+        thread_session.close()
+
+
+def import_dumps(paths, fetch=False, workers=IMPORT_WORKERS):
+    """Bulk imports `snscrape --jsonl twitter-search` dumps. Lines
+    are parsed in worker processes and written in batches; see
+    modules/jsonl_import.py.
+
+    Args:
+        paths (list[str]): Dump files (plain, .gz, .bz2, .xz or .zst)
+        fetch (bool, optional): Afterwards, download the imported tweets'
+        media and capture their links. Defaults to False.
+        workers (int, optional): Parsing processes.
+    """
+    initialize_database()
+    lines = 0
+    errors = 0
+    # media and links to fetch are spilled to a journal file, so memory
+    # stays flat however large the dumps are
+    fetch_journal = None
+    if fetch:
+        fetch_journal = Journal(journal_dir, "import-fetch-" + get_datetime(save_file=True))  # noqa
+
+    def write(result):
+        nonlocal lines, errors
+        write_import_chunk(result)
+        lines += result["lines"]
+        errors += result["errors"]
+        if fetch_journal is not None:
+            for tweet_id, media in result["media"]:
+                fetch_journal.write("media", {"tweet_id": tweet_id, "media": media})  # noqa
+            for tweet_id, url in result["links"]:
+                fetch_journal.write("link", {"tweet_id": tweet_id, "url": url})  # noqa
+        logger.info(f"Imported {lines:,} lines ({errors:,} unreadable)")
+
+    # spawned rather than forked, since this process has threads and
+    # open DB connections
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        # submitted by hand rather than with imap, which would read
+        # the whole dump into its task queue
+        pending = collections.deque()
+        for chunk in read_chunks(paths):
+            pending.append(pool.apply_async(parse_chunk, (chunk, fetch)))
+            if len(pending) >= workers * 2:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+
+    if fetch_journal is not None:
+        fetch_journal.close()
+        slots = threading.BoundedSemaphore(ACCOUNT_WORKERS * 4)
+
+        def run(fn, *args):
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(e)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=ACCOUNT_WORKERS) as executor:
+            for kind, job in read_journal([fetch_journal.path], sntwitter):
+                if kind == "link":
+                    jobs = [(save_webpage, job["url"], job["tweet_id"], TweetTable)]  # noqa
+                else:
+                    jobs = [(save_media, media, job["tweet_id"], None, None) for media in job["media"]]  # noqa
+                for fn, *args in jobs:
+                    slots.acquire()
+                    executor.submit(run, fn, *args)
+        stop_webpage_archiver()
+        os.remove(fetch_journal.path)
+    db_session.close()
+    logger.info(f"Finished importing {len(paths)} file(s)")
+
+
+def migrate_legacy(path, batch_size=legacy.BATCH_SIZE):
+    """Converts an archive written by docker/archiver.py into this
+    program's schema, streaming it in batches. Inline media BLOBs are
+    hashed and deduped into media/media_tweets/media_users. Rows that
+    already exist are kept, so an interrupted migration can simply be
+    run again.
+
+    Args:
+        path (str): Legacy DB file
+        batch_size (int, optional): Rows per transaction. Memory use is
+        proportional to it, as each row may carry a media BLOB.
+    """
+    initialize_database()
+    steps = [
+        ("users", "user_id", legacy.convert_users, UserTable, MediaUsersTable),  # noqa
+        ("tweets", "tweet_id", legacy.convert_tweets, TweetTable, MediaTweetsTable),  # noqa
+    ]
+    for table, key, convert, target, link_table in steps:
+        total = legacy.count(path, table)
+        done = 0
+        for batch in legacy.read_batches(path, table, key, batch_size):
+            rows, media, links = convert(batch)
+            with engine.begin() as conn:
+                conn.execute(target.__table__.insert().prefix_with("OR IGNORE"), rows)  # noqa
+                if media:
+                    conn.execute(MediaTable.__table__.insert().prefix_with("OR IGNORE"), media)  # noqa
+                if links:
+                    conn.execute(link_table.__table__.insert().prefix_with("OR IGNORE"), links)  # noqa
+                if table == "tweets":
+                    link_tweets(conn, legacy.convert_edges(batch))
+            done += len(batch)
+            logger.info(f"Migrated {done:,}/{total:,} {table}")
+    db_session.close()
+
+
+def archive(accounts=None):
+    """Archives accounts, then captures pending webpages
+
+    Args:
+        accounts (list[str], optional): Defaults to the accounts in
+        ACCOUNTS_FILE or, without one, TWITTER_ACCOUNTS.
+    """
+    global journal
+    if accounts:
+        accounts = load_accounts(None, accounts)
+    else:
+        accounts = load_accounts(ACCOUNTS_FILE, TWITTER_ACCOUNTS)
+    initialize_database()
+    if JOURNAL:
+        journal = Journal(journal_dir, get_datetime(save_file=True))
+    open_event_sink()
+    queue_pending_webpages()
+    for account in accounts:
+        scheduler.add(account["name"], account["priority"], account["weight"])  # noqa
+        if account["media"]:
+            media_policies[account["name"]] = VariantPolicy(**{**MEDIA_POLICY, **account["media"]})  # noqa
+    # every account gets a thread; scheduler limits how many search at once
+    with ThreadPoolExecutor(max_workers=max(1, min(len(accounts), MAX_ACCOUNT_THREADS))) as executor:  # noqa
+        for account in accounts:
+            executor.submit(archive_accounts, account["name"])
+    # for account in TWITTER_ACCOUNTS:
+    #     archive_accounts(account)
+
+    stop_webpage_archiver()
+    if journal is not None:
+        journal.close()
+    close_event_sink()
+    if COMPRESS_TEXT and not codec.enabled:
+        # rows are compressed as they're written once a dictionary
+        # exists; `python main.py compress` catches up older ones
+        train_text_dictionary()
+    db_session.close()
+    pending = job_queue.pending()
+    if pending:
+        logger.info(f"{pending:,} jobs queued for a retry; run `python main.py work`")  # noqa
+    logger.info("Finished program")
+
@@ -0,0 +1,130 @@
+"""Process-wide budget for bytes held in memory by downloads.
+
+Thread counts bound how many downloads run at once, but not how much
+memory they take: a dozen threads each reading a 500 MB video would
+exhaust most containers. Every download reserves its expected size
+(Content-Length, or an estimate such as bitrate x duration) before
+reading its body, and waits while the budget is spent, as does a
+download that outgrows its reservation. Objects larger than
+large_object bytes additionally go through a dedicated lane with few
+slots, so a handful of huge videos can't starve everything else.
+"""
+import threading
+
+DEFAULT_ESTIMATE = 4 * 1024 * 1024
+
+
+def estimate_size(bitrate, duration):
+    """Estimates a video's size from its bitrate and duration
+
+    Args:
+        bitrate (int): Bits per second
+        duration (float): Seconds
+
+    Returns:
+        int: Estimated bytes, or None if either value is unknown
+    """
+    if not bitrate or not duration:
+        return None
+    return int(bitrate * duration / 8)
+
+
+class Reservation:
+    """Bytes reserved from a ByteBudget. Release it once the data is
+    no longer held in memory, i.e. once it has been written to the DB.
+    """
+    def __init__(self, budget, size, large):
+        self.budget = budget
+        self.size = size
+        self.large = large
+        self._released = False
+
+    def grow(self, size):
+        """Raises the reservation to size bytes, e.g. when a download
+        turns out larger than its estimate, waiting while the budget is
+        spent. So that downloads that all outgrew their estimates can't
+        wait on each other forever, one that only waits on other
+        growing downloads overdraws the budget instead. Once size passes
+        the budget's large_object, a large lane is taken too.
+        """
+        if size > self.size:
+            self.budget._grow(self, size)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.budget._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ByteBudget:
+    """Args:
+        capacity (int): Max bytes reserved at once
+        large_object (int): Objects larger than this use the large lane
+        large_lanes (int): Large objects in flight at once
+    """
+    def __init__(self, capacity, large_object, large_lanes=1):
+        self.capacity = capacity
+        self.large_object = large_object
+        self.in_use = 0
+        # bytes held by reservations waiting in grow()
+        self._growing = 0
+        self._cond = threading.Condition()
+        self._lanes = threading.Semaphore(large_lanes)
+
+    def reserve(self, size=None):
+        """Blocks until size bytes fit in the budget, then reserves them
+
+        Args:
+            size (int, optional): Expected bytes. Defaults to
+            DEFAULT_ESTIMATE. Sizes above capacity are clamped to it, so
+            an oversized object runs on its own rather than never.
+
+        Returns:
+            Reservation: Reserved bytes
+        """
+        size = min(size or DEFAULT_ESTIMATE, self.capacity)
+        large = size > self.large_object
+        if large:
+            self._lanes.acquire()
+        with self._cond:
+            while self.in_use + size > self.capacity:
+                self._cond.wait()
+            self.in_use += size
+        return Reservation(self, size, large)
+
+    def _grow(self, reservation, size):
+        held = reservation.size
+        with self._cond:
+            self._growing += held
+            # others waiting may now only be waiting on growers
+            self._cond.notify_all()
+        try:
+            # an object that turns out large takes a large lane, as if
+            # its size had been known when it was reserved
+            if not reservation.large and size > self.large_object:
+                self._lanes.acquire()
+                reservation.large = True
+            with self._cond:
+                # wait only while someone not growing holds bytes, since
+                # only they are sure to release them
+                while (self.in_use + size - held > self.capacity
+                       and self.in_use > self._growing):
+                    self._cond.wait()
+                self.in_use += size - held
+                reservation.size = size
+        finally:
+            with self._cond:
+                self._growing -= held
+
+    def _release(self, reservation):
+        with self._cond:
+            self.in_use -= reservation.size
+            self._cond.notify_all()
+        if reservation.large:
+            self._lanes.release()
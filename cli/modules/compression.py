@@ -0,0 +1,180 @@
+"""Dictionary-based zstd compression for text-heavy columns.
+
+Tweet content, user descriptions and webpage html/plaintext are short,
+highly repetitive texts. Compressing each value on its own barely helps,
+but compressing them against a dictionary trained from the archive itself
+shrinks them considerably. The dictionary is stored inside the archive
+(see ``ZstdDictionaryTable`` in archiver.py) and its ID is written into every
+zstd frame, so any value can be decompressed without extra bookkeeping.
+
+Compressed values are stored as BLOBs in the original (text) columns.
+Uncompressed values are left as TEXT, so old and new rows can coexist.
+archiver.py's CompressedText column type applies codec on write/read.
+"""
+import sqlite3
+import threading
+
+try:
+    import zstandard
+except ImportError:  # compression is optional
+    zstandard = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DICTIONARY_SIZE = 112640  # zstd's default (110 KiB)
+COMPRESSION_LEVEL = 9
+MIN_SAMPLES = 1000
+
+
+class TextCodec:
+    """Holds the zstd dictionaries loaded from the archive and
+    compresses/decompresses values with them.
+
+    zstd (de)compressor objects aren't thread-safe, so each thread
+    gets its own, created lazily from the shared dictionaries.
+    """
+    def __init__(self):
+        self._dicts = {}
+        self._active_id = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._active_id is not None
+
+    def load(self, dict_id, data, activate=False):
+        """Registers a dictionary stored in the archive
+
+        Args:
+            dict_id (int): zstd dictionary ID
+            data (bytes): Raw dictionary
+            activate (bool, optional): Use this dictionary for new
+            values. Defaults to False.
+        """
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed; run `pip install zstandard`")  # noqa
+        with self._lock:
+            self._dicts[dict_id] = zstandard.ZstdCompressionDict(data)
+            if activate:
+                self._active_id = dict_id
+            self._local = threading.local()
+
+    def disable(self):
+        with self._lock:
+            self._active_id = None
+            self._local = threading.local()
+
+    def _compressor(self):
+        local = self._local
+        if getattr(local, "compressor", None) is None:
+            local.compressor = zstandard.ZstdCompressor(
+                level=COMPRESSION_LEVEL,
+                dict_data=self._dicts[self._active_id],
+            )
+        return local.compressor
+
+    def _decompressor(self, dict_id):
+        local = self._local
+        if not hasattr(local, "decompressors"):
+            local.decompressors = {}
+        if dict_id not in local.decompressors:
+            local.decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=self._dicts.get(dict_id))
+        return local.decompressors[dict_id]
+
+    def compress(self, value):
+        """Compresses a text value with the active dictionary. Values are
+        returned unchanged if no dictionary is active, or if compressing
+        them wouldn't save space.
+
+        Args:
+            value (str): Text value
+
+        Returns:
+            bytes, str: zstd frame, or the original value
+        """
+        if value is None or not self.enabled or not isinstance(value, str):
+            return value
+        raw = value.encode("utf-8")
+        frame = self._compressor().compress(raw)
+        if len(frame) >= len(raw):
+            return value
+        return frame
+
+    def decompress(self, value):
+        """Decompresses a value written by compress(). Text values are
+        passed through.
+
+        Args:
+            value (bytes, str): Stored value
+
+        Returns:
+            str: Text value
+        """
+        if not isinstance(value, (bytes, memoryview)):
+            return value
+        value = bytes(value)
+        if not value.startswith(ZSTD_MAGIC):
+            return value.decode("utf-8")
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed; run `pip install zstandard`")  # noqa
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        return self._decompressor(dict_id).decompress(value).decode("utf-8")  # noqa
+
+
+codec = TextCodec()
+
+
+def train_dictionary(samples, dict_size=DICTIONARY_SIZE):
+    """Trains a zstd dictionary from text samples
+
+    Args:
+        samples (list[str]): Sample values, e.g., tweet content
+        dict_size (int, optional): Maximum dictionary size in bytes.
+        Defaults to DICTIONARY_SIZE.
+
+    Returns:
+        tuple: (dictionary ID, raw dictionary bytes), or None if there
+        aren't enough samples to train on yet
+    """
+    if zstandard is None:
+        raise RuntimeError("zstandard is not installed; run `pip install zstandard`")  # noqa
+    samples = [s.encode("utf-8") for s in samples if s]
+    if len(samples) < MIN_SAMPLES:
+        return None
+    zdict = zstandard.train_dictionary(dict_size, samples)
+    return zdict.dict_id(), zdict.as_bytes()
+
+
+def register_sqlite_functions(dbapi_connection):
+    """Adds a zstd_decompress() SQL function to a sqlite3 connection,
+    which the *_text views use. Call it for connections opened outside
+    of archiver.py, e.g., from analysis scripts:
+
+        conn = sqlite3.connect("twitter_archive.db")
+        register_sqlite_functions(conn)
+        load_dictionaries(conn)
+        conn.execute("SELECT content FROM tweets_text")
+
+    Args:
+        dbapi_connection (sqlite3.Connection): Connection
+    """
+    dbapi_connection.create_function("zstd_decompress", 1,
+                                     codec.decompress,
+                                     deterministic=True)
+
+
+def load_dictionaries(dbapi_connection):
+    """Loads all dictionaries stored in an archive into codec, without
+    activating any of them for compression
+
+    Args:
+        dbapi_connection (sqlite3.Connection): Connection
+    """
+    try:
+        rows = dbapi_connection.execute(
+            "SELECT id, dictionary FROM zstd_dictionaries").fetchall()
+    except sqlite3.OperationalError:
+        return
+    for dict_id, data in rows:
+        codec.load(dict_id, data)
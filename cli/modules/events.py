@@ -0,0 +1,325 @@
+"""Stream of archived items as NDJSON, for downstream consumers.
+
+Consumers polling the archive with `SELECT ... WHERE id > ?` add read
+load to the DB and only see new rows on their next poll. With an event
+sink, every tweet, user, media file and webpage the archiver commits is
+also written as one JSON line, e.g.
+
+    {"event":"tweet","at":"2024-05-01T12:00:00.123456+00:00","id":...}
+
+to stdout, a rotating file, or a Unix socket that any number of
+consumers can connect to (e.g. `socat - UNIX-CONNECT:events.sock`).
+Fields that are None are left out, and BLOBs and page contents aren't
+included: consumers read those from the archive by ID.
+
+emit() never blocks the archiver. Events wait in a bounded queue, and a
+background thread encodes and writes whatever has accumulated as one
+batch. When the queue is full, because the output is slower than the
+archiver (a stdout pipe nobody reads, a full disk), new events are
+dropped and counted. Each socket consumer also has a bounded buffer:
+one that doesn't keep up misses whole batches, counted too, while the
+others are unaffected. Lines are never cut, so what a consumer receives
+is always valid NDJSON, possibly with gaps.
+"""
+import datetime
+import errno
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+from loguru import logger
+
+BUFFER = 10000
+BATCH_SIZE = 1000
+# Seconds between retries of socket sends that couldn't complete, when
+# no new events arrive
+IDLE_INTERVAL = 0.5
+FILE_MAX_BYTES = 100 * 1024 * 1024
+FILE_BACKUPS = 5
+CLIENT_BUFFER = 4 * 1024 * 1024
+CLOSE_TIMEOUT = 10
+
+_STOP = object()
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return None
+    return str(value)
+
+
+def encode(kind, at, data):
+    """One event as an NDJSON line
+
+    Args:
+        kind (str): e.g. "tweet"
+        at (float): When it was committed, as a timestamp
+        data (dict): Fields; None values are left out
+
+    Returns:
+        str: JSON, with a trailing newline
+    """
+    record = {"event": kind, "at": datetime.datetime.fromtimestamp(at, datetime.timezone.utc).isoformat()}  # noqa
+    record.update((key, value) for key, value in data.items() if value is not None)  # noqa
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"),
+                      default=_default) + "\n"
+
+
+class StreamOutput:
+    """Writes to a binary stream, e.g. stdout
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.dropped = 0
+
+    def write(self, data, count):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def idle(self):
+        pass
+
+    def close(self):
+        self.stream.flush()
+
+
+class RotatingFileOutput:
+    """Appends to a file. Once it's larger than max_bytes, it's renamed
+    to PATH.1 (PATH.1 to PATH.2, ...), keeping backups files, and a new
+    one is started.
+    """
+    def __init__(self, path, max_bytes=FILE_MAX_BYTES, backups=FILE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "ab")
+
+    def write(self, data, count):
+        self._file.write(data)
+        self._file.flush()
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+
+    def idle(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+
+class UnixSocketOutput:
+    """Listens on a Unix socket and sends every batch to each connected
+    consumer, without ever waiting for one. A consumer's unsent data is
+    kept, up to client_buffer bytes; batches that don't fit are
+    dropped for it.
+    """
+    def __init__(self, path, client_buffer=CLIENT_BUFFER):
+        self.path = path
+        self.client_buffer = client_buffer
+        self.dropped = 0
+        self._clients = {}
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError(errno.EADDRINUSE, f"Another process is streaming events to {path}")  # noqa
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left over from a process that didn't exit cleanly
+                os.remove(path)
+            finally:
+                probe.close()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen()
+        self._server.setblocking(False)
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            client.setblocking(False)
+            self._clients[client] = bytearray()
+            logger.info(f"Event consumer connected to {self.path}")
+
+    def _send(self, client, pending):
+        try:
+            sent = client.send(pending)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        del pending[:sent]
+        return True
+
+    def write(self, data, count):
+        self._accept()
+        for client, pending in list(self._clients.items()):
+            if len(pending) + len(data) > self.client_buffer:
+                self.dropped += count
+            else:
+                pending += data
+            if not self._send(client, pending):
+                self._disconnect(client)
+
+    def idle(self):
+        self._accept()
+        for client, pending in list(self._clients.items()):
+            if pending and not self._send(client, pending):
+                self._disconnect(client)
+
+    def _disconnect(self, client):
+        del self._clients[client]
+        client.close()
+        logger.info(f"Event consumer disconnected from {self.path}")
+
+    def close(self):
+        for client, pending in list(self._clients.items()):
+            # what consumers haven't received yet, if they take it soon
+            client.settimeout(1)
+            try:
+                client.sendall(pending)
+            except OSError:
+                pass
+            client.close()
+        self._clients.clear()
+        self._server.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def open_output(target, max_bytes=FILE_MAX_BYTES, backups=FILE_BACKUPS):
+    """Output for a target: "stdout", "file:PATH" or "unix:PATH"
+    """
+    if target == "stdout":
+        return StreamOutput(sys.stdout.buffer)
+    if target.startswith("file:"):
+        return RotatingFileOutput(target[len("file:"):], max_bytes, backups)
+    if target.startswith("unix:"):
+        return UnixSocketOutput(target[len("unix:"):])
+    raise ValueError(f"Unknown event sink {target!r}; use stdout, file:PATH or unix:PATH")  # noqa
+
+
+class EventSink:
+    """Queues events and writes them to an output in batches, from a
+    background thread
+
+    Args:
+        output: StreamOutput, RotatingFileOutput or UnixSocketOutput
+        buffer (int, optional): Events that may wait to be written.
+        Beyond that, new events are dropped.
+        batch_size (int, optional): Most events written at once
+    """
+    def __init__(self, output, buffer=BUFFER, batch_size=BATCH_SIZE):
+        self.output = output
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=buffer)
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="events",
+                                        daemon=True)
+        self._thread.start()
+
+    def emit(self, kind, data):
+        """Queues an event, or drops it if the queue is full
+
+        Args:
+            kind (str): "tweet", "user", "media" or "webpage"
+            data (dict): Fields, e.g. the row's columns
+        """
+        try:
+            self._queue.put_nowait((kind, time.time(), data))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                first = self.dropped == 1
+            if first:
+                logger.warning("Event sink can't keep up; dropping events")  # noqa
+
+    def stats(self):
+        """
+        Returns:
+            tuple: (events written, events dropped, whether from the
+            queue or by a slow socket consumer)
+        """
+        return self.sent, self.dropped + self.output.dropped
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=IDLE_INTERVAL)
+            except queue.Empty:
+                self._idle()
+                continue
+            batch = []
+            stop = False
+            while item is not _STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                stop = True
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        data = "".join(encode(*item) for item in batch).encode("utf-8")
+        try:
+            self.output.write(data, len(batch))
+            self.sent += len(batch)
+        except Exception as e:
+            logger.error(f"Could not write {len(batch):,} events: {e}")
+            with self._lock:
+                self.dropped += len(batch)
+
+    def _idle(self):
+        try:
+            self.output.idle()
+        except Exception as e:
+            logger.error(f"Event sink: {e}")
+
+    def close(self):
+        """Writes the events still queued, waiting up to CLOSE_TIMEOUT
+        seconds, and closes the output
+        """
+        try:
+            self._queue.put(_STOP, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            pass
+        self._thread.join(CLOSE_TIMEOUT)
+        if self._thread.is_alive():
+            logger.warning("Event sink didn't finish writing; remaining events dropped")  # noqa
+            return
+        self.output.close()
+        sent, dropped = self.stats()
+        logger.info(f"Event sink: {sent:,} events written, {dropped:,} dropped")  # noqa
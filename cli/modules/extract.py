@@ -0,0 +1,201 @@
+"""Exports media from an archive to files.
+
+Each BLOB is streamed to disk in chunks with SQLite's incremental BLOB
+I/O, so memory use doesn't depend on the size of the largest video, and
+several files are written in parallel. Files are named after the
+media's ID (the sha512 of its content), with an extension sniffed from
+the first bytes. A file that already exists with the right size is
+skipped, so an interrupted export can simply be run again.
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+
+from modules.reader import to_db_datetime
+
+WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+PAGE_SIZE = 1000
+
+# (offset, magic bytes, extension), checked in order
+SIGNATURES = [
+    (0, b"\xff\xd8\xff", ".jpg"),
+    (0, b"\x89PNG\r\n\x1a\n", ".png"),
+    (0, b"GIF8", ".gif"),
+    (8, b"WEBP", ".webp"),
+    (4, b"ftypqt", ".mov"),
+    (4, b"ftyp", ".mp4"),
+    (0, b"\x1a\x45\xdf\xa3", ".webm"),
+    (0, b"%PDF", ".pdf"),
+]
+
+
+def sniff_extension(header: bytes) -> str:
+    """Guesses a file extension from a file's first bytes
+
+    Args:
+        header (bytes): At least the first 16 bytes
+
+    Returns:
+        str: e.g. ".jpg", or ".bin" if the format isn't recognized
+    """
+    for offset, magic, extension in SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            return extension
+    return ".bin"
+
+
+def select_media(path, user_id=None, since=None, until=None, tweet_id=None,
+                 page_size=PAGE_SIZE):
+    """Streams the media matching the filters. With no filters, every
+    media row is selected.
+
+    Args:
+        path (str): Archive DB file
+        user_id (int, optional): Media of this user's tweets, and their
+        profile pictures and banners
+        since (datetime, optional): Media of tweets from this time on
+        until (datetime, optional): Media of tweets before this time
+        tweet_id (int, optional): Media of this tweet
+        page_size (int, optional): Rows read per query
+
+    Yields:
+        tuple: (rowid, media ID, size in bytes)
+    """
+    where = []
+    params = []
+    if tweet_id is not None:
+        where.append("tweets.id = ?")
+        params.append(tweet_id)
+    if user_id is not None:
+        where.append("tweets.user_id = ?")
+        params.append(user_id)
+    if since is not None:
+        where.append("tweets.creation_datetime >= ?")
+        params.append(to_db_datetime(since))
+    if until is not None:
+        where.append("tweets.creation_datetime < ?")
+        params.append(to_db_datetime(until))
+
+    if where:
+        selected = f"media.id IN (SELECT media_tweets.media_id FROM media_tweets JOIN tweets ON tweets.id = media_tweets.tweet_id WHERE {' AND '.join(where)})"  # noqa
+        if user_id is not None and tweet_id is None and since is None and until is None:  # noqa
+            selected = f"({selected} OR media.id IN (SELECT media_id FROM media_users WHERE user_id = ?))"  # noqa
+            params.append(user_id)
+    else:
+        selected = "1"
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    last = 0
+    try:
+        while True:
+            rows = conn.execute(f"SELECT media.rowid, media.id, length(media.content_blob) FROM media WHERE {selected} AND media.rowid > ? AND media.content_blob IS NOT NULL ORDER BY media.rowid LIMIT ?", params + [last, page_size]).fetchall()  # noqa
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield from rows
+    finally:
+        conn.close()
+
+
+class MediaExtractor:
+    """Writes media files on a thread pool, each thread reading through
+    its own read-only connection
+
+    Args:
+        path (str): Archive DB file
+        out_dir (str): Directory to write the files to
+        workers (int, optional): Files written in parallel
+    """
+    def __init__(self, path, out_dir, workers=WORKERS):
+        self.path = path
+        self.out_dir = out_dir
+        self.workers = workers
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def _connection(self):
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)  # noqa
+        return self._local.conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def extract_one(self, rowid, media_id, size):
+        """Streams one media BLOB to out_dir/<media ID><extension>
+
+        Returns:
+            str: File name, or None if it couldn't be written
+        """
+        try:
+            with self._connection().blobopen("media", "content_blob", rowid, readonly=True) as blob:  # noqa
+                extension = sniff_extension(blob.read(16))
+                target = os.path.join(self.out_dir, media_id + extension)
+                if os.path.exists(target) and os.path.getsize(target) == size:  # noqa
+                    self._count("skipped")
+                    return os.path.basename(target)
+                blob.seek(0)
+                # pages of a site may extract the same media at once
+                partial = f"{target}.{threading.get_ident()}.part"
+                with open(partial, "wb") as file:
+                    while True:
+                        chunk = blob.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        file.write(chunk)
+                os.replace(partial, target)
+            self._count("written")
+            self._count("bytes", size)
+            return os.path.basename(target)
+        except Exception as e:
+            logger.error(f"Could not extract media {media_id}: {e}")
+            self._count("failed")
+            return None
+
+    def run(self, media):
+        """Extracts media, e.g. from select_media()
+
+        Args:
+            media (iterable): (rowid, media ID, size) tuples
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        # bounds the rows selected but not yet extracted
+        slots = threading.BoundedSemaphore(self.workers * 4)
+
+        def extract(row):
+            try:
+                self.extract_one(*row)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="extract") as executor:
+            for row in media:
+                slots.acquire()
+                executor.submit(extract, row)
+
+
+def extract_media(path: str, out_dir: str, user_id: Optional[int] = None,
+                  since: Optional[datetime] = None,
+                  until: Optional[datetime] = None,
+                  tweet_id: Optional[int] = None,
+                  workers: int = WORKERS) -> MediaExtractor:
+    """Extracts the media matching the filters (see select_media())
+
+    Returns:
+        MediaExtractor: With the written/skipped/failed counts
+    """
+    extractor = MediaExtractor(path, out_dir, workers)
+    extractor.run(select_media(path, user_id, since, until, tweet_id))
+    return extractor
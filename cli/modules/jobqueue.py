@@ -0,0 +1,399 @@
+"""Persistent job queue in the archive's SQLite file.
+
+Work that only lives in memory (executor futures, recursive calls) is
+lost when a process stops, and can't be shared: two processes given the
+same accounts would both crawl all of them. Jobs in the jobs table can
+be claimed by any number of worker threads, processes, or hosts sharing
+the DB file.
+
+A claim is a lease: the job is the worker's until lease_expires, which
+Worker extends while the job runs. If the worker dies, the lease runs
+out and another worker claims the job again. Claims run in BEGIN
+IMMEDIATE transactions, so a job is only ever leased to one worker at a
+time.
+
+Each claim counts as an attempt. A failed job is retried after an
+exponential backoff, until it has had max_attempts; then it's
+dead-lettered (state "dead") with its last error, until requeue_dead()
+puts it back. A job's (kind, key) is unique, so enqueuing work that's
+already queued does nothing.
+
+Hosts sharing a DB file need a filesystem with working POSIX locks
+(which many network filesystems lack); SQLite can't detect that.
+"""
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from loguru import logger
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 60 * 60
+POLL_INTERVAL = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    state TEXT NOT NULL DEFAULT 'ready',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs (state, priority, available_at);
+CREATE INDEX IF NOT EXISTS ix_jobs_lease ON jobs (state, lease_expires);
+"""
+
+
+class PermanentError(Exception):
+    """Raised by a handler for a job that can't succeed on retry; it's
+    dead-lettered straight away
+    """
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    key: str
+    payload: Any
+    attempts: int
+    max_attempts: int
+    owner: str
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """Thread-safe. Connections are opened per thread.
+
+    Args:
+        path (str): SQLite file, e.g. the archive DB
+        lease_seconds (int, optional): How long a claim lasts without
+        being extended
+    """
+    def __init__(self, path, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60,
+                                   isolation_level=None)
+            conn.execute("PRAGMA busy_timeout = 60000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers can't
+        # both read a job as claimable
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def enqueue(self, kind, key, payload=None, priority=0,
+                max_attempts=MAX_ATTEMPTS, delay=0, again=False):
+        """Adds a job, unless one with the same kind and key exists
+
+        Args:
+            kind (str): Handler name, e.g. "account" or "media"
+            key (str): Identifies the work within its kind, e.g. a URL
+            payload (optional): JSON-serializable arguments
+            priority (int, optional): Higher is claimed first
+            max_attempts (int, optional): Attempts before dead-lettering
+            delay (float, optional): Seconds before it can be claimed
+            again (bool, optional): Also reset a finished or dead job
+            with this kind and key to run again, e.g. a periodic crawl
+
+        Returns:
+            bool: Whether a job was added or reset
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            added = conn.execute(
+                "INSERT OR IGNORE INTO jobs (kind, key, payload, priority, max_attempts, available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",  # noqa
+                (kind, str(key), json.dumps(payload), priority, max_attempts,
+                 now + delay, now, now)).rowcount
+            if not added and again:
+                added = conn.execute(
+                    "UPDATE jobs SET state = 'ready', payload = ?, priority = ?, attempts = 0, max_attempts = ?, available_at = ?, last_error = NULL, updated_at = ? WHERE kind = ? AND key = ? AND state IN ('done', 'dead')",  # noqa
+                    (json.dumps(payload), priority, max_attempts, now + delay,
+                     now, kind, str(key))).rowcount
+        return bool(added)
+
+    def claim(self, owner=None, kinds=None, limit=1):
+        """Leases jobs that are ready, or whose lease has run out,
+        highest priority first
+
+        Args:
+            owner (str, optional): Worker name. Defaults to host:pid.
+            kinds (list[str], optional): Only these kinds
+            limit (int, optional): Max jobs
+
+        Returns:
+            list[Job]: Leased jobs, possibly none
+        """
+        owner = owner or default_owner()
+        now = time.time()
+        kind_filter = ""
+        params = [now, now]
+        if kinds:
+            kind_filter = f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params += list(kinds)
+        with self._transaction() as conn:
+            # workers that died with their last attempt leased
+            conn.execute("UPDATE jobs SET state = 'dead', last_error = coalesce(last_error, 'lease expired'), updated_at = ? WHERE state = 'leased' AND lease_expires <= ? AND attempts >= max_attempts", (now, now))  # noqa
+            rows = conn.execute(
+                f"SELECT id, kind, key, payload, attempts, max_attempts FROM jobs WHERE ((state = 'ready' AND available_at <= ?) OR (state = 'leased' AND lease_expires <= ?)){kind_filter} ORDER BY priority DESC, available_at LIMIT ?",  # noqa
+                params + [limit]).fetchall()
+            for row in rows:
+                conn.execute("UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",  # noqa
+                             (owner, now + self.lease_seconds, now, row[0]))
+        return [Job(id=row[0], kind=row[1], key=row[2],
+                    payload=json.loads(row[3]) if row[3] else None,
+                    attempts=row[4] + 1, max_attempts=row[5], owner=owner)
+                for row in rows]
+
+    def extend(self, jobs):
+        """Renews leases
+
+        Returns:
+            int: Leases still held by their owners
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            return sum(conn.execute("UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",  # noqa
+                                    (now + self.lease_seconds, now, job.id, job.owner)).rowcount  # noqa
+                       for job in jobs)
+
+    def complete(self, job):
+        """Marks a job done, if its owner still holds it
+
+        Returns:
+            bool: False if the lease was lost to another worker
+        """
+        with self._transaction() as conn:
+            return bool(conn.execute("UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires = NULL, last_error = NULL, updated_at = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",  # noqa
+                                     (time.time(), job.id, job.owner)).rowcount)  # noqa
+
+    def fail(self, job, error, retry=True):
+        """Schedules a retry after a backoff, or dead-letters the job
+        once it's out of attempts (or retry is False)
+
+        Returns:
+            str: The job's new state, or None if the lease was lost
+        """
+        now = time.time()
+        if retry and job.attempts < job.max_attempts:
+            state = "ready"
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (job.attempts - 1))  # noqa
+            available_at = now + delay * random.uniform(0.5, 1.5)
+        else:
+            state = "dead"
+            available_at = now
+        with self._transaction() as conn:
+            updated = conn.execute("UPDATE jobs SET state = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",  # noqa
+                                   (state, available_at, str(error)[:1000], now, job.id, job.owner)).rowcount  # noqa
+        return state if updated else None
+
+    def release(self, job):
+        """Gives a job back without counting the attempt, e.g. on
+        shutdown
+        """
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET state = 'ready', attempts = max(attempts - 1, 0), lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",  # noqa
+                         (time.time(), job.id, job.owner))
+
+    def requeue_dead(self, kind=None):
+        """Gives dead-lettered jobs a fresh set of attempts
+
+        Returns:
+            int: Jobs requeued
+        """
+        sql = "UPDATE jobs SET state = 'ready', attempts = 0, available_at = ?, updated_at = ? WHERE state = 'dead'"  # noqa
+        params = [time.time(), time.time()]
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def pending(self, kinds=None):
+        """Jobs that are ready, waiting for a retry, or leased, e.g. to
+        tell whether a crawl is finished
+
+        Returns:
+            int: Count
+        """
+        sql = "SELECT COUNT(*) FROM jobs WHERE state IN ('ready', 'leased')"
+        params = []
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params = list(kinds)
+        return self._conn().execute(sql, params).fetchone()[0]
+
+    def stats(self):
+        """Returns:
+            list: [kind, state, count] rows
+        """
+        return [list(row) for row in self._conn().execute("SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state ORDER BY kind, state")]  # noqa
+
+    def dead(self, kind=None, limit=20):
+        """Returns:
+            list: [kind, key, attempts, last_error] of dead-lettered jobs,
+            most recent first
+        """
+        sql = "SELECT kind, key, attempts, last_error FROM jobs WHERE state = 'dead'"  # noqa
+        params = []
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += " ORDER BY updated_at DESC LIMIT ?"
+        return [list(row) for row in self._conn().execute(sql, params + [limit])]  # noqa
+
+
+class Worker:
+    """Runs jobs from a queue on a pool of threads, extending their
+    leases while they run
+
+    Handlers take the job's payload. Returning marks the job done;
+    raising PermanentError dead-letters it, and any other exception
+    schedules a retry (see JobQueue.fail). retryable(e) can veto the
+    retry, e.g. for errors a handler doesn't raise as PermanentError but
+    that are known to be permanent. Jobs claimed after stop() aren't
+    run, but given back (see JobQueue.release).
+
+    Args:
+        queue (JobQueue): Queue
+        handlers (dict): Kind -> handler(payload)
+        threads (int, optional): Jobs run at once
+        retryable (callable, optional): exception -> bool
+        owner (str, optional): Defaults to host:pid
+    """
+    def __init__(self, queue, handlers, threads=8, retryable=None,
+                 owner=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.threads = threads
+        self.retryable = retryable
+        self.owner = owner or default_owner()
+        self.done = 0
+        self.failed = 0
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self, forever=False):
+        """Claims and runs jobs until none can be claimed and this
+        worker's running jobs (which may enqueue more) are finished, or
+        until stop() if forever. Jobs waiting for a retry are left to a
+        later run.
+        """
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        pool = [threading.Thread(target=self._loop, args=(forever,),
+                                 name=f"worker-{n}")
+                for n in range(self.threads)]
+        for thread in pool:
+            thread.start()
+        try:
+            for thread in pool:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in pool:
+                thread.join()
+        finally:
+            self._stop.set()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, forever):
+        kinds = list(self.handlers)
+        while not self._stop.is_set():
+            try:
+                jobs = self.queue.claim(self.owner, kinds)
+            except sqlite3.OperationalError as e:
+                # e.g. locked for longer than the busy timeout
+                logger.error(f"Claiming jobs: {e}")
+                self._stop.wait(POLL_INTERVAL)
+                continue
+            if not jobs:
+                with self._lock:
+                    idle = not self._running
+                if idle and not forever:
+                    return
+                self._stop.wait(POLL_INTERVAL)
+                continue
+            if self._stop.is_set():
+                # stopped while claiming
+                for job in jobs:
+                    self.queue.release(job)
+                return
+            self._run(jobs[0])
+
+    def _run(self, job):
+        with self._lock:
+            self._running[job.id] = job
+        try:
+            self.handlers[job.kind](job.payload)
+        except PermanentError as e:
+            with self._lock:
+                self.failed += 1
+            self.queue.fail(job, e, retry=False)
+            logger.error(f"Job {job.kind} {job.key}: {e}")
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            retry = self.retryable is None or self.retryable(e)
+            state = self.queue.fail(job, e, retry=retry)
+            logger.error(f"Job {job.kind} {job.key} (attempt {job.attempts}/{job.max_attempts}, now {state}): {e}")  # noqa
+        else:
+            with self._lock:
+                self.done += 1
+            self.queue.complete(job)
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._lock:
+                jobs = list(self._running.values())
+            if jobs:
+                try:
+                    self.queue.extend(jobs)
+                except sqlite3.Error as e:
+                    logger.error(f"Extending leases: {e}")
+
@@ -0,0 +1,153 @@
+"""Append-only journal of raw scraped objects.
+
+save_tweet flattens snscrape's Tweet/User objects into table columns and
+drops everything else, so a schema change would otherwise mean scraping
+everything again. The journal keeps every scraped tweet (with its nested
+users, quoted and retweeted tweets, media, ...) as one JSON line, so the
+archive can be rebuilt or upgraded offline by replaying it through the
+same save pipeline.
+
+Each run writes its own gzip-compressed JSONL file. Objects are encoded
+generically from their dataclass fields, tagged with their class name,
+so they can be turned back into snscrape objects on replay.
+"""
+import dataclasses
+import datetime
+import enum
+import glob
+import gzip
+import json
+import os
+import threading
+import zlib
+
+from loguru import logger
+
+COMPRESS_LEVEL = 6
+
+
+def encode(obj):
+    """Converts an snscrape object into JSON-serializable data
+
+    Args:
+        obj: Tweet, User, or any value found in their fields
+
+    Returns:
+        dict, list, str, int, float, bool, None: Encoded value
+    """
+    if dataclasses.is_dataclass(obj):
+        data = {"_type": type(obj).__name__}
+        for field in dataclasses.fields(obj):
+            data[field.name] = encode(getattr(obj, field.name))
+        return data
+    if isinstance(obj, datetime.datetime):
+        return {"_type": "datetime", "value": obj.isoformat()}
+    if isinstance(obj, enum.Enum):
+        return {"_type": type(obj).__name__, "_enum": obj.value}
+    if isinstance(obj, (list, tuple)):
+        return [encode(item) for item in obj]
+    if isinstance(obj, dict):
+        return {str(k): encode(v) for k, v in obj.items()}
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return str(obj)
+
+
+def decode(data, namespace):
+    """Inverse of encode()
+
+    Args:
+        data: Encoded value
+        namespace (module): Where to look up the classes, i.e.
+        snscrape.modules.twitter
+
+    Returns:
+        Decoded value. Objects whose class no longer exists are
+        returned as dicts. Unknown fields are dropped, and fields
+        added since the journal was written are left at their defaults
+        (or None).
+    """
+    if isinstance(data, list):
+        return [decode(item, namespace) for item in data]
+    if not isinstance(data, dict):
+        return data
+    type_name = data.get("_type")
+    if type_name == "datetime":
+        return datetime.datetime.fromisoformat(data["value"])
+    cls = getattr(namespace, type_name, None) if type_name else None
+    if cls is not None and "_enum" in data:
+        return cls(data["_enum"])
+    values = {k: decode(v, namespace) for k, v in data.items() if k != "_type"}  # noqa
+    if cls is None or not dataclasses.is_dataclass(cls):
+        return values
+    kwargs = {}
+    for field in dataclasses.fields(cls):
+        if field.name in values:
+            kwargs[field.name] = values[field.name]
+        elif field.default is dataclasses.MISSING and field.default_factory is dataclasses.MISSING:  # noqa
+            kwargs[field.name] = None
+    return cls(**kwargs)
+
+
+class Journal:
+    """Thread-safe writer for one journal file
+
+    Args:
+        directory (str): Journal directory, e.g. next to the DB
+        name (str): File name, without extension
+    """
+    def __init__(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.jsonl.gz")
+        self._file = gzip.open(self.path, "at", encoding="utf-8",
+                               compresslevel=COMPRESS_LEVEL)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, kind, obj):
+        """Appends an object to the journal
+
+        Args:
+            kind (str): e.g. "tweet"
+            obj: snscrape object
+        """
+        line = json.dumps({"kind": kind, "item": encode(obj)},
+                          ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def journal_files(directory):
+    """Lists a directory's journal files, oldest first
+    """
+    return sorted(glob.glob(os.path.join(directory, "*.jsonl.gz")))
+
+
+def read_journal(paths, namespace):
+    """Streams (kind, object) pairs from journal files. A file cut off
+    by a crash is read up to its last complete line.
+
+    Args:
+        paths (list[str]): Journal files, in the order to replay them
+        namespace (module): See decode()
+
+    Yields:
+        tuple: (kind, decoded object)
+    """
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping truncated line in {path}")  # noqa
+                        continue
+                    yield record["kind"], decode(record["item"], namespace)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            logger.warning(f"{path} ends early, probably from a crash: {e}")  # noqa
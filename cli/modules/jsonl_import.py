@@ -0,0 +1,158 @@
+"""Parsing of `snscrape --jsonl twitter-search` dumps for bulk import.
+
+Dumps are streamed in chunks of lines, which worker processes turn back
+into snscrape objects and then into archive rows with the same mapping
+save_tweet uses (see rows.py). The parent process only has to write the
+resulting rows, in one transaction per chunk.
+
+Plain, .gz, .bz2, .xz and .zst (requires zstandard) files are supported.
+"""
+import bz2
+import dataclasses
+import datetime
+import gzip
+import io
+import json
+import lzma
+
+from modules.rows import edge_rows, tweet_row, user_row, walk_tweets
+
+try:
+    import zstandard
+except ImportError:  # only needed for .zst dumps
+    zstandard = None
+
+CHUNK_LINES = 5000
+
+
+def open_dump(path):
+    """Opens a (possibly compressed) JSONL dump for reading as text
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed; run `pip install zstandard`")  # noqa
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)  # noqa
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def read_chunks(paths, size=CHUNK_LINES):
+    """Streams the lines of one or more dumps in chunks
+
+    Args:
+        paths (list[str]): Dump files
+        size (int, optional): Lines per chunk.
+
+    Yields:
+        list[str]: Non-empty lines
+    """
+    chunk = []
+    for path in paths:
+        with open_dump(path) as file:
+            for line in file:
+                if line.strip():
+                    chunk.append(line)
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def _is_datetime_field(field):
+    return field.type is datetime.datetime or "datetime" in str(field.type)  # noqa
+
+
+def decode_item(data, namespace, default=None):
+    """Rebuilds snscrape objects from snscrape's JSON output, which
+    tags each object with its class in "_type" and writes datetimes as
+    ISO strings
+
+    Args:
+        data: Decoded JSON value
+        namespace (module): snscrape.modules.twitter
+        default (type, optional): Class for an untagged top-level object
+
+    Returns:
+        Rebuilt object. Objects of unknown classes are returned as dicts.
+    """
+    if isinstance(data, list):
+        return [decode_item(item, namespace) for item in data]
+    if not isinstance(data, dict):
+        return data
+    type_name = data.get("_type")
+    cls = default
+    if type_name is not None:
+        cls = getattr(namespace, type_name.rsplit(".", 1)[-1], None)
+    if cls is None or not dataclasses.is_dataclass(cls):
+        return {k: decode_item(v, namespace) for k, v in data.items()}
+    kwargs = {}
+    for field in dataclasses.fields(cls):
+        value = data.get(field.name)
+        if isinstance(value, str) and _is_datetime_field(field):
+            value = datetime.datetime.fromisoformat(value)
+        elif field.name not in data and field.default is not dataclasses.MISSING:  # noqa
+            value = field.default
+        else:
+            value = decode_item(value, namespace)
+        kwargs[field.name] = value
+    return cls(**kwargs)
+
+
+def parse_chunk(lines, fetch=False):
+    """Worker process entry point: turns dump lines into rows
+
+    Args:
+        lines (list[str]): JSON lines, one tweet each
+        fetch (bool, optional): Also return the media and links to
+        fetch once the rows are written.
+
+    Returns:
+        dict: "tweets", "authors", "mentions" and "edges" row lists, plus
+        "media" [(tweet ID, media objects)], "links" [(tweet ID,
+        url)], "lines" and "errors" counts
+    """
+    import snscrape.modules.twitter as sntwitter
+
+    tweets = {}
+    authors = {}
+    mentions = {}
+    edges = []
+    media = []
+    links = []
+    errors = 0
+    for line in lines:
+        try:
+            tweet = decode_item(json.loads(line), sntwitter, sntwitter.Tweet)
+            for t in walk_tweets(tweet):
+                tweets[t.id] = tweet_row(t)
+                authors[t.user.id] = user_row(t.user)
+                edges.extend(edge_rows(t))
+                for user in t.mentionedUsers or []:
+                    # mentions usually carry only the ID and names;
+                    # those would be saved as near-empty profiles
+                    if getattr(user, "followersCount", None) is not None:
+                        mentions[user.id] = user_row(user)
+                if fetch:
+                    if t.media:
+                        media.append((t.id, t.media))
+                    if tweets[t.id]["links"] is not None:
+                        links.append((t.id, tweets[t.id]["links"]))
+        except Exception:
+            errors += 1
+    return {
+        "tweets": list(tweets.values()),
+        "authors": list(authors.values()),
+        "mentions": [row for id, row in mentions.items() if id not in authors],  # noqa
+        "edges": edges,
+        "media": media,
+        "links": links,
+        "lines": len(lines),
+        "errors": errors,
+    }
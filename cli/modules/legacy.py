@@ -0,0 +1,209 @@
+"""Conversion of archives written by docker/archiver.py to this schema.
+
+The legacy layout has wide tweets/users tables with tweet_*/user_*
+column names, and stores media inline: one BLOB per tweet in
+tweets.tweet_media_content_blob, and profile pictures and banners in
+users. Here, media is deduped by sha512 into media, and linked through
+media_tweets/media_users.
+
+Rows are read in keyset-paginated batches, so memory use depends on the
+batch size, not on the size of the archive.
+"""
+import sqlite3
+from datetime import datetime
+from hashlib import sha512
+
+BATCH_SIZE = 500
+
+
+def read_batches(path, table, key, batch_size=BATCH_SIZE):
+    """Streams a legacy table in batches, ordered by its primary key
+
+    Args:
+        path (str): Legacy DB file
+        table (str): "tweets" or "users"
+        key (str): Primary key column, "tweet_id" or "user_id"
+        batch_size (int, optional): Rows per batch.
+
+    Yields:
+        list[sqlite3.Row]: Rows
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    last = None
+    try:
+        while True:
+            if last is None:
+                rows = conn.execute(f"SELECT * FROM {table} ORDER BY {key} LIMIT ?", (batch_size,)).fetchall()  # noqa
+            else:
+                rows = conn.execute(f"SELECT * FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?", (last, batch_size)).fetchall()  # noqa
+            if len(rows) == 0:
+                return
+            last = rows[-1][key]
+            yield rows
+    finally:
+        conn.close()
+
+
+def count(path, table):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def parse_datetime(value):
+    """Legacy datetimes are str(datetime), e.g. 2022-01-01 12:00:00+00:00
+    """
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def media_row(blob, url=None, duration=None, views=None):
+    if blob is None or len(blob) == 0:
+        return None
+    if isinstance(blob, str):
+        blob = blob.encode("utf-8")
+    try:
+        duration = float(duration) if duration is not None else None
+    except (TypeError, ValueError):
+        duration = None
+    try:
+        views = int(views) if views is not None else None
+    except (TypeError, ValueError):
+        views = None
+    return dict(
+        id=sha512(blob).hexdigest(),
+        content_blob=blob,
+        alt_text=None,
+        duration=duration,
+        url=url,
+        views=views,
+        thumbnail_id=None,
+    )
+
+
+def convert_tweets(rows):
+    """Converts a batch of legacy tweets
+
+    The legacy archiver unpacked get_media()'s return values in the
+    wrong order, so its media columns are shifted: tweet_media_filename
+    holds the duration, tweet_media_duration the views, tweet_media_views
+    the URL and tweet_media_url the filename.
+
+    Args:
+        rows (list[sqlite3.Row]): Legacy tweets rows
+
+    Returns:
+        tuple: (tweets rows, media rows, media_tweets rows)
+    """
+    tweets = []
+    media = {}
+    media_tweets = []
+    for row in rows:
+        tweets.append(dict(
+            id=row["tweet_id"],
+            content=row["tweet_content"],
+            creation_datetime=parse_datetime(row["tweet_datetime"]),
+            conversation_id=row["tweet_conversation_id"],
+            hashtags=row["tweet_hashtags"],
+            language=row["tweet_language"],
+            latitude=row["tweet_latitude"],
+            longitude=row["tweet_longitude"],
+            like_count=row["tweet_like_count"],
+            links=None,
+            mentioned_users=row["tweet_mentioned_users"],
+            place_country=row["tweet_place_country"],
+            place_country_code=row["tweet_place_country_code"],
+            place_full_name=row["tweet_place_full_name"],
+            place_name=row["tweet_place_name"],
+            place_type=row["tweet_place_type"],
+            quote_count=row["tweet_quote_count"],
+            recount=row["tweet_retweet_count"],
+            replied_to_id=row["tweet_replied_to_tweet_id"],
+            reply_count=row["tweet_reply_count"],
+            source_app=row["tweet_source_app"],
+            url=row["tweet_url"],
+            user_id=row["tweet_user_id"],
+            username=row["tweet_user_name"],
+            vibe=None,
+            view_count=None,
+        ))
+        medium = media_row(row["tweet_media_content_blob"],
+                           url=row["tweet_media_views"],
+                           duration=row["tweet_media_filename"],
+                           views=row["tweet_media_duration"])
+        if medium is not None:
+            media[medium["id"]] = medium
+            media_tweets.append(dict(media_id=medium["id"],
+                                     tweet_id=row["tweet_id"]))
+    return tweets, list(media.values()), media_tweets
+
+
+def convert_edges(rows):
+    """Reply, quote and retweet edges of a batch of legacy tweets
+
+    Args:
+        rows (list[sqlite3.Row]): Legacy tweets rows
+
+    Returns:
+        list[dict]: TweetEdgeTable rows
+    """
+    edges = []
+    columns = [("tweet_replied_to_tweet_id", "reply"),
+               ("tweet_quoted_tweet_id", "quote"),
+               ("tweet_retweeted_tweet_id", "retweet")]
+    for row in rows:
+        for column, kind in columns:
+            if row[column] is not None:
+                edges.append(dict(child_id=row["tweet_id"],
+                                  parent_id=row[column],
+                                  kind=kind))
+    return edges
+
+
+def convert_users(rows):
+    """Converts a batch of legacy users
+
+    Args:
+        rows (list[sqlite3.Row]): Legacy users rows
+
+    Returns:
+        tuple: (users rows, media rows, media_users rows)
+    """
+    users = []
+    media = {}
+    media_users = []
+    for row in rows:
+        users.append(dict(
+            id=row["user_id"],
+            account_url=row["user_twitter_url"],
+            creation_datetime=parse_datetime(row["user_account_datetime_created"]),  # noqa
+            description=row["user_description"],
+            description_links=None,
+            display_name=row["user_display_name"],
+            favorites_count=row["user_favorites_count"],
+            followers_count=row["user_followers_count"],
+            friends_count=row["user_friends_count"],
+            label=row["user_label"],
+            links=row["user_linked_url"],
+            listed_count=row["user_listed_count"],
+            location=row["user_location"],
+            protected_account=row["user_account_protected"],
+            status_count=row["user_status_count"],
+            url=row["user_twitter_url"],
+            username=row["user_username"],
+            verified=row["user_verified"],
+        ))
+        for column in ("user_profile_picture", "user_profile_banner_picture"):
+            medium = media_row(row[column])
+            link = dict(media_id=medium["id"], user_id=row["user_id"]) if medium else None  # noqa
+            if link is not None and link not in media_users:
+                media[medium["id"]] = medium
+                media_users.append(link)
+    return users, list(media.values()), media_users
@@ -0,0 +1,377 @@
+"""Read-only access to an archive, for viewers and analysis scripts.
+
+Results are streamed: tweets are read in pages using keyset pagination
+on (creation_datetime, id), so each page costs the same however deep
+into an account it is, unlike OFFSET. Media BLOBs are only read when
+asked for, with media_content() or with_content=True.
+
+Threads and other reply/quote/retweet trees are read with one lookup
+in the tweet_closure table (see archiver.py) via subtree() and ancestors().
+
+user_as_of() reconstructs a user's profile at a given time from the
+deltas in user_snapshots (see snapshots.py).
+
+Compressed text columns are decompressed transparently (see
+compression.py). Datetimes are returned in UTC.
+
+    with ArchiveReader("archives/twitter_archive.db") as archive:
+        for tweet in archive.tweets_by_user("example1", since=datetime(2022, 1, 1)):
+            for media in archive.media_for_tweet(tweet.id):
+                data = archive.media_content(media.id)
+"""
+import dataclasses
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Union
+
+from modules import snapshots
+from modules.compression import load_dictionaries, register_sqlite_functions
+
+PAGE_SIZE = 500
+
+# Columns holding compressed text, read through zstd_decompress()
+COMPRESSED = {"content", "description"}
+
+
+@dataclass
+class Tweet:
+    id: int
+    content: Optional[str]
+    creation_datetime: Optional[datetime]
+    conversation_id: Optional[int]
+    hashtags: Optional[str]
+    language: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    like_count: Optional[int]
+    links: Optional[str]
+    mentioned_users: Optional[str]
+    place_country: Optional[str]
+    place_country_code: Optional[str]
+    place_full_name: Optional[str]
+    place_name: Optional[str]
+    place_type: Optional[str]
+    quote_count: Optional[int]
+    reply_count: Optional[int]
+    recount: Optional[int]
+    replied_to_id: Optional[int]
+    source_app: Optional[str]
+    url: Optional[str]
+    user_id: Optional[int]
+    username: Optional[str]
+    vibe: Optional[str]
+    view_count: Optional[int]
+
+
+@dataclass
+class Media:
+    id: str
+    alt_text: Optional[str]
+    duration: Optional[float]
+    url: Optional[str]
+    views: Optional[int]
+    thumbnail_id: Optional[str]
+    size: Optional[int]
+    content_blob: Optional[bytes] = None
+
+
+def to_db_datetime(value: datetime) -> str:
+    """Formats a datetime the way SQLAlchemy stores DateTime columns in
+    SQLite, so it can be compared with them. Aware datetimes are
+    converted to UTC first.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def from_db_datetime(value) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc)  # noqa
+    except ValueError:
+        return None
+
+
+def _select(cls, table):
+    columns = []
+    for field in dataclasses.fields(cls):
+        if field.name in COMPRESSED:
+            columns.append(f"zstd_decompress({table}.{field.name})")
+        else:
+            columns.append(f"{table}.{field.name}")
+    return ", ".join(columns)
+
+
+TWEET_COLUMNS = _select(Tweet, "tweets")
+MEDIA_COLUMNS = "media.id, media.alt_text, media.duration, media.url, media.views, media.thumbnail_id, length(media.content_blob)"  # noqa
+
+
+def _tweet(row) -> Tweet:
+    tweet = Tweet(*row)
+    tweet.creation_datetime = from_db_datetime(tweet.creation_datetime)
+    return tweet
+
+
+class ArchiveReader:
+    """Read-only connection to an archive. Not thread-safe: open one
+    per thread.
+
+    Args:
+        path (str): Archive DB file, e.g. archives/twitter_archive.db
+    """
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        register_sqlite_functions(self.conn)
+        load_dictionaries(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def user_id(self, username: str) -> Optional[int]:
+        """Looks up a user's ID by username (case-insensitive)
+        """
+        row = self.conn.execute("SELECT id FROM users WHERE username = ? COLLATE NOCASE", (username,)).fetchone()  # noqa
+        return row[0] if row else None
+
+    def user_as_of(self, user: Union[int, str],
+                   when: Optional[datetime] = None) -> Optional[dict]:
+        """Reconstructs a user's profile as it was archived at a moment:
+        the users row (the profile when first seen) with the changes
+        observed up to then applied. Before the first change, that's
+        the first-seen profile.
+
+        Args:
+            user (int, str): User ID or username
+            when (datetime, optional): Defaults to the latest profile
+
+        Returns:
+            dict: users columns, or None if the user isn't archived
+        """
+        if isinstance(user, str):
+            user = self.user_id(user)
+        cursor = self.conn.execute("SELECT *, zstd_decompress(description) AS description FROM users WHERE id = ?", (user,))  # noqa
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        names = [column[0] for column in cursor.description]
+        profile = dict(zip(names, row))
+        profile["creation_datetime"] = from_db_datetime(profile["creation_datetime"])  # noqa
+        sql = "SELECT changes FROM user_snapshots WHERE user_id = ?"
+        params = [user]
+        if when is not None:
+            sql += " AND observed_datetime <= ?"
+            params.append(to_db_datetime(when))
+        try:
+            deltas = [r[0] for r in self.conn.execute(sql + " ORDER BY observed_datetime", params)]  # noqa
+        except sqlite3.OperationalError:
+            # archives from before user_snapshots existed
+            deltas = []
+        return snapshots.apply(profile, deltas)
+
+    def tweets_by_user(self, user: Union[int, str],
+                       since: Optional[datetime] = None,
+                       until: Optional[datetime] = None,
+                       page_size: int = PAGE_SIZE) -> Iterator[Tweet]:
+        """Streams a user's tweets, oldest first
+
+        Args:
+            user (int, str): User ID or username
+            since (datetime, optional): Only tweets from this time on
+            until (datetime, optional): Only tweets before this time
+            page_size (int, optional): Rows read per query
+
+        Yields:
+            Tweet: Tweets
+        """
+        if isinstance(user, str):
+            user = self.user_id(user)
+            if user is None:
+                return
+        yield from self._tweets("tweets.user_id = ?", [user], since, until,
+                                page_size)
+
+    def tweets_between(self, since: Optional[datetime] = None,
+                       until: Optional[datetime] = None,
+                       page_size: int = PAGE_SIZE) -> Iterator[Tweet]:
+        """Streams every archived tweet in a date range, oldest first
+
+        Args:
+            since (datetime, optional): Only tweets from this time on
+            until (datetime, optional): Only tweets before this time
+            page_size (int, optional): Rows read per query
+
+        Yields:
+            Tweet: Tweets
+        """
+        yield from self._tweets("1", [], since, until, page_size)
+
+    def thread(self, conversation_id: int,
+               page_size: int = PAGE_SIZE) -> Iterator[Tweet]:
+        """Streams the archived tweets of a conversation, oldest first
+
+        Args:
+            conversation_id (int): Conversation ID, i.e. the ID of the
+            tweet that started it
+            page_size (int, optional): Rows read per query
+
+        Yields:
+            Tweet: Tweets
+        """
+        yield from self._tweets("tweets.conversation_id = ?",
+                                [conversation_id], None, None, page_size)
+
+    def search(self, query: str, user: Union[int, str, None] = None,
+               since: Optional[datetime] = None,
+               until: Optional[datetime] = None,
+               page_size: int = PAGE_SIZE) -> Iterator[Tweet]:
+        """Streams tweets whose content contains query (case-insensitive
+        for ASCII), oldest first. There's no full-text index, so this
+        scans the user's or date range's tweets.
+
+        Args:
+            query (str): Text to look for
+            user (int, str, optional): User ID or username
+            since (datetime, optional): Only tweets from this time on
+            until (datetime, optional): Only tweets before this time
+            page_size (int, optional): Rows read per query
+
+        Yields:
+            Tweet: Matching tweets
+        """
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"  # noqa
+        where = "zstd_decompress(tweets.content) LIKE ? ESCAPE '\\'"
+        params = [pattern]
+        if user is not None:
+            if isinstance(user, str):
+                user = self.user_id(user)
+                if user is None:
+                    return
+            where += " AND tweets.user_id = ?"
+            params.append(user)
+        yield from self._tweets(where, params, since, until, page_size)
+
+    def stats(self) -> dict:
+        """Row counts of the main tables, and the newest tweet's time
+
+        Returns:
+            dict: e.g. {"tweets": 1200, ..., "newest_tweet": datetime}
+        """
+        stats = {}
+        for table in ("tweets", "users", "media", "web_pages"):
+            try:
+                stats[table] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]  # noqa
+            except sqlite3.OperationalError:
+                stats[table] = 0
+        stats["newest_tweet"] = None
+        if stats["tweets"]:
+            newest = self.conn.execute("SELECT MAX(creation_datetime) FROM tweets").fetchone()[0]  # noqa
+            stats["newest_tweet"] = from_db_datetime(newest)
+        return stats
+
+    def subtree(self, tweet_id: int, kind: Optional[str] = None) -> Iterator[Tweet]:  # noqa
+        """Streams a tweet and every archived tweet below it: replies,
+        replies to those, quotes, retweets, ... oldest first. Uses
+        tweet_closure, so it's a single indexed lookup however deep.
+
+        Args:
+            tweet_id (int): Root tweet ID. Pass a conversation ID for
+            the whole thread.
+            kind (str, optional): Only tweets linked to their parent by
+            a "reply", "quote" or "retweet" edge. The closure doesn't
+            record kinds, so this checks each tweet's own edge: replies
+            to a quote of the root are returned with kind="reply".
+
+        Yields:
+            Tweet: Tweets
+        """
+        sql = f"SELECT {TWEET_COLUMNS} FROM tweet_closure JOIN tweets ON tweets.id = tweet_closure.descendant_id WHERE tweet_closure.ancestor_id = ?"  # noqa
+        params = [tweet_id]
+        if kind is not None:
+            sql += " AND (tweets.id = ? OR EXISTS (SELECT 1 FROM tweet_edges WHERE tweet_edges.child_id = tweets.id AND tweet_edges.kind = ?))"  # noqa
+            params += [tweet_id, kind]
+        for row in self.conn.execute(sql + " ORDER BY tweets.creation_datetime, tweets.id", params):  # noqa
+            yield _tweet(row)
+
+    def ancestors(self, tweet_id: int) -> List[Tweet]:
+        """Lists the archived tweets above a tweet, i.e. those it replies
+        to, quotes or retweets, and so on, root first
+
+        Args:
+            tweet_id (int): Tweet ID
+
+        Returns:
+            list[Tweet]: Tweets, not including tweet_id itself
+        """
+        rows = self.conn.execute(f"SELECT {TWEET_COLUMNS} FROM tweet_closure JOIN tweets ON tweets.id = tweet_closure.ancestor_id WHERE tweet_closure.descendant_id = ? AND tweet_closure.depth > 0 ORDER BY tweet_closure.depth DESC", (tweet_id,)).fetchall()  # noqa
+        return [_tweet(row) for row in rows]
+
+    def tweet(self, tweet_id: int) -> Optional[Tweet]:
+        row = self.conn.execute(f"SELECT {TWEET_COLUMNS} FROM tweets WHERE id = ?", (tweet_id,)).fetchone()  # noqa
+        return _tweet(row) if row else None
+
+    def media_for_tweet(self, tweet_id: int,
+                        with_content: bool = False) -> List[Media]:
+        """Lists a tweet's media
+
+        Args:
+            tweet_id (int): Tweet ID
+            with_content (bool, optional): Also read content_blob.
+            Otherwise it's left as None; see media_content().
+
+        Returns:
+            list[Media]: Media, without thumbnails' own rows
+        """
+        return self._media("media_tweets", "tweet_id", tweet_id, with_content)  # noqa
+
+    def media_for_user(self, user_id: int,
+                       with_content: bool = False) -> List[Media]:
+        """Lists a user's profile pictures and banners. See
+        media_for_tweet()
+        """
+        return self._media("media_users", "user_id", user_id, with_content)
+
+    def media_content(self, media_id: str) -> Optional[bytes]:
+        """Reads a media file's content
+
+        Args:
+            media_id (str): Media ID (sha512 of the content)
+
+        Returns:
+            bytes: Content, or None if there's no such media
+        """
+        row = self.conn.execute("SELECT content_blob FROM media WHERE id = ?", (media_id,)).fetchone()  # noqa
+        return bytes(row[0]) if row and row[0] is not None else None
+
+    def _media(self, link_table, key, value, with_content):
+        columns = MEDIA_COLUMNS + (", media.content_blob" if with_content else "")  # noqa
+        rows = self.conn.execute(f"SELECT {columns} FROM media JOIN {link_table} ON {link_table}.media_id = media.id WHERE {link_table}.{key} = ?", (value,)).fetchall()  # noqa
+        return [Media(*row) for row in rows]
+
+    def _tweets(self, where, params, since, until, page_size):
+        where = [where, "tweets.creation_datetime IS NOT NULL"]
+        params = list(params)
+        if since is not None:
+            where.append("tweets.creation_datetime >= ?")
+            params.append(to_db_datetime(since))
+        if until is not None:
+            where.append("tweets.creation_datetime < ?")
+            params.append(to_db_datetime(until))
+        sql = f"SELECT {TWEET_COLUMNS} FROM tweets WHERE {' AND '.join(where)}"  # noqa
+        order = "ORDER BY tweets.creation_datetime, tweets.id LIMIT ?"
+        rows = self.conn.execute(f"{sql} {order}", params + [page_size]).fetchall()  # noqa
+        while rows:
+            for row in rows:
+                yield _tweet(row)
+            if len(rows) < page_size:
+                return
+            last_datetime, last_id = rows[-1][2], rows[-1][0]
+            rows = self.conn.execute(f"{sql} AND (tweets.creation_datetime, tweets.id) > (?, ?) {order}", params + [last_datetime, last_id, page_size]).fetchall()  # noqa
@@ -0,0 +1,186 @@
+"""Mapping of snscrape objects to archive rows.
+
+save_tweet/save_user and the bulk importers share these, so a tweet
+ends up with the same columns whichever way it enters the archive. They
+have no side effects (no DB access, no downloads) and only depend on
+snscrape's objects, so they can also run in worker processes.
+"""
+
+
+def tweet_row(tweet):
+    """Columns of a TweetTable row
+
+    Args:
+        tweet (snscrape.Tweet): Tweet object
+
+    Returns:
+        dict: TweetTable column values
+    """
+    hashtags = tweet.hashtags
+    if hashtags is not None:
+        hashtags = ", ".join(str(tag) for tag in hashtags)
+
+    lat = None
+    lon = None
+    if tweet.coordinates is not None:
+        lat = tweet.coordinates.latitude
+        lon = tweet.coordinates.longitude
+
+    links = None
+    if tweet.links:
+        links = tweet.links[0].url
+
+    users_mentioned = None
+    if tweet.mentionedUsers is not None:
+        users_mentioned = ", ".join(str(user.username) for user in tweet.mentionedUsers)  # noqa
+
+    pl_country = None
+    pl_country_code = None
+    pl_full_name = None
+    pl_name = None
+    pl_type = None
+    if tweet.place is not None:
+        pl_country = tweet.place.country
+        pl_country_code = tweet.place.countryCode
+        pl_full_name = tweet.place.fullName
+        pl_name = tweet.place.name
+        pl_type = tweet.place.type
+
+    return dict(
+        id=tweet.id,
+        content=tweet.rawContent,
+        creation_datetime=tweet.date,
+        conversation_id=tweet.conversationId,
+        hashtags=hashtags,
+        language=tweet.lang,
+        latitude=lat,
+        longitude=lon,
+        like_count=tweet.likeCount,
+        links=links,
+        mentioned_users=users_mentioned,
+        place_country=pl_country,
+        place_country_code=pl_country_code,
+        place_full_name=pl_full_name,
+        place_name=pl_name,
+        place_type=pl_type,
+        quote_count=tweet.quoteCount,
+        recount=tweet.retweetCount,
+        replied_to_id=tweet.inReplyToTweetId,
+        reply_count=tweet.replyCount,
+        source_app=tweet.sourceLabel,
+        url=tweet.url,
+        user_id=tweet.user.id,
+        username=tweet.user.username,
+        vibe=tweet.vibe,
+        view_count=tweet.viewCount,
+    )
+
+
+def user_row(user):
+    """Columns of a UserTable row
+
+    Args:
+        user (snscrape.User): User object
+
+    Returns:
+        dict: UserTable column values
+    """
+    lbl = None
+    if user.label is not None:
+        lbl = user.label.description
+
+    description_links = None
+    if user.descriptionLinks:
+        description_links = user.descriptionLinks[0].url
+
+    links = None
+    if user.link is not None:
+        links = user.link.url
+
+    return dict(
+        id=user.id,
+        account_url=user.url,
+        creation_datetime=user.created,
+        description=user.renderedDescription,
+        description_links=description_links,
+        display_name=user.displayname,
+        favorites_count=user.favouritesCount,
+        followers_count=user.followersCount,
+        friends_count=user.friendsCount,
+        label=lbl,
+        links=links,
+        listed_count=user.listedCount,
+        location=user.location,
+        protected_account=user.protected,
+        status_count=user.statusesCount,
+        url=user.url,
+        username=user.username,
+        verified=user.verified,
+    )
+
+
+def walk_tweets(tweet):
+    """Yields a tweet and every full tweet nested in it (quoted and
+    retweeted tweets, recursively). TweetRefs, which only carry an ID,
+    are skipped.
+
+    Args:
+        tweet (snscrape.Tweet): Tweet object
+
+    Yields:
+        snscrape.Tweet: Tweet objects
+    """
+    stack = [tweet]
+    while stack:
+        tweet = stack.pop()
+        if tweet is None or not hasattr(tweet, "rawContent"):
+            continue
+        yield tweet
+        stack.append(tweet.quotedTweet)
+        stack.append(tweet.retweetedTweet)
+
+
+def edge_rows(tweet):
+    """Reply, quote and retweet edges from a tweet to the tweets it
+    refers to, as TweetEdgeTable rows
+
+    Args:
+        tweet (snscrape.Tweet): Tweet object
+
+    Returns:
+        list[dict]: child_id, parent_id and kind of each edge
+    """
+    edges = []
+    if tweet.inReplyToTweetId is not None:
+        edges.append(dict(child_id=tweet.id,
+                          parent_id=tweet.inReplyToTweetId,
+                          kind="reply"))
+    if tweet.quotedTweet is not None:
+        edges.append(dict(child_id=tweet.id,
+                          parent_id=tweet.quotedTweet.id,
+                          kind="quote"))
+    if tweet.retweetedTweet is not None:
+        edges.append(dict(child_id=tweet.id,
+                          parent_id=tweet.retweetedTweet.id,
+                          kind="retweet"))
+    return edges
+
+
+def metric_row(tweet):
+    """Engagement counts of a tweet, as a TweetMetricsTable row without
+    its observation time
+
+    Args:
+        tweet (snscrape.Tweet): Tweet object
+
+    Returns:
+        dict: tweet_id and counts
+    """
+    return dict(
+        tweet_id=tweet.id,
+        like_count=tweet.likeCount,
+        reply_count=tweet.replyCount,
+        quote_count=tweet.quoteCount,
+        recount=tweet.retweetCount,
+        view_count=tweet.viewCount,
+    )
@@ -0,0 +1,190 @@
+"""Fair-share scheduling of search work across accounts.
+
+Every account (and every time window of a large account) searches on
+its own thread, but has to take a turn before fetching each page of
+results, and only `slots` turns run at once. Turns go to the waiting
+account that has used the least of its share so far: its virtual time,
+which advances by 1 / weight per page. So an account with weight 2 gets
+twice the pages of one with weight 1, no account is starved by large
+ones, and small accounts finish early.
+
+Searches are newest first, so an account's first FRESH_PAGES pages hold
+its new tweets. Those are scheduled ahead of any other account's older
+tweets, highest priority first. As they're few, this can't starve
+anyone either.
+
+Accounts are configured in a TOML file:
+
+    [[accounts]]
+    name = "example1"
+    priority = 10   # optional, default 0
+    weight = 2      # optional, default 1
+
+    [accounts.media]    # optional; see modules/variants.py
+    max_height = 720
+"""
+import os
+import threading
+import time
+import tomllib
+from contextlib import contextmanager
+
+FRESH_PAGES = 5
+
+
+def load_accounts(path, default=()):
+    """Reads the accounts config
+
+    Args:
+        path (str): TOML file
+        default (list[str], optional): Account names to use, with
+        default priority and weight, if the file doesn't exist
+
+    Returns:
+        list[dict]: name, priority, weight and media (VariantPolicy
+        options) of each account, highest priority first
+    """
+    if path is not None and os.path.exists(path):
+        with open(path, "rb") as file:
+            entries = tomllib.load(file).get("accounts", [])
+    else:
+        entries = [{"name": name} for name in default]
+    accounts = []
+    for entry in entries:
+        weight = float(entry.get("weight", 1))
+        if weight <= 0:
+            raise ValueError(f"{path}: weight of {entry['name']} must be positive")  # noqa
+        media = entry.get("media", {})
+        if not isinstance(media, dict):
+            raise ValueError(f"{path}: media of {entry['name']} must be a table")  # noqa
+        accounts.append(dict(name=str(entry["name"]).lstrip("@"),
+                             priority=int(entry.get("priority", 0)),
+                             weight=weight,
+                             media=dict(media)))
+    return sorted(accounts, key=lambda a: -a["priority"])
+
+
+class _Account:
+    def __init__(self, name, priority, weight):
+        self.name = name
+        self.priority = priority
+        self.weight = weight
+        self.vtime = 0.0
+        self.pages = 0
+        self.waiting = 0
+        self.running = 0
+        self.seen = 0
+        self.expected = None
+        self.started = None
+        self.finished = None
+
+
+class FairScheduler:
+    """Args:
+        slots (int): Pages fetched at once, across all accounts
+    """
+    def __init__(self, slots):
+        self.slots = slots
+        self._free = slots
+        self._vtime = 0.0
+        self._accounts = {}
+        self._cond = threading.Condition()
+
+    def add(self, name, priority=0, weight=1.0):
+        with self._cond:
+            if name not in self._accounts:
+                self._accounts[name] = _Account(name, priority, weight)
+
+    def expect(self, name, total):
+        """Sets how many tweets an account is expected to have, for its
+        progress and ETA
+        """
+        with self._cond:
+            self._accounts[name].expected = total
+
+    def _next(self):
+        best = None
+        best_key = None
+        for account in self._accounts.values():
+            if account.waiting == 0:
+                continue
+            if account.pages < FRESH_PAGES:
+                key = (0, -account.priority, account.vtime)
+            else:
+                key = (1, account.vtime, -account.priority)
+            if best is None or key < best_key:
+                best = account
+                best_key = key
+        return best
+
+    @contextmanager
+    def turn(self, name):
+        """Blocks until it's the account's turn to fetch a page
+
+        Args:
+            name (str): Account, added with add()
+        """
+        with self._cond:
+            account = self._accounts[name]
+            if account.waiting == 0 and account.running == 0:
+                # an account that was idle doesn't get to catch up on
+                # the turns it didn't need
+                account.vtime = max(account.vtime, self._vtime)
+            if account.started is None:
+                account.started = time.monotonic()
+            account.waiting += 1
+            while self._free == 0 or self._next() is not account:
+                self._cond.wait()
+            account.waiting -= 1
+            account.running += 1
+            account.pages += 1
+            self._free -= 1
+            self._vtime = account.vtime
+        try:
+            yield
+        finally:
+            with self._cond:
+                account.running -= 1
+                account.vtime += 1 / account.weight
+                self._free += 1
+                self._cond.notify_all()
+
+    def count(self, name, n=1):
+        """Records tweets seen for an account
+        """
+        with self._cond:
+            self._accounts[name].seen += n
+
+    def finish(self, name):
+        with self._cond:
+            self._accounts[name].finished = time.monotonic()
+
+    def stats(self, limit=10):
+        """Progress of the accounts being archived, highest priority
+        first
+
+        Args:
+            limit (int, optional): Max accounts listed
+
+        Returns:
+            list: [name, seen, expected, percent, ETA in seconds] rows.
+            expected, percent and ETA are None if unknown.
+        """
+        rows = []
+        now = time.monotonic()
+        with self._cond:
+            accounts = [a for a in self._accounts.values()
+                        if a.started is not None and a.finished is None]
+        accounts.sort(key=lambda a: (-a.priority, a.name))
+        for account in accounts[:limit]:
+            percent = None
+            eta = None
+            if account.expected:
+                percent = min(100.0, 100.0 * account.seen / account.expected)  # noqa
+                elapsed = now - account.started
+                remaining = max(account.expected - account.seen, 0)
+                if account.seen > 0 and elapsed > 0:
+                    eta = remaining / (account.seen / elapsed)
+            rows.append([account.name, account.seen, account.expected,
+                         percent, eta])
+        return rows
@@ -0,0 +1,258 @@
+"""Integrity checks of an archive's contents, for `python main.py verify`.
+
+PRAGMA quick_check only covers SQLite's own structures. This checks
+what the archiver relies on:
+
+- every media row's content still hashes to its ID (the sha512 of the
+  content). Media are scanned in rowid order by several threads, each
+  streaming BLOBs in chunks through its own read-only connection, so
+  memory use doesn't depend on file sizes. Reads are limited to `rate`
+  bytes per second, so a scrub can run alongside the archiver.
+  Progress is saved to a file next to the DB after every page of rows,
+  so an interrupted scrub resumes where it stopped.
+- link tables and references point at existing rows (LINK_CHECKS), and
+  which media aren't referenced at all.
+
+With repair, broken links are deleted or cleared, and media whose
+content doesn't match are queued as "media-repair" jobs, which
+re-download them (see archiver.py). Links to tweets or users that
+aren't archived are only reported: media and webpages are saved just
+before their tweet, so they're expected while the archiver runs.
+"""
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha512
+
+from loguru import logger
+
+WORKERS = 4
+CHUNK_SIZE = 1024 * 1024
+PAGE_SIZE = 500
+# Bytes read per second while scrubbing media, 0 for no limit
+RATE = 100 * 1024 * 1024
+
+# (table, column, referenced table, referenced column, repair):
+# "delete" deletes the row, "null" clears the column, None only reports
+LINK_CHECKS = [
+    ("media_tweets", "media_id", "media", "id", "delete"),
+    ("media_tweets", "tweet_id", "tweets", "id", None),
+    ("media_users", "media_id", "media", "id", "delete"),
+    ("media_users", "user_id", "users", "id", None),
+    ("webpages_tweets", "webpage_id", "web_pages", "id", "delete"),
+    ("webpages_tweets", "tweet_id", "tweets", "id", None),
+    ("webpages_users", "webpage_id", "web_pages", "id", "delete"),
+    ("webpages_users", "user_id", "users", "id", None),
+    ("media", "thumbnail_id", "media", "id", "null"),
+    ("web_pages", "duplicate_of", "web_pages", "id", "null"),
+    ("user_snapshots", "user_id", "users", "id", "delete"),
+    ("tweet_metrics", "tweet_id", "tweets", "id", "delete"),
+]
+
+ORPHAN_MEDIA = """
+SELECT COUNT(*) FROM media
+WHERE NOT EXISTS (SELECT 1 FROM media_tweets WHERE media_tweets.media_id = media.id)
+AND NOT EXISTS (SELECT 1 FROM media_users WHERE media_users.media_id = media.id)
+AND NOT EXISTS (SELECT 1 FROM media AS parent WHERE parent.thumbnail_id = media.id)
+"""  # noqa
+
+
+class RateLimiter:
+    """Spaces out reads to an average of `rate` bytes per second,
+    across threads
+
+    Args:
+        rate (int): Bytes per second. 0 or None for no limit.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def take(self, n):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + n / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+def check_links(conn, repair=False, samples=5):
+    """Runs LINK_CHECKS and counts unreferenced media
+
+    Args:
+        conn (sqlite3.Connection): Archive; writable if repair
+        repair (bool, optional): Delete or clear the broken references
+        samples (int, optional): Example values reported per check
+
+    Returns:
+        list[dict]: check, count, examples and repaired rows of each
+        check that found problems
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}  # noqa
+    columns = {table: {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}  # noqa
+               for table in tables}
+    problems = []
+    for table, column, target, target_column, fix in LINK_CHECKS:
+        if table not in tables or target not in tables or column not in columns[table]:  # noqa
+            continue
+        broken = f'"{table}"."{column}" IS NOT NULL AND NOT EXISTS (SELECT 1 FROM "{target}" AS target WHERE target."{target_column}" = "{table}"."{column}")'  # noqa
+        count = conn.execute(f'SELECT COUNT(*) FROM "{table}" WHERE {broken}').fetchone()[0]  # noqa
+        if not count:
+            continue
+        examples = [row[0] for row in conn.execute(f'SELECT DISTINCT "{column}" FROM "{table}" WHERE {broken} LIMIT ?', (samples,))]  # noqa
+        repaired = 0
+        if repair and fix == "delete":
+            with conn:
+                repaired = conn.execute(f'DELETE FROM "{table}" WHERE {broken}').rowcount  # noqa
+        elif repair and fix == "null":
+            with conn:
+                repaired = conn.execute(f'UPDATE "{table}" SET "{column}" = NULL WHERE {broken}').rowcount  # noqa
+        problems.append(dict(check=f"{table}.{column} -> {target}.{target_column}",  # noqa
+                             count=count, examples=examples, repaired=repaired))  # noqa
+    if {"media", "media_tweets", "media_users"} <= tables:
+        count = conn.execute(ORPHAN_MEDIA).fetchone()[0]
+        if count:
+            problems.append(dict(check="media not linked to any tweet or user",  # noqa
+                                 count=count, examples=[], repaired=0))
+    return problems
+
+
+class MediaScrubber:
+    """Checks that media content hashes to its ID
+
+    Args:
+        path (str): Archive DB file
+        workers (int, optional): Threads hashing at once
+        rate (int, optional): Bytes read per second, 0 for no limit
+        on_mismatch (callable, optional): Called with (media ID, URL)
+        for each media whose content doesn't match, e.g. to queue a
+        repair
+        progress_path (str, optional): Where progress is saved.
+        Defaults to the DB file + ".verify.json".
+    """
+    def __init__(self, path, workers=WORKERS, rate=RATE, on_mismatch=None,
+                 progress_path=None):
+        self.path = path
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.on_mismatch = on_mismatch
+        self.progress_path = progress_path or path + ".verify.json"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.bytes = 0
+        self.mismatched = []
+        self.failed = 0
+        self.resumed_from = 0
+
+    def _connection(self):
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)  # noqa
+        return self._local.conn
+
+    def _load(self):
+        try:
+            with open(self.progress_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return 0
+        self.checked = state.get("checked", 0)
+        self.bytes = state.get("bytes", 0)
+        self.mismatched = state.get("mismatched", [])
+        return state.get("rowid", 0)
+
+    def _save(self, rowid):
+        state = dict(rowid=rowid, checked=self.checked, bytes=self.bytes,
+                     mismatched=self.mismatched)
+        partial = self.progress_path + ".part"
+        with open(partial, "w") as file:
+            json.dump(state, file)
+        os.replace(partial, self.progress_path)
+
+    def check_one(self, rowid, media_id, url):
+        """Hashes one media BLOB in chunks
+
+        Returns:
+            bool: Whether it matches its ID
+        """
+        digest = sha512()
+        size = 0
+        with self._connection().blobopen("media", "content_blob", rowid, readonly=True) as blob:  # noqa
+            while True:
+                chunk = blob.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.limiter.take(len(chunk))
+                digest.update(chunk)
+                size += len(chunk)
+        matches = digest.hexdigest() == media_id
+        with self._lock:
+            self.checked += 1
+            self.bytes += size
+            # a resumed scrub may check again pages checked after the
+            # saved position
+            if not matches and media_id not in self.mismatched:
+                self.mismatched.append(media_id)
+        if not matches:
+            logger.warning(f"Media {media_id} doesn't match its content ({size:,} bytes, {url})")  # noqa
+            if self.on_mismatch is not None:
+                self.on_mismatch(media_id, url)
+        return matches
+
+    def _check_page(self, rows):
+        for rowid, media_id, url in rows:
+            try:
+                self.check_one(rowid, media_id, url)
+            except Exception as e:
+                logger.error(f"Could not read media {media_id}: {e}")
+                with self._lock:
+                    self.failed += 1
+
+    def run(self, restart=False):
+        """Scrubs every media row with content, resuming from the last
+        saved position unless restart. Progress is deleted once the
+        scrub completes, so the next run starts over.
+        """
+        last = 0 if restart else self._load()
+        if restart:
+            self.checked = self.bytes = 0
+            self.mismatched = []
+        self.resumed_from = last
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        # pages finish out of order; progress only advances past pages
+        # whose predecessors are all done
+        order = collections.deque()
+        finished = set()
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def page_done(end):
+            with self._lock:
+                finished.add(end)
+                while order and order[0] in finished:
+                    finished.discard(order[0])
+                    self._save(order.popleft())
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="verify") as executor:
+            while True:
+                rows = conn.execute("SELECT rowid, id, url FROM media WHERE rowid > ? AND content_blob IS NOT NULL ORDER BY rowid LIMIT ?", (last, PAGE_SIZE)).fetchall()  # noqa
+                if not rows:
+                    break
+                last = rows[-1][0]
+                slots.acquire()
+                with self._lock:
+                    order.append(last)
+                future = executor.submit(self._check_page, rows)
+                future.add_done_callback(lambda _, end=last: page_done(end))  # noqa
+        conn.close()
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
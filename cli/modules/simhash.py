@@ -0,0 +1,73 @@
+"""SimHash fingerprints for finding near-duplicate webpages.
+
+Syndicated articles and mirrored posts differ only in their boilerplate,
+so their texts share most of their word 3-grams. A SimHash is a 64-bit
+fingerprint in which each bit is the weighted majority vote of that bit
+across the hashes of a text's 3-grams, so similar texts get
+fingerprints that differ in only a few bits (Charikar 2002; Manku et
+al. 2007 use 64 bits and a distance of 3 for web pages).
+
+To find fingerprints within a distance d < BANDS without comparing
+against every page, each is split into BANDS bands of 64 / BANDS bits:
+two fingerprints at most d bits apart must have at least one identical
+band, so candidates are looked up by band and then checked in full.
+"""
+from collections import Counter
+from hashlib import blake2b
+
+BITS = 64
+BANDS = 4
+SHINGLE = 3
+# Shorter texts (error pages, "enable JavaScript", ...) say too little to
+# be told apart, and aren't fingerprinted
+MIN_WORDS = 50
+
+_MASK = (1 << BITS) - 1
+_BAND_BITS = BITS // BANDS
+
+
+def fingerprint(text):
+    """SimHash of a text's word 3-grams, case-insensitive
+
+    Args:
+        text (str): Plaintext
+
+    Returns:
+        int: Unsigned 64-bit fingerprint, or None if the text has fewer
+        than MIN_WORDS words
+    """
+    words = (text or "").lower().split()
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = Counter(" ".join(words[i:i + SHINGLE])
+                       for i in range(len(words) - SHINGLE + 1))
+    votes = [0] * BITS
+    for shingle, weight in shingles.items():
+        h = int.from_bytes(blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")  # noqa
+        for bit in range(BITS):
+            if h >> bit & 1:
+                votes[bit] += weight
+            else:
+                votes[bit] -= weight
+    return sum(1 << bit for bit in range(BITS) if votes[bit] > 0)
+
+
+def distance(a, b):
+    """Number of differing bits between two fingerprints, signed or not
+    """
+    return ((a ^ b) & _MASK).bit_count()
+
+
+def bands(value):
+    """Splits a fingerprint into BANDS values, lowest bits first
+    """
+    value &= _MASK
+    return [value >> (band * _BAND_BITS) & ((1 << _BAND_BITS) - 1)
+            for band in range(BANDS)]
+
+
+def to_signed(value):
+    """Maps an unsigned 64-bit fingerprint onto SQLite's signed 64-bit
+    INTEGER range
+    """
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
@@ -0,0 +1,94 @@
+"""History of user profiles, stored as deltas.
+
+The users table keeps each profile as it was first seen. Whenever a
+user is seen again while archiving (as the author of a tweet), the
+fields that differ from the last known profile are written to
+user_snapshots with the time of the observation, as a JSON object. An
+unchanged profile writes nothing, so the history costs a row per change
+rather than per sighting.
+
+A profile as of any moment is its users row with every delta up to that
+moment applied in order. Fields an observation doesn't include (None)
+are treated as unobserved, not as cleared.
+"""
+import json
+
+# user_row() fields whose changes are recorded. id and creation_datetime
+# can't change
+TRACKED = (
+    "account_url",
+    "description",
+    "description_links",
+    "display_name",
+    "favorites_count",
+    "followers_count",
+    "friends_count",
+    "label",
+    "links",
+    "listed_count",
+    "location",
+    "protected_account",
+    "status_count",
+    "url",
+    "username",
+    "verified",
+)
+
+
+def snapshot_value(value):
+    """Normalizes a value the way it reads back from the DB, so an
+    unchanged field compares equal: booleans are stored in String
+    columns as "1"/"0"
+    """
+    if isinstance(value, bool):
+        return str(int(value))
+    return value
+
+
+def profile(row):
+    """Tracked fields of a user_row() dict or users row
+
+    Args:
+        row (dict): Column values
+
+    Returns:
+        dict: Normalized values of TRACKED fields
+    """
+    return {name: snapshot_value(row.get(name)) for name in TRACKED}
+
+
+def changes(known, observed):
+    """Fields of an observation that differ from the known profile
+
+    Args:
+        known (dict): Last known profile, from profile()/apply()
+        observed (dict): New observation, from profile()
+
+    Returns:
+        dict: Changed fields and their new values, empty if none
+    """
+    return {name: value for name, value in observed.items()
+            if value is not None and known.get(name) != value}
+
+
+def apply(base, deltas):
+    """Reconstructs a profile
+
+    Args:
+        base (dict): The users row's profile
+        deltas (iterable[dict | str]): Changes, oldest first, as dicts
+        or as stored (JSON)
+
+    Returns:
+        dict: Profile after the changes
+    """
+    result = dict(base)
+    for delta in deltas:
+        if isinstance(delta, str):
+            delta = json.loads(delta)
+        result.update(delta)
+    return result
+
+
+def encode(delta):
+    return json.dumps(delta, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,386 @@
+"""Static HTML site for browsing an archive, for `python main.py site`.
+
+The site has an index of accounts, a page per account (profile and
+months), a timeline page per account and month, and a page per thread
+(conversation with more than one archived tweet). Media are extracted
+next to the pages, named by their ID like `extract` does, so a file is
+written once however many pages show it.
+
+Builds are incremental. Each page has a digest of what it shows: the
+IDs of its tweets and their media, the threads it links to, and for
+account pages the months, profile changes and profile pictures. A
+tweet's content never changes once archived, so its ID stands for it.
+The digests are computed with a few scans of the tweets table and its
+indexes, without rendering anything, and compared with those of the
+last build, kept in OUT_DIR/.manifest.db. Only pages whose digest
+changed (or whose file is missing) are rendered again, and pages that
+no longer exist are deleted. The manifest is committed every
+BATCH_SIZE pages, so an interrupted build picks up where it stopped.
+
+Pages are rendered on a thread pool, each thread reading through its
+own connection.
+"""
+import html
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from hashlib import blake2b
+from itertools import islice
+
+from loguru import logger
+
+from modules.extract import MediaExtractor
+from modules.reader import ArchiveReader
+
+WORKERS = 8
+BATCH_SIZE = 1000
+# Part of every digest: bump it when the templates change, so every page
+# is rendered again
+RENDER_VERSION = 1
+MANIFEST = ".manifest.db"
+IMAGE_EXTENSIONS = (".jpg", ".png", ".gif", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm")
+
+_MASK = (1 << 64) - 1
+
+STYLE = """body { font-family: sans-serif; max-width: 44em; margin: 0 auto; padding: 1em; color: #222; }
+nav { margin-bottom: 1em; }
+article { border-bottom: 1px solid #ddd; padding: 0.8em 0; }
+article header, article footer { color: #666; font-size: 0.9em; }
+article p { white-space: pre-wrap; overflow-wrap: anywhere; }
+.media img, .media video { max-width: 100%; max-height: 30em; margin: 0.2em 0; }
+.profile img { max-height: 8em; margin-right: 0.5em; }
+table td { padding: 0.1em 1em 0.1em 0; }
+"""  # noqa
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<link rel="stylesheet" href="{root}style.css">
+</head>
+<body>
+<nav><a href="{root}index.html">Accounts</a></nav>
+{body}
+</body>
+</html>
+"""
+
+
+def _hash(*values):
+    return int.from_bytes(blake2b(repr(values).encode("utf-8"), digest_size=8).digest(), "big")  # noqa
+
+
+def _month_path(user_id, month):
+    return f"accounts/{user_id}/{month}.html"
+
+
+def _thread_path(conversation_id):
+    # threads are sharded, since there can be millions
+    return f"threads/{conversation_id % 1000:03d}/{conversation_id}.html"
+
+
+def _next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return datetime(year + number // 12, number % 12 + 1, 1)
+
+
+def _text(value):
+    return html.escape(str(value)) if value is not None else ""
+
+
+class SiteBuilder:
+    """Builds or updates the site in out_dir
+
+    Args:
+        path (str): Archive DB file
+        out_dir (str): Site directory
+        workers (int, optional): Pages rendered at once
+        full (bool, optional): Render every page, ignoring the manifest
+    """
+    def __init__(self, path, out_dir, workers=WORKERS, full=False):
+        self.path = path
+        self.out_dir = out_dir
+        self.workers = workers
+        self.full = full
+        self.extractor = MediaExtractor(path, os.path.join(out_dir, "media"), workers)  # noqa
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # conversation ID -> digest, of conversations with a thread page
+        self.threads = {}
+        # (user ID, month) -> tweet count
+        self.months = {}
+        # user ID -> months with tweets, oldest first
+        self.accounts = {}
+        # user ID -> latest username
+        self.usernames = {}
+        self.rendered = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.failed = 0
+
+    def _reader(self):
+        if not hasattr(self._local, "reader"):
+            self._local.reader = ArchiveReader(self.path)
+        return self._local.reader
+
+    def plan(self, conn):
+        """Computes the digest of every page the site should have
+
+        Args:
+            conn (sqlite3.Connection): Archive
+
+        Returns:
+            dict: Page path -> (digest, kind, key)
+        """
+        # Conversations, in index order so each one's rows are adjacent
+        rows = conn.execute("SELECT tweets.conversation_id, tweets.id, media_tweets.media_id FROM tweets LEFT JOIN media_tweets ON media_tweets.tweet_id = tweets.id WHERE tweets.conversation_id IS NOT NULL AND tweets.creation_datetime IS NOT NULL ORDER BY tweets.conversation_id")  # noqa
+        current, count, total, last = None, 0, 0, None
+        for conversation_id, tweet_id, media_id in rows:
+            if conversation_id != current:
+                if count > 1:
+                    self.threads[current] = total
+                current, count, total, last = conversation_id, 0, 0, None
+            if tweet_id != last:
+                count += 1
+                last = tweet_id
+            total = (total + _hash(tweet_id, media_id)) & _MASK
+        if count > 1:
+            self.threads[current] = total
+
+        # Timelines, in table order: grouped in memory, as there are far
+        # fewer months than tweets
+        digests = {}
+        rows = conn.execute("SELECT tweets.user_id, substr(tweets.creation_datetime, 1, 7), tweets.id, tweets.conversation_id, media_tweets.media_id FROM tweets LEFT JOIN media_tweets ON media_tweets.tweet_id = tweets.id WHERE tweets.user_id IS NOT NULL AND tweets.creation_datetime IS NOT NULL")  # noqa
+        last = None
+        for user_id, month, tweet_id, conversation_id, media_id in rows:
+            key = (user_id, month)
+            if tweet_id != last:
+                self.months[key] = self.months.get(key, 0) + 1
+                last = tweet_id
+            thread = conversation_id if conversation_id in self.threads else None  # noqa
+            digests[key] = (digests.get(key, 0) + _hash(tweet_id, media_id, thread)) & _MASK  # noqa
+
+        accounts = self.accounts
+        for user_id, month in sorted(self.months):
+            accounts.setdefault(user_id, []).append(month)
+        profiles = {user_id: _hash(user_id) for user_id in accounts}
+        for user_id, username in conn.execute("SELECT id, username FROM users"):  # noqa
+            if user_id in accounts:
+                self.usernames[user_id] = username
+        try:
+            for user_id, count, newest in conn.execute("SELECT user_id, COUNT(*), MAX(observed_datetime) FROM user_snapshots GROUP BY user_id"):  # noqa
+                if user_id in profiles:
+                    profiles[user_id] = (profiles[user_id] + _hash(count, newest)) & _MASK  # noqa
+            for user_id, changes in conn.execute("SELECT user_id, json_extract(changes, '$.username') FROM user_snapshots WHERE json_extract(changes, '$.username') IS NOT NULL ORDER BY observed_datetime"):  # noqa
+                if user_id in accounts:
+                    self.usernames[user_id] = changes
+        except sqlite3.OperationalError:
+            # archives from before user_snapshots existed
+            pass
+        for user_id, media_id in conn.execute("SELECT user_id, media_id FROM media_users"):  # noqa
+            if user_id in profiles:
+                profiles[user_id] = (profiles[user_id] + _hash(media_id)) & _MASK  # noqa
+
+        pages = {}
+
+        def add(path, digest, kind, key):
+            pages[path] = (f"{RENDER_VERSION}:{digest:016x}", kind, key)
+
+        index = 0
+        for user_id, months in accounts.items():
+            total = profiles[user_id]
+            for n, month in enumerate(months):
+                around = (months[n - 1] if n else None,
+                          months[n + 1] if n + 1 < len(months) else None)
+                add(_month_path(user_id, month),
+                    (digests[(user_id, month)] + _hash(around, self.usernames.get(user_id))) & _MASK,  # noqa
+                    "month", (user_id, month, around))
+                total = (total + _hash(month, self.months[(user_id, month)])) & _MASK  # noqa
+            add(f"accounts/{user_id}/index.html", total, "account", user_id)  # noqa
+            index = (index + _hash(user_id, self.usernames.get(user_id), sum(self.months[(user_id, month)] for month in months))) & _MASK  # noqa
+        for conversation_id, digest in self.threads.items():
+            add(_thread_path(conversation_id), digest, "thread", conversation_id)  # noqa
+        add("index.html", index, "index", None)
+        return pages
+
+    def build(self):
+        """Renders the pages that changed since the last build, and
+        deletes those that no longer exist
+        """
+        os.makedirs(self.extractor.out_dir, exist_ok=True)
+        manifest = sqlite3.connect(os.path.join(self.out_dir, MANIFEST))
+        manifest.execute("CREATE TABLE IF NOT EXISTS pages (path TEXT PRIMARY KEY, digest TEXT NOT NULL)")  # noqa
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            pages = self.plan(conn)
+        finally:
+            conn.close()
+        built = {} if self.full else dict(manifest.execute("SELECT path, digest FROM pages"))  # noqa
+        stale = [(path, page) for path, page in pages.items()
+                 if built.get(path) != page[0]
+                 or not os.path.exists(os.path.join(self.out_dir, path))]
+        self.unchanged = len(pages) - len(stale)
+        logger.info(f"{len(stale):,} of {len(pages):,} pages to render")
+
+        self._write("style.css", STYLE)
+        gone = [path for path in built if path not in pages]
+        for path in gone:
+            try:
+                os.remove(os.path.join(self.out_dir, path))
+            except FileNotFoundError:
+                pass
+        with manifest:
+            manifest.executemany("DELETE FROM pages WHERE path = ?", [(path,) for path in gone])  # noqa
+        self.removed = len(gone)
+
+        stale = iter(stale)
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="site") as executor:
+            while True:
+                batch = list(islice(stale, BATCH_SIZE))
+                if not batch:
+                    break
+                done = [path for path, ok in zip((path for path, _ in batch), executor.map(self._render, batch)) if ok]  # noqa
+                with manifest:
+                    manifest.executemany("INSERT OR REPLACE INTO pages (path, digest) VALUES (?, ?)", [(path, pages[path][0]) for path in done])  # noqa
+                logger.info(f"Rendered {self.rendered:,} pages")
+        manifest.close()
+
+    def _render(self, item):
+        path, (_, kind, key) = item
+        try:
+            if kind == "month":
+                body, title = self.render_month(*key)
+            elif kind == "thread":
+                body, title = self.render_thread(key)
+            elif kind == "account":
+                body, title = self.render_account(key)
+            else:
+                body, title = self.render_index()
+            root = "../" * path.count("/")
+            self._write(path, PAGE.format(title=_text(title), root=root, body=body))  # noqa
+        except Exception as e:
+            logger.error(f"Could not render {path}: {e}")
+            with self._lock:
+                self.failed += 1
+            return False
+        with self._lock:
+            self.rendered += 1
+        return True
+
+    def _write(self, path, text):
+        target = os.path.join(self.out_dir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = target + ".part"
+        with open(partial, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(partial, target)
+
+    def _media_file(self, media_id):
+        """Extracts a media file if it isn't already
+
+        Returns:
+            str: Path relative to the site, or None if the media has no
+            content
+        """
+        row = self._reader().conn.execute("SELECT rowid, length(content_blob) FROM media WHERE id = ? AND content_blob IS NOT NULL", (media_id,)).fetchone()  # noqa
+        if row is None:
+            return None
+        name = self.extractor.extract_one(row[0], media_id, row[1])
+        return f"media/{name}" if name else None
+
+    def _media_html(self, media, root):
+        file = self._media_file(media.id)
+        if file is None:
+            return f'<a href="{_text(media.url)}">{_text(media.url)}</a>'
+        alt = _text(media.alt_text)
+        if file.endswith(IMAGE_EXTENSIONS):
+            return f'<a href="{root}{file}"><img src="{root}{file}" alt="{alt}" loading="lazy"></a>'  # noqa
+        if file.endswith(VIDEO_EXTENSIONS):
+            poster = self._media_file(media.thumbnail_id) if media.thumbnail_id else None  # noqa
+            poster = f' poster="{root}{poster}"' if poster else ""
+            return f'<video src="{root}{file}" controls preload="none"{poster}></video>'  # noqa
+        return f'<a href="{root}{file}">{_text(media.url)}</a>'
+
+    def _tweet_html(self, tweet, root, thread_link=True):
+        month = f"{tweet.creation_datetime:%Y-%m}"
+        account = f"{root}{_month_path(tweet.user_id, month)}#t{tweet.id}"
+        media = "".join(self._media_html(m, root) for m in self._reader().media_for_tweet(tweet.id))  # noqa
+        counts = [f"{tweet.reply_count or 0:,} replies",
+                  f"{tweet.recount or 0:,} retweets",
+                  f"{tweet.quote_count or 0:,} quotes",
+                  f"{tweet.like_count or 0:,} likes"]
+        if thread_link and tweet.conversation_id in self.threads:
+            counts.append(f'<a href="{root}{_thread_path(tweet.conversation_id)}#t{tweet.id}">thread</a>')  # noqa
+        return (f'<article id="t{tweet.id}">'
+                f'<header><a href="{account}">@{_text(tweet.username)}</a> · '
+                f'<a href="{_text(tweet.url)}">{tweet.creation_datetime:%Y-%m-%d %H:%M} UTC</a></header>'  # noqa
+                f"<p>{_text(tweet.content)}</p>"
+                + (f'<div class="media">{media}</div>' if media else "")
+                + f"<footer>{' · '.join(counts)}</footer></article>")
+
+    def render_month(self, user_id, month, around):
+        root = "../../"
+        since = datetime.fromisoformat(month + "-01")
+        tweets = self._reader().tweets_by_user(user_id, since=since,
+                                               until=_next_month(month))
+        body = [self._tweet_html(tweet, root) for tweet in tweets]
+        username = self.usernames.get(user_id, user_id)
+        links = [f'<a href="index.html">@{_text(username)}</a>']
+        if around[0]:
+            links.append(f'<a href="{around[0]}.html">{around[0]}</a>')
+        if around[1]:
+            links.append(f'<a href="{around[1]}.html">{around[1]}</a>')
+        title = f"@{username}, {month}"
+        return f"<h1>{_text(title)}</h1><p>{' · '.join(links)}</p>" + "".join(body), title  # noqa
+
+    def render_thread(self, conversation_id):
+        body = [self._tweet_html(tweet, "../../", thread_link=False)
+                for tweet in self._reader().thread(conversation_id)]
+        title = f"Thread {conversation_id}"
+        return f"<h1>{title}</h1>" + "".join(body), title
+
+    def render_account(self, user_id):
+        reader = self._reader()
+        profile = reader.user_as_of(user_id) or {}
+        username = profile.get("username") or user_id
+        pictures = "".join(f'<img src="../../{file}" alt="">' for file in (self._media_file(m.id) for m in reader.media_for_user(user_id)) if file)  # noqa
+        fields = [("Name", profile.get("display_name")),
+                  ("Bio", profile.get("description")),
+                  ("Location", profile.get("location")),
+                  ("Joined", profile.get("creation_datetime")),
+                  ("Followers", profile.get("followers_count")),
+                  ("Following", profile.get("friends_count")),
+                  ("Tweets", profile.get("status_count")),
+                  ("Profile", profile.get("account_url"))]
+        rows = "".join(f"<tr><td>{name}</td><td>{_text(value)}</td></tr>"
+                       for name, value in fields if value is not None)
+        links = "".join(f'<tr><td><a href="{month}.html">{month}</a></td><td>{self.months[(user_id, month)]:,}</td></tr>' for month in self.accounts.get(user_id, []))  # noqa
+        title = f"@{username}"
+        return (f"<h1>{_text(title)}</h1>"
+                f'<div class="profile">{pictures}</div><table>{rows}</table>'
+                f"<h2>Archived tweets</h2><table>{links}</table>"), title
+
+    def render_index(self):
+        counts = {}
+        for (user_id, month), count in self.months.items():
+            counts[user_id] = counts.get(user_id, 0) + count
+        rows = "".join(f'<tr><td><a href="accounts/{user_id}/index.html">@{_text(self.usernames.get(user_id, user_id))}</a></td><td>{count:,}</td></tr>' for user_id, count in sorted(counts.items(), key=lambda item: -item[1]))  # noqa
+        return f"<h1>Accounts</h1><table>{rows}</table>", "Archive"
+
+
+def build_site(path: str, out_dir: str, workers: int = WORKERS,
+               full: bool = False) -> SiteBuilder:
+    """Builds or updates the site (see SiteBuilder)
+
+    Returns:
+        SiteBuilder: With the rendered/unchanged/removed/failed counts
+    """
+    builder = SiteBuilder(path, out_dir, workers, full)
+    builder.build()
+    return builder
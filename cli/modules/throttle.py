@@ -0,0 +1,241 @@
+"""Adaptive, rate-limit-aware concurrency control.
+
+Each kind of remote call (search pagination, single-tweet lookups, the
+media CDN, linked webpages) gets its own AdaptiveLimiter: a token bucket
+bounding the request rate, plus a cap on requests in flight. Both adapt
+AIMD-style, like TCP congestion control. Every fast, successful call nudges
+them up additively, and every 429/5xx response (or a call slower than
+SLOW_CALL) halves them. Throttled calls are retried with full-jitter
+exponential backoff instead of being dropped.
+"""
+import random
+import re
+import threading
+import time
+import urllib.error
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+SLOW_CALL = 30.0
+# Calls in flight when throttling starts all fail together; only the
+# first failure in this window counts as a decrease
+DECREASE_INTERVAL = 2.0
+
+# snscrape retries 429s and 5xxs itself, then raises "N requests to ...
+# failed, giving up."
+THROTTLE_PATTERN = re.compile(r"\b(429|50[0-4])\b|too many requests|rate.?limit|failed, giving up", re.IGNORECASE)  # noqa
+
+
+def is_throttled(e):
+    """Whether an exception means the remote side is throttling us or
+    overloaded, i.e. the call should be retried more slowly
+
+    Args:
+        e (Exception): Exception raised by a call
+
+    Returns:
+        bool: True for HTTP 429 and 5xx, and scraper errors mentioning them
+    """
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code == 429 or e.code >= 500
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    return THROTTLE_PATTERN.search(str(e)) is not None
+
+
+class TokenBucket:
+    """Thread-safe token bucket
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (float): Max tokens, i.e. the burst size
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Rate and concurrency limit for one kind of remote call
+
+    Args:
+        name (str): Shown in the stats output
+        rate (float): Initial requests/sec
+        limit (int): Initial requests in flight
+        max_rate (float): Upper bound for rate
+        max_limit (int): Upper bound for limit
+    """
+    def __init__(self, name, rate, limit, max_rate, max_limit):
+        self.name = name
+        self.max_rate = max_rate
+        self.max_limit = max_limit
+        self.min_rate = 0.1
+        self.min_limit = 1
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.bucket = TokenBucket(rate, max(1.0, rate))
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _acquire(self, token=True):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        if token:
+            self.bucket.acquire()
+
+    def _release(self, latency, throttled, adjust=True):
+        with self._cond:
+            self.in_flight -= 1
+            if not adjust and not throttled:
+                # not a request of its own (see iterate()), or one that
+                # failed for a reason other than throttling
+                self._cond.notify_all()
+                return
+            self.calls += 1
+            if throttled or latency > SLOW_CALL:
+                self.throttled += 1
+                now = time.monotonic()
+                if now - self._last_decrease < DECREASE_INTERVAL:
+                    self._cond.notify_all()
+                    return
+                # multiplicative decrease
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+            else:
+                # additive increase: about +1 per `limit` successful calls
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)  # noqa
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + 0.1)  # noqa
+            self._cond.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) within the limits, retrying with
+        jittered exponential backoff while it's being throttled
+
+        Raises:
+            Exception: Whatever fn raised, if it isn't a throttling error
+            or still fails after MAX_RETRIES retries
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time.monotonic()
+            throttled = False
+            adjust = True
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttled(e)
+                # a 404 or a parse error says nothing about the load on
+                # the remote side, and mustn't count as a fast success
+                adjust = throttled
+                if not throttled or attempt >= MAX_RETRIES:
+                    raise
+            finally:
+                self._release(time.monotonic() - start, throttled, adjust)
+            attempt += 1
+            self.retries += 1
+            self.backoff(attempt)
+
+    def backoff(self, attempt):
+        """Sleeps for a full-jitter exponential backoff interval
+
+        Args:
+            attempt (int): Retry number, starting at 1
+        """
+        time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))  # noqa
+
+    def iterate(self, iterable, page_size=1):
+        """Yields from an iterable, running each next() call (which may
+        fetch another page of results) within the limits. Throttling
+        errors are raised to the caller, which can resume from the last
+        item it received.
+
+        Args:
+            iterable (iterable): e.g. a scraper's get_items()
+            page_size (int, optional): Items per request; a token is
+            taken, and the limits adapted, once per page. The other
+            next() calls only return buffered items, and counting them
+            as fast successful requests would raise the limits
+            page_size times too quickly. Defaults to 1.
+        """
+        iterator = iter(iterable)
+        count = 0
+        while True:
+            request = count % page_size == 0
+            self._acquire(token=request)
+            count += 1
+            start = time.monotonic()
+            throttled = False
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                throttled = is_throttled(e)
+                if not throttled:
+                    request = False
+                raise
+            finally:
+                self._release(time.monotonic() - start, throttled,
+                              adjust=request)
+            yield item
+
+
+class ConcurrencyController:
+    """One AdaptiveLimiter per kind of remote call
+    """
+    def __init__(self):
+        self.limiters = {
+            "search": AdaptiveLimiter("search", rate=2, limit=4, max_rate=50, max_limit=12),  # noqa
+            "tweet": AdaptiveLimiter("tweet", rate=2, limit=4, max_rate=20, max_limit=16),  # noqa
+            "media": AdaptiveLimiter("media", rate=10, limit=8, max_rate=100, max_limit=32),  # noqa
+            "webpage": AdaptiveLimiter("webpage", rate=2, limit=4, max_rate=20, max_limit=16),  # noqa
+        }
+
+    def __getitem__(self, name):
+        return self.limiters[name]
+
+    def stats(self):
+        """Current limits, for the stats output
+
+        Returns:
+            list[list]: [name, limit, in flight, req/sec, throttled] rows
+        """
+        return [[limiter.name,
+                 int(limiter.limit),
+                 limiter.in_flight,
+                 round(limiter.rate, 1),
+                 limiter.throttled,
+                 ] for limiter in self.limiters.values()]
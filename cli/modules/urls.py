@@ -0,0 +1,117 @@
+"""URL canonicalization for webpage dedupe.
+
+Webpages are keyed on sha512(url), so the same article reached through a
+short link, with tracking parameters, or over http and https would
+otherwise be captured several times. canonicalize() normalizes a URL
+without any network access; resolve() additionally expands known URL
+shorteners by following their redirects. Resolved URLs are cached in the
+archive's url_redirects table (see archiver.py) so each short link costs at
+most one round trip, ever.
+"""
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+TIMEOUT = 10
+USER_AGENT = "Mozilla/5.0 (compatible; twitter-account-archiver)"
+
+SHORTENER_HOSTS = {
+    "t.co", "bit.ly", "buff.ly", "dlvr.it", "fb.me", "goo.gl", "ift.tt",
+    "is.gd", "lnkd.in", "ow.ly", "tinyurl.com", "trib.al", "wp.me",
+    "youtu.be", "amzn.to", "apple.co", "spoti.fi", "redd.it", "bit.do",
+}
+
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "gclsrc", "msclkid", "yclid", "igshid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "ref_src", "ref_url", "cmpid",
+    "ncid", "ocid", "smid", "smtyp", "mkt_tok", "wt.mc_id", "xtor",
+}
+TRACKING_PREFIXES = ("utm_", "__twitter_impression")
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize(url):
+    """Normalizes a URL: http becomes https, the host is lowercased,
+    default ports, fragments, tracking parameters and trailing slashes
+    are removed, and the remaining query parameters are sorted
+
+    Args:
+        url (str): URL
+
+    Returns:
+        str: Canonical URL. Non-http(s) URLs are returned unchanged
+    """
+    url = str(url).strip()
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return url
+
+    host = (parts.hostname or "").rstrip(".")
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS
+        and not k.lower().startswith(TRACKING_PREFIXES)
+    ]
+    query = urlencode(sorted(query), doseq=True)
+
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def is_short_url(url):
+    return (urlsplit(str(url)).hostname or "").lower() in SHORTENER_HOSTS
+
+
+def expand(url, timeout=TIMEOUT):
+    """Follows a URL's redirects, trying a HEAD request first and
+    falling back to GET for servers that reject HEAD
+
+    Args:
+        url (str): URL
+        timeout (int, optional): Socket timeout in seconds.
+
+    Returns:
+        str: Final URL after redirects
+    """
+    headers = {"User-Agent": USER_AGENT}
+    try:
+        request = urllib.request.Request(url, headers=headers, method="HEAD")
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.geturl()
+    except urllib.error.HTTPError as e:
+        if e.code not in (403, 405, 501):
+            return e.geturl() or url
+    request = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.geturl()
+
+
+def resolve(url, timeout=TIMEOUT):
+    """Canonicalizes a URL, expanding it first if it's a known short
+    link
+
+    Args:
+        url (str): URL
+        timeout (int, optional): Socket timeout in seconds.
+
+    Raises:
+        urllib.error.URLError: The short link couldn't be expanded
+
+    Returns:
+        str: Canonical URL
+    """
+    if is_short_url(url):
+        url = expand(str(url), timeout)
+    return canonicalize(url)
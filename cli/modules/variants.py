@@ -0,0 +1,87 @@
+"""Choosing which variant of a video or GIF to download.
+
+Twitter usually offers a video as several MP4s at different bitrates,
+plus an HLS (m3u8) playlist that needs ffmpeg. The first variant isn't
+reliably the best one, nor always one we want: it may be the playlist,
+or a far larger file than needed. VariantPolicy picks among them:
+
+- direct MP4 over HLS, unless prefer_mp4 is off
+- the highest bitrate (then resolution) within max_bitrate/max_height
+- nothing larger than max_bytes, estimated from bitrate x duration
+
+HLS playlists have no bitrate, so the limits can't be checked for them.
+With prefer_mp4 on, they're only used for videos without any MP4.
+"""
+import re
+
+from modules.budget import estimate_size
+
+HLS_TYPES = ("application/x-mpegurl", "application/vnd.apple.mpegurl")
+RESOLUTION = re.compile(r"/(\d+)x(\d+)/")
+
+
+def is_hls(variant):
+    content_type = (variant.contentType or "").lower()
+    return content_type in HLS_TYPES or ".m3u8" in (variant.url or "")
+
+
+def resolution(variant):
+    """Width and height of a variant, parsed from its URL (e.g.
+    .../vid/1280x720/...mp4)
+
+    Returns:
+        tuple: (width, height), or None if the URL doesn't say
+    """
+    match = RESOLUTION.search(variant.url or "")
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+class VariantPolicy:
+    """Args:
+        prefer_mp4 (bool, optional): Take a direct MP4 over HLS if
+        there's one within the limits
+        max_bitrate (int, optional): Bits per second
+        max_height (int, optional): Pixels along the shorter side, e.g.
+        720, so portrait videos are treated like landscape ones
+        max_bytes (int, optional): Skip videos whose every variant is
+        estimated to be larger than this
+    """
+    def __init__(self, prefer_mp4=True, max_bitrate=None, max_height=None,
+                 max_bytes=None):
+        self.prefer_mp4 = prefer_mp4
+        self.max_bitrate = max_bitrate
+        self.max_height = max_height
+        self.max_bytes = max_bytes
+
+    def allows(self, variant, duration):
+        if self.max_bitrate and variant.bitrate and variant.bitrate > self.max_bitrate:  # noqa
+            return False
+        size = resolution(variant)
+        if self.max_height and size and min(size) > self.max_height:
+            return False
+        estimate = estimate_size(variant.bitrate, duration)
+        if self.max_bytes and estimate and estimate > self.max_bytes:
+            return False
+        return True
+
+    def choose(self, variants, duration=None):
+        """Picks the variant to download
+
+        Args:
+            variants (list[snscrape.VideoVariant]): Offered variants
+            duration (float, optional): Video length in seconds
+
+        Returns:
+            snscrape.VideoVariant: Chosen variant, or None if none is
+            within the limits
+        """
+        allowed = [v for v in variants or [] if v.url and self.allows(v, duration)]  # noqa
+        mp4 = [v for v in allowed if not is_hls(v)]
+        hls = [v for v in allowed if is_hls(v)]
+        allowed = (mp4 or hls) if self.prefer_mp4 else (hls or mp4)
+        if not allowed:
+            return None
+        return max(allowed, key=lambda v: (v.bitrate or 0, resolution(v) or (0, 0)))  # noqa
+
@@ -0,0 +1,460 @@
+"""Background capture of webpages linked from tweets and user profiles.
+
+save_webpage only records that a page exists; WebpageArchiver then
+fetches it on its own thread pool, so tweet ingestion never waits on
+slow websites. Each page is streamed to a spooled temp file, then stored
+as gzip-compressed WARC response and request records alongside its html
+and plaintext.
+
+Decoding HTML, converting it to plaintext and fingerprinting it (see
+simhash.py) is CPU-bound, and would hold the GIL against every other
+thread of the archiver. WebpageArchiver runs it in a pool of
+extract_processes processes instead, while the fetching thread waits.
+
+Politeness: at most MAX_PER_DOMAIN requests run against the same host at
+once, and consecutive requests to a host are spaced DOMAIN_DELAY seconds
+apart. That state is kept for the MAX_DOMAINS most recently used hosts;
+idle hosts beyond that are forgotten.
+
+Given a modules.budget.ByteBudget, a fetch reserves the page's expected
+in-memory footprint before reading its body, and holds it until
+on_capture has stored the page.
+"""
+import base64
+import collections
+import gzip
+import hashlib
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from modules import simhash
+
+WORKERS = 8
+MAX_PER_DOMAIN = 2
+DOMAIN_DELAY = 1.0
+MAX_DOMAINS = 10000
+TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+MAX_BYTES = 50 * 1024 * 1024
+SPOOL_SIZE = 1024 * 1024
+USER_AGENT = "Mozilla/5.0 (compatible; twitter-account-archiver)"
+# Bytes held in memory per body byte: the raw and decoded html, its
+# plaintext and the compressed WARC record
+MEMORY_FACTOR = 3
+
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML to plaintext converter. Skips scripts, styles
+    and other non-visible elements, and starts a new line for block
+    elements.
+    """
+    SKIP = {"script", "style", "noscript", "template", "head", "svg"}
+    BLOCK = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5",
+             "h6", "article", "section", "blockquote", "pre"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._skip_depth = 0
+        self._lines = []
+        self._line = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip_depth += 1
+        elif tag in self.BLOCK:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip_depth > 0:
+            self._skip_depth -= 1
+        elif tag in self.BLOCK:
+            self._newline()
+
+    def handle_data(self, data):
+        if self._skip_depth == 0:
+            self._line.append(data)
+
+    def _newline(self):
+        line = " ".join("".join(self._line).split())
+        if line:
+            self._lines.append(line)
+        self._line = []
+
+    def text(self):
+        self.close()
+        self._newline()
+        return "\n".join(self._lines)
+
+
+class Capture:
+    """Result of fetching a single webpage
+    """
+    def __init__(self, url):
+        self.url = url
+        self.status = None
+        self.content_type = None
+        self.warc = None
+        self.html = None
+        self.plaintext = None
+        self.pdf = None
+        self.simhash = None
+        self.reservation = None
+        # raw HTML and its charset, until extract() has run
+        self.body = None
+        self.charset = None
+
+    def release(self):
+        """Returns the capture's bytes to the budget it was fetched under
+        """
+        if self.reservation is not None:
+            self.reservation.release()
+
+
+def warc_header(fields, length):
+    """WARC/1.0 record header
+
+    Args:
+        fields (list[tuple]): (name, value) pairs, after WARC-Type
+        length (int): Length of the record's block
+
+    Returns:
+        bytes: Header, including the blank line that ends it
+    """
+    lines = ["WARC/1.0"]
+    lines.extend(f"{name}: {value}" for name, value in fields)
+    lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+
+
+def sha1_label(digest):
+    """Formats a hashlib.sha1 as a WARC digest, e.g. sha1:3I42H3S6..."""
+    return "sha1:" + base64.b32encode(digest.digest()).decode("ascii")
+
+
+def request_head(request):
+    """HTTP request line and headers of a urllib Request
+
+    Returns:
+        bytes: As sent, ending with a blank line
+    """
+    parts = urlsplit(request.full_url)
+    target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    lines = [f"{request.get_method()} {target} HTTP/1.1",
+             f"Host: {parts.netloc}"]
+    lines.extend(f"{k}: {v}" for k, v in request.header_items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", "replace")  # noqa
+
+
+def warc_record(url, http_head, body_file, body_length, block_digest,
+                payload_digest=None, request=None):
+    """Writes a gzip-compressed WARC/1.0 response record, followed by
+    the request record it answers if request is given. Each record is
+    a gzip member of its own, as WARC readers expect.
+
+    Args:
+        url (str): Target URI
+        http_head (bytes): HTTP status line and headers
+        body_file (file): Response body, positioned at its start
+        body_length (int): Body length in bytes
+        block_digest (hashlib.sha1): Digest of http_head + body
+        payload_digest (hashlib.sha1, optional): Digest of the body
+        request (bytes, optional): HTTP request, see request_head()
+
+    Returns:
+        bytes: gzip members containing the records
+    """
+    record_id = f"<urn:uuid:{uuid.uuid4()}>"
+    date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    fields = [
+        ("WARC-Type", "response"),
+        ("WARC-Record-ID", record_id),
+        ("WARC-Date", date),
+        ("WARC-Target-URI", url),
+        ("WARC-Block-Digest", sha1_label(block_digest)),
+    ]
+    if payload_digest is not None:
+        fields.append(("WARC-Payload-Digest", sha1_label(payload_digest)))
+    fields.append(("Content-Type", "application/http; msgtype=response"))
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as out:
+        with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            gz.write(warc_header(fields, len(http_head) + body_length))
+            gz.write(http_head)
+            shutil.copyfileobj(body_file, gz, CHUNK_SIZE)
+            gz.write(b"\r\n\r\n")
+        if request is not None:
+            with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+                gz.write(warc_header([
+                    ("WARC-Type", "request"),
+                    ("WARC-Record-ID", f"<urn:uuid:{uuid.uuid4()}>"),
+                    ("WARC-Date", date),
+                    ("WARC-Target-URI", url),
+                    ("WARC-Concurrent-To", record_id),
+                    ("WARC-Block-Digest", sha1_label(hashlib.sha1(request))),  # noqa
+                    ("Content-Type", "application/http; msgtype=request"),
+                ], len(request)))
+                gz.write(request)
+                gz.write(b"\r\n\r\n")
+        out.seek(0)
+        return out.read()
+
+
+def extract(body, charset):
+    """Decodes an HTML page and extracts its text and fingerprint. Runs
+    in a worker process, so it only takes and returns plain values.
+
+    Args:
+        body (bytes): Raw HTML
+        charset (str): From the Content-Type header
+
+    Returns:
+        tuple: (html, plaintext, SimHash fingerprint or None)
+    """
+    try:
+        html = body.decode(charset, "replace")
+    except LookupError:
+        html = body.decode("utf-8", "replace")
+    extractor = TextExtractor()
+    extractor.feed(html)
+    plaintext = extractor.text()
+    return html, plaintext, simhash.fingerprint(plaintext)
+
+
+def fetch(url, timeout=TIMEOUT, max_bytes=MAX_BYTES, budget=None,
+          extract_text=True):
+    """Downloads a webpage, streaming the body to a spooled temp file
+
+    Args:
+        url (str): Webpage URL
+        timeout (int, optional): Socket timeout in seconds.
+        max_bytes (int, optional): Bodies are truncated at this size.
+        budget (modules.budget.ByteBudget, optional): Reserved from
+        before the body is read. Call the capture's release() once it's
+        stored.
+        extract_text (bool, optional): Extract an HTML page's text here.
+        If False, the raw page is left in capture.body for extract().
+
+    Returns:
+        Capture: Captured page
+    """
+    capture = Capture(url)
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})  # noqa
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        if budget is not None:
+            expected = None
+            if response.headers.get("Content-Length", "").isdigit():
+                expected = min(int(response.headers["Content-Length"]), max_bytes) * MEMORY_FACTOR  # noqa
+            capture.reservation = budget.reserve(expected)
+        try:
+            _read(capture, response, max_bytes, request_head(request))
+        except Exception:
+            capture.release()
+            raise
+    if extract_text and capture.body is not None:
+        capture.html, capture.plaintext, capture.simhash = extract(
+            capture.body, capture.charset)
+        capture.body = None
+    return capture
+
+
+def _read(capture, response, max_bytes, request=None):
+    """Reads fetch()'s response into capture
+    """
+    url = capture.url
+    capture.status = response.status
+    capture.content_type = response.headers.get_content_type()
+    charset = response.headers.get_content_charset() or "utf-8"
+    head = [f"HTTP/1.1 {response.status} {response.reason}"]
+    head.extend(f"{k}: {v}" for k, v in response.headers.items())
+    http_head = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1", "replace")  # noqa
+    block_digest = hashlib.sha1(http_head)
+    payload_digest = hashlib.sha1()
+
+    is_html = capture.content_type in ("text/html", "application/xhtml+xml")  # noqa
+
+    length = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as body:
+        while length < max_bytes:
+            chunk = response.read(min(CHUNK_SIZE, max_bytes - length))
+            if not chunk:
+                break
+            length += len(chunk)
+            if capture.reservation is not None:
+                capture.reservation.grow(length * MEMORY_FACTOR)
+            body.write(chunk)
+            block_digest.update(chunk)
+            payload_digest.update(chunk)
+        body.seek(0)
+        if capture.content_type == "application/pdf":
+            capture.pdf = body.read()
+            body.seek(0)
+        elif is_html:
+            capture.body = body.read()
+            capture.charset = charset
+            body.seek(0)
+        capture.warc = warc_record(url, http_head, body, length, block_digest,  # noqa
+                                   payload_digest, request)
+
+
+class WebpageArchiver:
+    """Fetches webpages on a background thread pool and hands each
+    capture to on_capture(webpage_id, capture). Pages are deduped by
+    webpage ID, so a page linked from many tweets is fetched once.
+
+    Args:
+        on_capture (callable): Called with (webpage_id, Capture) from a
+        worker thread once a page has been fetched
+        on_error (callable, optional): Called with (webpage_id, url,
+        exception) when a fetch fails
+        workers (int, optional): Concurrent fetches across all domains
+        limiter (modules.throttle.AdaptiveLimiter, optional): Applied to
+        every fetch, on top of the per-domain limits
+        budget (modules.budget.ByteBudget, optional): See fetch()
+        extract_processes (int, optional): Processes extracting text
+        from HTML. 0 extracts on the fetching thread.
+    """
+    def __init__(self, on_capture, on_error=None, workers=WORKERS,
+                 limiter=None, budget=None, extract_processes=0):
+        self.on_capture = on_capture
+        self.on_error = on_error
+        self.limiter = limiter
+        self.budget = budget
+        self.extract_processes = extract_processes
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="webpage")
+        self._extractor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        # host -> [semaphore, lock, last request time, requests using it]
+        self._domains = collections.OrderedDict()
+
+    def submit(self, webpage_id, url):
+        """Queues a webpage for capture. Returns immediately.
+
+        Args:
+            webpage_id (str): sha512 ID of the web_pages row
+            url (str): Webpage URL
+
+        Returns:
+            bool: False if the page is already queued or not http(s)
+        """
+        if urlsplit(str(url)).scheme not in ("http", "https"):
+            return False
+        with self._lock:
+            if webpage_id in self._pending:
+                return False
+            self._pending.add(webpage_id)
+        self._executor.submit(self._run, webpage_id, str(url))
+        return True
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            extractor, self._extractor = self._extractor, None
+        if extractor is not None:
+            extractor.shutdown(wait=wait)
+
+    def _extract(self, capture):
+        if capture.body is None:
+            return
+        if self.extract_processes > 0:
+            with self._lock:
+                if self._extractor is None:
+                    # spawned rather than forked: forking a process
+                    # with this many threads can copy held locks
+                    self._extractor = ProcessPoolExecutor(
+                        self.extract_processes,
+                        mp_context=multiprocessing.get_context("spawn"))
+                extractor = self._extractor
+            try:
+                result = extractor.submit(extract, capture.body,
+                                          capture.charset).result()
+            except BrokenProcessPool as e:
+                # a worker died (e.g. killed for memory); start a new
+                # pool for the next page, and do this one here
+                logger.error(f"Text extraction pool failed: {e}")
+                with self._lock:
+                    if self._extractor is extractor:
+                        self._extractor = None
+                extractor.shutdown(wait=False)
+                result = extract(capture.body, capture.charset)
+        else:
+            result = extract(capture.body, capture.charset)
+        capture.html, capture.plaintext, capture.simhash = result
+        capture.body = None
+
+    def _domain(self, host):
+        with self._lock:
+            domain = self._domains.get(host)
+            if domain is None:
+                domain = self._domains[host] = [threading.Semaphore(MAX_PER_DOMAIN),  # noqa
+                                                threading.Lock(),
+                                                0.0,
+                                                0]
+            self._domains.move_to_end(host)
+            domain[3] += 1
+            if len(self._domains) > MAX_DOMAINS:
+                self._prune_domains()
+            return domain
+
+    def _release_domain(self, domain):
+        with self._lock:
+            domain[3] -= 1
+
+    def _prune_domains(self):
+        # least recently used first, and only hosts no request is using
+        # and whose delay has passed, so forgetting them can't break
+        # the per-domain limits
+        now = time.monotonic()
+        excess = len(self._domains) - MAX_DOMAINS
+        idle = []
+        for host, (_semaphore, _lock, last, users) in self._domains.items():  # noqa
+            if len(idle) >= excess:
+                break
+            if users == 0 and last + DOMAIN_DELAY <= now:
+                idle.append(host)
+        for host in idle:
+            del self._domains[host]
+
+    def _wait_turn(self, domain):
+        lock = domain[1]
+        with lock:
+            delay = domain[2] + DOMAIN_DELAY - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            domain[2] = time.monotonic()
+
+    def _run(self, webpage_id, url):
+        domain = self._domain(urlsplit(url).hostname or "")
+        try:
+            with domain[0]:
+                self._wait_turn(domain)
+                if self.limiter is not None:
+                    capture = self.limiter.call(fetch, url, budget=self.budget, extract_text=False)  # noqa
+                else:
+                    capture = fetch(url, budget=self.budget,
+                                    extract_text=False)
+            try:
+                self._extract(capture)
+                self.on_capture(webpage_id, capture)
+            finally:
+                capture.release()
+        except Exception as e:
+            logger.debug(f"Could not capture {url}: {e}")
+            if self.on_error is not None:
+                self.on_error(webpage_id, url, e)
+        finally:
+            self._release_domain(domain)
+            with self._lock:
+                self._pending.discard(webpage_id)
@@ -0,0 +1,136 @@
+"""Splitting one account's history into time windows scraped in parallel.
+
+A search is a single serial stream of pages, so an account with a few
+hundred thousand tweets takes as long as all the small accounts put
+together. Searching `since:`/`until:` windows of its history
+concurrently lets it scale with workers instead.
+
+Windows are handed out newest first. Their width targets WINDOW_TWEETS
+tweets each, from the account's tweet density: initially its average
+(statuses count / age), then what the windows scraped so far actually
+contained. Tweet IDs are Snowflakes, which encode their creation time,
+so a window cut short by errors still tells how far back it got; the
+part it didn't cover is handed out again.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Snowflake IDs: milliseconds since TWITTER_EPOCH_MS, shifted left 22
+# bits. Tweets from before November 2010 have sequential IDs instead
+TWITTER_EPOCH_MS = 1288834974657
+LAST_SEQUENTIAL_ID = 29700859247
+SNOWFLAKE_START = datetime(2010, 11, 4, 1, 42, 54, 657000, tzinfo=timezone.utc)  # noqa
+
+WINDOW_TWEETS = 1000
+MIN_WIDTH = timedelta(hours=1)
+MAX_WIDTH = timedelta(days=365)
+# Weight of the newest window in the density estimate
+SMOOTHING = 0.5
+# Times a window that makes no progress is handed out again before
+# it's given up on
+MAX_REQUEUES = 3
+
+
+def snowflake_datetime(tweet_id):
+    """Creation time of a tweet, from its ID
+
+    Returns:
+        datetime: UTC, or None for pre-Snowflake IDs
+    """
+    if tweet_id <= LAST_SEQUENTIAL_ID:
+        return None
+    ms = (tweet_id >> 22) + TWITTER_EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def search_time(moment):
+    """Formats a datetime for since:/until: search operators
+    """
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%d_%H:%M:%S_UTC")  # noqa
+
+
+class WindowPlanner:
+    """Hands out consecutive [since, until) windows from end back to
+    start. Thread-safe.
+
+    Args:
+        start (datetime): Oldest moment to cover, e.g. account creation
+        end (datetime): Newest moment to cover, e.g. now
+        density (float, optional): Expected tweets per second
+        target (int, optional): Tweets per window to aim for
+    """
+    def __init__(self, start, end, density=None, target=WINDOW_TWEETS):
+        self.start = start
+        self.cursor = end
+        self.target = target
+        self.density = density
+        self.windows = 0
+        self.tweets = 0
+        # [since, until) ranges given up on
+        self.abandoned = []
+        self._requeued = []
+        self._requeues = {}
+        self._lock = threading.Lock()
+
+    def width(self):
+        if not self.density:
+            return MAX_WIDTH
+        width = timedelta(seconds=self.target / self.density)
+        return max(MIN_WIDTH, min(MAX_WIDTH, width))
+
+    def next(self):
+        """Returns the next window to scrape: one handed back by
+        requeue(), else the next older one
+
+        Returns:
+            tuple: (since, until), or None once start is reached
+        """
+        with self._lock:
+            if self._requeued:
+                return self._requeued.pop()
+            if self.cursor <= self.start:
+                return None
+            until = self.cursor
+            since = max(self.start, until - self.width())
+            self.cursor = since
+            self.windows += 1
+            return since, until
+
+    def observe(self, since, until, count):
+        """Updates the density estimate with a scraped window
+
+        Args:
+            since (datetime): Window start
+            until (datetime): Window end
+            count (int): Tweets found in it
+        """
+        seconds = max((until - since).total_seconds(), 1)
+        density = count / seconds
+        with self._lock:
+            self.tweets += count
+            if self.density is None:
+                self.density = density
+            else:
+                self.density = SMOOTHING * density + (1 - SMOOTHING) * self.density  # noqa
+
+    def requeue(self, since, until):
+        """Hands a range that couldn't be scraped out again, e.g. the
+        part of a window not covered before its search was abandoned.
+        A range handed back more than MAX_REQUEUES times, i.e. without
+        any progress, is added to abandoned instead.
+
+        Args:
+            since (datetime): Range start
+            until (datetime): Range end
+
+        Returns:
+            bool: False if the range was abandoned
+        """
+        with self._lock:
+            requeues = self._requeues.get((since, until), 0) + 1
+            if requeues > MAX_REQUEUES:
+                self.abandoned.append((since, until))
+                return False
+            self._requeues[(since, until)] = requeues
+            self._requeued.append((since, until))
+            return True
@@ -0,0 +1,62 @@
+"""Shared fixtures. Run the tests from the CLI directory with
+`python -m pytest tests`. Tests import the CLI's modules the way main.py
+does, e.g. `from modules import throttle`, so the CLI directory is put
+on the path.
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # noqa
+
+
+class LocalServer:
+    """HTTP server on localhost. routes maps a path to the responses
+    served for it, as (status, headers, body) tuples, in order; the
+    last one repeats. Request paths are recorded in requests.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append(self.path)
+                    responses = server.routes.get(self.path) or [(404, {}, b"")]  # noqa
+                    status, headers, body = responses[0]
+                    if len(responses) > 1:
+                        responses.pop(0)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def url(self, path="/"):
+        return f"http://127.0.0.1:{self._server.server_port}{path}"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def server():
+    local = LocalServer()
+    yield local
+    local.close()
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+from modules import jobqueue
+from modules.jobqueue import JobQueue, PermanentError, Worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "archive.db"), lease_seconds=60)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(jobqueue, "RETRY_DELAY", 0)
+    monkeypatch.setattr(jobqueue, "POLL_INTERVAL", 0.05)
+
+
+def states(queue):
+    return {(kind, state): count for kind, state, count in queue.stats()}
+
+
+def test_enqueue_is_idempotent(queue):
+    assert queue.enqueue("account", "jack", {"name": "jack"}) is True
+    assert queue.enqueue("account", "jack", {"name": "jack"}) is False
+    assert queue.pending() == 1
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.lease_seconds = 0.1
+    queue.enqueue("account", "jack")
+    [first] = queue.claim("a")
+    assert queue.claim("b") == []
+    time.sleep(0.2)
+    [second] = queue.claim("b")
+    assert second.id == first.id
+    assert second.attempts == 2
+    # the first owner lost the job, and can't finish or fail it
+    assert queue.complete(first) is False
+    assert queue.fail(first, "late") is None
+    assert queue.complete(second) is True
+    assert states(queue) == {("account", "done"): 1}
+
+
+def test_extended_lease_isnt_claimed(queue):
+    queue.lease_seconds = 0.2
+    queue.enqueue("account", "jack")
+    jobs = queue.claim("a")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.extend(jobs) == 1
+        assert queue.claim("b") == []
+
+
+def test_failed_job_is_retried_after_a_backoff(queue, fast_retries):
+    queue.enqueue("account", "jack", max_attempts=3)
+    [job] = queue.claim("a")
+    assert queue.fail(job, RuntimeError("search failed")) == "ready"
+    [job] = queue.claim("a")
+    assert job.attempts == 2
+    assert queue.fail(job, RuntimeError("search failed")) == "ready"
+    [job] = queue.claim("a")
+    assert job.attempts == 3
+
+
+def test_backoff_delays_the_retry(queue):
+    queue.enqueue("account", "jack")
+    [job] = queue.claim("a")
+    queue.fail(job, RuntimeError("search failed"))
+    assert queue.claim("a") == []
+    assert queue.pending() == 1
+
+
+def test_gives_up_after_max_attempts(queue, fast_retries):
+    queue.enqueue("account", "jack", max_attempts=2)
+    for expected in ("ready", "dead"):
+        [job] = queue.claim("a")
+        assert queue.fail(job, RuntimeError("search failed")) == expected
+    assert queue.claim("a") == []
+    assert queue.dead() == [["account", "jack", 2, "search failed"]]
+    assert queue.requeue_dead() == 1
+    [job] = queue.claim("a")
+    assert job.attempts == 1
+
+
+def test_lease_expiring_on_the_last_attempt_dead_letters(queue):
+    queue.lease_seconds = 0.1
+    queue.enqueue("account", "jack", max_attempts=1)
+    queue.claim("a")
+    time.sleep(0.2)
+    assert queue.claim("b") == []
+    assert queue.dead() == [["account", "jack", 1, "lease expired"]]
+
+
+def test_released_job_keeps_its_attempts(queue):
+    queue.enqueue("account", "jack")
+    [job] = queue.claim("a")
+    queue.release(job)
+    [job] = queue.claim("b")
+    assert job.attempts == 1
+
+
+def test_worker_retries_failed_account_jobs(queue, fast_retries):
+    calls = []
+
+    def run_account_job(payload):
+        calls.append(payload["name"])
+        if len(calls) < 3:
+            raise RuntimeError("search abandoned")
+
+    queue.enqueue("account", "jack", {"name": "jack"})
+    worker = Worker(queue, {"account": run_account_job}, threads=2)
+    worker.run()
+    assert calls == ["jack"] * 3
+    assert (worker.done, worker.failed) == (1, 2)
+    assert states(queue) == {("account", "done"): 1}
+
+
+def test_worker_dead_letters_permanent_errors(queue, fast_retries):
+    def run_tweet_job(payload):
+        raise PermanentError("deleted")
+
+    queue.enqueue("tweet", "1")
+    worker = Worker(queue, {"tweet": run_tweet_job})
+    worker.run()
+    assert (worker.done, worker.failed) == (0, 1)
+    assert queue.dead() == [["tweet", "1", 1, "deleted"]]
+
+
+def test_retryable_can_veto_retries(queue, fast_retries):
+    def run_account_job(payload):
+        raise KeyError("name")
+
+    queue.enqueue("account", "jack")
+    worker = Worker(queue, {"account": run_account_job},
+                    retryable=lambda e: not isinstance(e, KeyError))
+    worker.run()
+    assert worker.failed == 1
+    assert states(queue) == {("account", "dead"): 1}
@@ -0,0 +1,68 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from modules import throttle
+from modules.throttle import AdaptiveLimiter
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(throttle, "BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(throttle, "DECREASE_INTERVAL", 0)
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read()
+
+
+def limiter():
+    return AdaptiveLimiter("test", rate=50, limit=8, max_rate=100,
+                           max_limit=8)
+
+
+def test_throttling_decreases_limits_and_successes_recover_them(server):
+    server.routes["/"] = [(429, {}, b"")] * 3 + [(200, {}, b"ok")]
+    limits = limiter()
+    assert limits.call(get, server.url()) == b"ok"
+    assert limits.throttled == 3
+    assert limits.retries == 3
+    # halved three times, then +1 / limit for the success
+    assert limits.limit == 2
+    assert limits.rate == pytest.approx(50 / 8 + 0.1)
+
+    for _ in range(40):
+        limits.call(get, server.url())
+    assert limits.limit == 8
+    assert limits.rate == pytest.approx(50 / 8 + 0.1 * 41)
+
+
+def test_gives_up_after_max_retries(server):
+    server.routes["/"] = [(503, {}, b"")]
+    limits = limiter()
+    with pytest.raises(urllib.error.HTTPError):
+        limits.call(get, server.url())
+    assert len(server.requests) == throttle.MAX_RETRIES + 1
+    assert limits.in_flight == 0
+
+
+def test_other_errors_dont_adjust_limits(server):
+    server.routes["/"] = [(404, {}, b"")]
+    limits = limiter()
+    limits.limit = 4.0
+    with pytest.raises(urllib.error.HTTPError):
+        limits.call(get, server.url())
+    assert len(server.requests) == 1
+    assert limits.limit == 4.0
+    assert limits.rate == 50
+    assert limits.in_flight == 0
+
+
+def test_iterate_adapts_once_per_page():
+    limits = limiter()
+    limits.limit = 4.0
+    assert list(limits.iterate(range(100), page_size=20)) == list(range(100))  # noqa
+    # the sixth asks for a page past the end
+    assert limits.calls == 6
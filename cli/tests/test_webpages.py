@@ -0,0 +1,91 @@
+import base64
+import gzip
+import hashlib
+import threading
+from urllib.parse import urlsplit
+
+from modules.webpages import WebpageArchiver, fetch
+
+PAGE = (b"<html><head><title>Archived</title><script>var x;</script></head>"
+        b"<body><p>First paragraph</p><p>Second</p></body></html>")
+
+
+def read_warc(data):
+    """Splits (gzip-compressed) WARC data into records
+
+    Returns:
+        list[tuple]: (headers dict, block bytes) per record
+    """
+    data = gzip.decompress(data)
+    records = []
+    while data:
+        head, data = data.split(b"\r\n\r\n", 1)
+        lines = head.decode("utf-8").split("\r\n")
+        assert lines[0] == "WARC/1.0"
+        headers = dict(line.split(": ", 1) for line in lines[1:])
+        length = int(headers["Content-Length"])
+        block, data = data[:length], data[length:]
+        assert data.startswith(b"\r\n\r\n")
+        data = data[4:]
+        records.append((headers, block))
+    return records
+
+
+def sha1_label(data):
+    return "sha1:" + base64.b32encode(hashlib.sha1(data).digest()).decode()
+
+
+def test_capture_writes_response_and_request_records(server):
+    server.routes["/page?q=1"] = [(200, {"Content-Type": "text/html; charset=utf-8"}, PAGE)]  # noqa
+    capture = fetch(server.url("/page?q=1"))
+    assert capture.status == 200
+    assert capture.plaintext == "First paragraph\nSecond"
+
+    (response, response_block), (request, request_block) = read_warc(capture.warc)  # noqa
+    assert response["WARC-Type"] == "response"
+    assert response["WARC-Target-URI"] == server.url("/page?q=1")
+    assert response["Content-Type"] == "application/http; msgtype=response"
+    http_head, payload = response_block.split(b"\r\n\r\n", 1)
+    assert http_head.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b"Content-Type: text/html; charset=utf-8" in http_head
+    assert payload == PAGE
+    assert response["WARC-Block-Digest"] == sha1_label(response_block)
+    assert response["WARC-Payload-Digest"] == sha1_label(PAGE)
+
+    assert request["WARC-Type"] == "request"
+    assert request["WARC-Concurrent-To"] == response["WARC-Record-ID"]
+    assert request["WARC-Target-URI"] == server.url("/page?q=1")
+    assert request["WARC-Block-Digest"] == sha1_label(request_block)
+    lines = request_block.decode().split("\r\n")
+    assert lines[0] == "GET /page?q=1 HTTP/1.1"
+    assert f"Host: {urlsplit(server.url()).netloc}" in lines
+    assert any(line.startswith("User-agent: ") for line in lines)
+    assert request_block.endswith(b"\r\n\r\n")
+
+
+def test_truncated_body_is_recorded_as_read(server):
+    server.routes["/big"] = [(200, {"Content-Type": "application/octet-stream"}, b"x" * 1000)]  # noqa
+    capture = fetch(server.url("/big"), max_bytes=100)
+    (response, block), _request = read_warc(capture.warc)
+    http_head, payload = block.split(b"\r\n\r\n", 1)
+    assert payload == b"x" * 100
+    assert response["WARC-Payload-Digest"] == sha1_label(b"x" * 100)
+
+
+def test_archiver_captures_each_page_once(server):
+    server.routes["/"] = [(200, {"Content-Type": "text/html"}, PAGE)]
+    captured = []
+    submitted = threading.Event()
+
+    def on_capture(webpage_id, capture):
+        submitted.wait(5)
+        captured.append((webpage_id, capture.html))
+
+    archiver = WebpageArchiver(on_capture)
+    assert archiver.submit("a", server.url("/")) is True
+    assert archiver.submit("a", server.url("/")) is False
+    assert archiver.submit("b", "ftp://example.com/") is False
+    submitted.set()
+    archiver.shutdown()
+    assert captured == [("a", PAGE.decode())]
+    assert server.requests == ["/"]
@@ -2,9 +2,15 @@
 import datetime
 import logging
 import os
+import queue
+import requests
 import snscrape.modules.twitter as sntwitter
 import sqlite3
-import urllib.request
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 ''' 
 --- OVERVIEW --- 
@@ -61,6 +67,9 @@ def write_to_file(binary_data, file_name):
 
 1. read the blob files
 2. write to your local file
+
+For large archives, convert the DB with the CLI (`python main.py migrate-legacy path/to/tweets_archive.db`)
+and use `python main.py extract OUT_DIR`, which streams the BLOBs to disk in parallel
 '''
 # ---------------------------
 # --- INITIALIZING SCRIPT ---
@@ -73,7 +82,15 @@ START_TIME = datetime.datetime.now()
 
 #twitter account to search
 # Change this value. e.g., TWITTER_ACCOUNTS = ["jack"]
-TWITTER_ACCOUNTS = os.environ.get("TWITTER_ACCOUNTS", "jack").split(",")
+TWITTER_ACCOUNTS = os.environ.get("TWITTER_ACCOUNTS", os.environ.get("TWITTER_USERS", "jack")).split(",")
+
+# PARALLELISM AND BATCHING
+# ARCHIVER_WORKERS accounts are archived at the same time. All inserts go through a single writer thread, which commits once every ARCHIVER_BATCH_SIZE rows (or every ARCHIVER_FLUSH_SECONDS, whichever comes first)
+ARCHIVER_WORKERS = int(os.environ.get("ARCHIVER_WORKERS", 4))
+ARCHIVER_BATCH_SIZE = int(os.environ.get("ARCHIVER_BATCH_SIZE", 500))
+ARCHIVER_FLUSH_SECONDS = float(os.environ.get("ARCHIVER_FLUSH_SECONDS", 5))
+# Rows carry media BLOBs, so the rows waiting for the writer are also bounded by size: workers wait while ARCHIVER_WRITER_MAX_BYTES are queued, and the writer commits early once half of that is pending (media spilled to temp files isn't counted, see MEDIA_SPOOL_SIZE)
+ARCHIVER_WRITER_MAX_BYTES = int(os.environ.get("ARCHIVER_WRITER_MAX_BYTES", 256 * 1024 * 1024))
 
 # ADVANCED SEARCH TERMS
 # Advanced search terms can be utilized (see example below). See this guide for search terms: https://github.com/igorbrigadir/twitter-advanced-search/blob/master/README.md 
@@ -88,11 +105,21 @@ TWITTER_ACCOUNTS = os.environ.get("TWITTER_ACCOUNTS", "jack").split(",")
 TWEETS_TABLE_NAME = "tweets" 
 USERS_TABLE_NAME = "users"
 
+# Media of up to MEDIA_SPOOL_SIZE bytes is downloaded into memory. Larger files spill over to an anonymous temp file, which the writer copies into the BLOB a chunk at a time, so no download is ever held in memory whole and nothing is written to (or has to be cleaned up from) the working directory
+# All downloads share one HTTP session, so connections to Twitter's media CDN are kept alive and reused
+MEDIA_SPOOL_SIZE = int(os.environ.get("ARCHIVER_MEDIA_SPOOL_SIZE", 8 * 1024 * 1024))
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_TIMEOUT = 60
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+HTTP_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 # Connecting/creating database. The DB file will be saved to the directory you're running this script in
 DB_FILE=os.path.expanduser(os.environ.get("TWITTER_DB_FILE", "tweets_archive.db"))
 print(f"Connecting to database:  {DB_FILE}")
 conn = sqlite3.connect(DB_FILE) 
 c = conn.cursor()
+COUNTER_LOCK = threading.Lock()
 # --                       --
 # - End of Global Variables -
 # --                       --
@@ -184,15 +211,18 @@ def create_global_vars():
 def error_handling(e):
     # logger.error(e)
     global ERROR_COUNT
-    ERROR_COUNT += 1
+    with COUNTER_LOCK:
+        ERROR_COUNT += 1
 
 def archive_counter():
     global ARCHIVED_ITEMS_COUNT
-    ARCHIVED_ITEMS_COUNT += 1 #due to this program's recursive nature, the ARCHIVED_ITEMS_COUNT printed on-screen may seem inaccurate; however, it's counting correctly. You'll see scenarios where the same count number is printed multiple times - this is caused by the recursion
+    with COUNTER_LOCK:
+        ARCHIVED_ITEMS_COUNT += 1 #due to this program's recursive nature, the ARCHIVED_ITEMS_COUNT printed on-screen may seem inaccurate; however, it's counting correctly. You'll see scenarios where the same count number is printed multiple times - this is caused by the recursion
 
 def skipped_archive_counter():
     global SKIPPED_ITEMS_COUNT
-    SKIPPED_ITEMS_COUNT += 1
+    with COUNTER_LOCK:
+        SKIPPED_ITEMS_COUNT += 1
     return 
 
 def total_items_viewed_counter():
@@ -200,6 +230,9 @@ def total_items_viewed_counter():
     TOTAL_ITEMS_VIEWED = ARCHIVED_ITEMS_COUNT + SKIPPED_ITEMS_COUNT
 
 def initialize_database():
+    # WAL lets the workers' existence checks read while the writer thread writes
+    c.execute("PRAGMA journal_mode=WAL")
+
     # TWEETS TABLE
     message = "Creating tweets table"
     # logging.info(message)
@@ -283,25 +316,189 @@ def initialize_database():
     print(message)
     # END OF USERS TABLE
 
-def download_media(media_url, filename): 
-    try:
-        downloaded_media = urllib.request.urlretrieve(media_url, filename) #media is named username_tweet_id.[filetype]
-    except Exception as e:
-        # error_handling(e)
-        return None # if the media no longer exists, return None (which results in no file being created locally)
-
-    return downloaded_media #media is named username_tweet_id.[filetype]
-
-def convert_to_binary_data(filename):
-    # Convert digital data to binary format
+# --                 --
+# - Batching Writer -
+# --                 --
+# All inserts are queued to one writer thread, which owns its own connection. Rows are grouped per statement and written with executemany (sqlite3 caches the prepared statement), then committed once per batch instead of once per row.
+# IDs a worker is archiving are "claimed" until the row holding them is committed, so two workers never archive the same tweet or user twice, even though the row isn't in the DB yet
+WRITER_STOP = object()
+CLAIMED = {"tweets": set(), "users": set()}
+CLAIMED_LOCK = threading.Lock()
+READ_CONNECTIONS = threading.local()
+
+class BatchWriter:
+    def __init__(self, db_file, batch_size, flush_seconds, max_bytes):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=batch_size * 4) # a full queue makes workers wait for the writer
+        self.queued_bytes = 0 # size of the rows queued or pending, which makes workers wait once it reaches max_bytes
+        self.bytes_cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="batch-writer", daemon=True)
+        self.thread.start()
+
+    def insert(self, sql, params, table_name, artifact_id):
+        size = sum(len(param) for param in params if isinstance(param, (str, bytes, bytearray)))
+        with self.bytes_cond:
+            # a row larger than max_bytes still goes through, on its own
+            while self.queued_bytes > 0 and self.queued_bytes + size > self.max_bytes:
+                self.bytes_cond.wait()
+            self.queued_bytes += size
+        self.queue.put((sql, params, table_name, artifact_id, size))
+
+    def close(self):
+        self.queue.put(WRITER_STOP)
+        self.thread.join()
+
+    def flush(self, writer_conn, pending, streamed, committed):
+        try:
+            for sql, rows in pending.items():
+                writer_conn.executemany(sql, rows)
+            for sql, params in streamed:
+                stream_row(writer_conn, sql, params)
+            writer_conn.commit()
+        except Exception as e:
+            # one bad row fails the whole executemany, so the batch is rolled back and written again row by row, skipping only the rows that fail
+            writer_conn.rollback()
+            logging.warning("Batch could not be written, retrying row by row: " + str(e))
+            self.flush_rows(writer_conn, pending, streamed)
+        finally:
+            for sql, params in streamed:
+                for param in params:
+                    if hasattr(param, "read"):
+                        param.close()
+        with CLAIMED_LOCK:
+            for table_name, artifact_id in committed:
+                CLAIMED[table_name].discard(artifact_id)
+        pending.clear()
+        streamed.clear()
+        committed.clear()
+
+    def flush_rows(self, writer_conn, pending, streamed):
+        rows = [(sql, params, False) for sql, sql_rows in pending.items() for params in sql_rows]
+        rows += [(sql, params, True) for sql, params in streamed]
+        try:
+            for sql, params, stream in rows:
+                try:
+                    if stream:
+                        stream_row(writer_conn, sql, params)
+                    else:
+                        writer_conn.execute(sql, params)
+                except Exception as e:
+                    logging.error("Row " + str(params[0]) + " could not be written: " + str(e)) # the first column is the tweet or user ID
+                    error_handling(e)
+            writer_conn.commit()
+        except Exception as e:
+            logging.error("Batch could not be written: " + str(e))
+            error_handling(e)
+            writer_conn.rollback()
+
+    def run(self):
+        writer_conn = sqlite3.connect(self.db_file)
+        pending = {}
+        streamed = []
+        committed = []
+        pending_bytes = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+            if item is WRITER_STOP:
+                break
+            if item is not None:
+                sql, params, table_name, artifact_id, size = item
+                pending_bytes += size
+                if any(hasattr(param, "read") for param in params):
+                    streamed.append((sql, params))
+                else:
+                    pending.setdefault(sql, []).append(params)
+                committed.append((table_name, artifact_id))
+            if len(committed) >= self.batch_size or pending_bytes >= self.max_bytes // 2 or (committed and time.monotonic() - last_flush >= self.flush_seconds):
+                self.flush(writer_conn, pending, streamed, committed)
+                self.flushed(pending_bytes)
+                pending_bytes = 0
+                last_flush = time.monotonic()
+        if committed:
+            self.flush(writer_conn, pending, streamed, committed)
+            self.flushed(pending_bytes)
+        writer_conn.close()
+
+    def flushed(self, size):
+        with self.bytes_cond:
+            self.queued_bytes -= size
+            self.bytes_cond.notify_all()
+
+def stream_row(writer_conn, sql, params):
+    # inserts a row whose media spilled to a temp file (see download_media): the BLOB is inserted as zeroblob(size) and the file is copied into it a chunk at a time
+    table_name = sql.split()[4] # INSERT OR IGNORE INTO <table> (<columns>) VALUES (...)
+    columns = sql[sql.index("(") + 1:sql.index(")")].split(", ")
+    placeholders = []
+    values = []
+    for param in params:
+        if hasattr(param, "read"):
+            param.seek(0, os.SEEK_END)
+            placeholders.append("zeroblob(?)")
+            values.append(param.tell())
+        else:
+            placeholders.append("?")
+            values.append(param)
+    cursor = writer_conn.execute("INSERT OR IGNORE INTO " + table_name + " (" + ", ".join(columns) + ") VALUES (" + ", ".join(placeholders) + ")", values)
+    if cursor.rowcount != 1:
+        return # already archived
+    for column, param in zip(columns, params):
+        if hasattr(param, "read"):
+            param.seek(0)
+            with writer_conn.blobopen(table_name, column, cursor.lastrowid) as blob:
+                while True:
+                    chunk = param.read(MEDIA_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    blob.write(chunk)
+
+def release_claim(table_name, artifact_id):
+    # for an ID that was claimed but never reached the writer, e.g. because archiving it failed, so it can be archived again later
+    with CLAIMED_LOCK:
+        CLAIMED[table_name].discard(artifact_id)
+
+def get_read_connection():
+    # each worker thread checks for existing rows on its own connection
+    if getattr(READ_CONNECTIONS, "conn", None) is None:
+        READ_CONNECTIONS.conn = sqlite3.connect(DB_FILE)
+    return READ_CONNECTIONS.conn
+
+def download_media(media_url):
+    # returns the media's binary data (a bytearray), a temp file holding it if it's larger than MEDIA_SPOOL_SIZE, or None
     try:
-        open(filename, 'rb')
+        with HTTP_SESSION.get(media_url, stream=True, timeout=MEDIA_TIMEOUT) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            if length is not None and length.isdigit() and int(length) <= MEDIA_SPOOL_SIZE:
+                content = bytearray(int(length)) # filled in place, so the data is only held once
+                size = 0
+                for chunk in response.iter_content(MEDIA_CHUNK_SIZE):
+                    content[size:size + len(chunk)] = chunk
+                    size += len(chunk)
+                del content[size:]
+                return content
+            buffer = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_SIZE)
+            size = 0
+            for chunk in response.iter_content(MEDIA_CHUNK_SIZE):
+                buffer.write(chunk)
+                size += len(chunk)
+            buffer.seek(0)
+            if size > MEDIA_SPOOL_SIZE:
+                logging.info("Media is larger than MEDIA_SPOOL_SIZE, streaming it from a temp file: " + media_url)
+                return buffer
+            content = bytearray(size)
+            buffer.readinto(content)
+            buffer.close()
+            return content
     except Exception as e:
         # error_handling(e)
-        return None
-    with open(filename, 'rb') as file:
-        blobData = file.read()
-    return blobData
+        return None # if the media no longer exists, return None
 
 def get_stats():
     elapsed_time = datetime.datetime.now() - START_TIME
@@ -327,16 +524,14 @@ def insert_into_tweets_table(tweet_id, tweet_user_name, tweet_datetime, tweet_co
     # logging.info("Inserting into tweet table:")
     print_inserting_into_db_message("tweets", tweet_id, tweet_user_name, tweet_datetime)
     archive_counter()
-    c.execute("INSERT OR IGNORE INTO tweets (tweet_id, tweet_user_name, tweet_datetime, tweet_content, tweet_media_content_blob, tweet_latitude, tweet_longitude, tweet_conversation_id, tweet_hashtags, tweet_like_count, tweet_language, tweet_media_filename, tweet_media_duration, tweet_media_views, tweet_media_url, tweet_mentioned_users, tweet_place_full_name, tweet_place_name, tweet_place_type, tweet_place_country, tweet_place_country_code, tweet_quote_count, tweet_quoted_tweet_id, tweet_replied_to_tweet_id, tweet_reply_count, tweet_retweet_count, tweet_retweeted_tweet_id, tweet_source_app, tweet_url, tweet_user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (tweet_id, tweet_user_name, tweet_datetime, tweet_content, tweet_media_content_blob, tweet_latitude, tweet_longitude, tweet_conversation_id, tweet_hashtags, tweet_like_count, tweet_language, tweet_media_filename, tweet_media_duration, tweet_media_views, tweet_media_url, tweet_mentioned_users, tweet_place_full_name, tweet_place_name, tweet_place_type, tweet_place_country, tweet_place_country_code, tweet_quote_count, tweet_quoted_tweet_id, tweet_replied_to_tweet_id, tweet_reply_count, tweet_retweet_count, tweet_retweeted_tweet_id, tweet_source_app, tweet_url, tweet_user_id))
-    conn.commit()    
+    WRITER.insert("INSERT OR IGNORE INTO tweets (tweet_id, tweet_user_name, tweet_datetime, tweet_content, tweet_media_content_blob, tweet_latitude, tweet_longitude, tweet_conversation_id, tweet_hashtags, tweet_like_count, tweet_language, tweet_media_filename, tweet_media_duration, tweet_media_views, tweet_media_url, tweet_mentioned_users, tweet_place_full_name, tweet_place_name, tweet_place_type, tweet_place_country, tweet_place_country_code, tweet_quote_count, tweet_quoted_tweet_id, tweet_replied_to_tweet_id, tweet_reply_count, tweet_retweet_count, tweet_retweeted_tweet_id, tweet_source_app, tweet_url, tweet_user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (tweet_id, tweet_user_name, tweet_datetime, tweet_content, tweet_media_content_blob, tweet_latitude, tweet_longitude, tweet_conversation_id, tweet_hashtags, tweet_like_count, tweet_language, tweet_media_filename, tweet_media_duration, tweet_media_views, tweet_media_url, tweet_mentioned_users, tweet_place_full_name, tweet_place_name, tweet_place_type, tweet_place_country, tweet_place_country_code, tweet_quote_count, tweet_quoted_tweet_id, tweet_replied_to_tweet_id, tweet_reply_count, tweet_retweet_count, tweet_retweeted_tweet_id, tweet_source_app, tweet_url, tweet_user_id), "tweets", tweet_id)
     return
 
 def insert_into_users_table(user_id, user_username, user_display_name, user_description, user_verified, user_account_datetime_created, user_followers_count, user_friends_count, user_status_count, user_favorites_count, user_listed_count, user_media_count, user_location, user_account_protected, user_linked_url, user_profile_picture, user_profile_banner_picture, user_label, user_twitter_url):
     # logging.info("Inserting into users table")
     print_inserting_into_db_message("users", user_id, user_username, user_account_datetime_created)
     archive_counter()
-    c.execute("INSERT INTO users (user_id, user_username, user_display_name, user_description, user_verified, user_account_datetime_created, user_followers_count, user_friends_count, user_status_count, user_favorites_count, user_listed_count, user_media_count, user_location, user_account_protected, user_linked_url, user_profile_picture, user_profile_banner_picture, user_label, user_twitter_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (user_id, user_username, user_display_name, user_description, user_verified, user_account_datetime_created, user_followers_count, user_friends_count, user_status_count, user_favorites_count, user_listed_count, user_media_count, user_location, user_account_protected, user_linked_url, user_profile_picture, user_profile_banner_picture, user_label, user_twitter_url))
-    conn.commit()  
+    WRITER.insert("INSERT OR IGNORE INTO users (user_id, user_username, user_display_name, user_description, user_verified, user_account_datetime_created, user_followers_count, user_friends_count, user_status_count, user_favorites_count, user_listed_count, user_media_count, user_location, user_account_protected, user_linked_url, user_profile_picture, user_profile_banner_picture, user_label, user_twitter_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (user_id, user_username, user_display_name, user_description, user_verified, user_account_datetime_created, user_followers_count, user_friends_count, user_status_count, user_favorites_count, user_listed_count, user_media_count, user_location, user_account_protected, user_linked_url, user_profile_picture, user_profile_banner_picture, user_label, user_twitter_url), "users", user_id)
     return
 
 def check_if_artifact_exists_in_db(table_name, artifact_id):
@@ -351,13 +546,20 @@ def check_if_artifact_exists_in_db(table_name, artifact_id):
         error_handling("Table" + table_name + "does not exist")
         return False
 
-    c.execute('''
-        SELECT EXISTS (
-            SELECT 1
-            FROM %s
-            WHERE %s = %s
-        )''' %(table_name, column_name, artifact_id))
-    exists = (c.fetchall())[0][0] #1 == Exists; 0 == Does not exist;
+    # the DB is read without holding CLAIMED_LOCK, so workers' checks don't wait on each other
+    exists_sql = "SELECT EXISTS (SELECT 1 FROM " + table_name + " WHERE " + column_name + " = ?)"
+    exists = get_read_connection().execute(exists_sql, (artifact_id,)).fetchone()[0] #1 == Exists; 0 == Does not exist;
+    if exists == 0:
+        with CLAIMED_LOCK:
+            if artifact_id in CLAIMED[table_name]:
+                exists = 1 # being archived by another worker, or waiting to be committed
+            else:
+                CLAIMED[table_name].add(artifact_id) # the caller archives it
+        if exists == 0:
+            # another worker's row may have been committed (and its claim released) between the read and the claim; claims are only released after the commit, so reading again catches it
+            exists = get_read_connection().execute(exists_sql, (artifact_id,)).fetchone()[0]
+            if exists == 1:
+                release_claim(table_name, artifact_id)
 
     if exists == 1:
         # message = str(artifact_id) + " already exists in " + table_name
@@ -373,8 +575,9 @@ def check_if_artifact_exists_in_db(table_name, artifact_id):
 def get_media(media, tweet_or_user_id, username, media_url=None, media_filename=None):
     # logging.info("Downloading media ")
     # print("\nDownloading media")
+    media_content_blob = None # blobs (as binary formats) are already quite compressed, and attempts to compress create a number of complications
     if media_url is not None:
-        media_content = download_media(media_url, media_filename)
+        media_content_blob = download_media(media_url)
         media_duration = None
         media_views = None
     else:
@@ -382,8 +585,6 @@ def get_media(media, tweet_or_user_id, username, media_url=None, media_filename=
         media_views = None
         media_url = None
         media_filename = None
-        media_content_blob = None # blobs (as binary formats) are already quite compressed, and attempts to compress create a number of complications
-        media_content = None
 
         if media is not None:
             media_type = str(type(media[0]))
@@ -393,27 +594,16 @@ def get_media(media, tweet_or_user_id, username, media_url=None, media_filename=
                 media_views = media_content.views
                 media_url = (media_content.variants)[0].url #Twitter can, but does not always, save more than one version type ("variant" in snscrape) per video/gif. We'll use the first variant, because (1) this will keep the DB simpler and (2) after testing, the first variant appears to always be the highest-quality version
                 media_filename = str(username) + "_" + str(tweet_or_user_id) + ".mp4"
-                media_content = download_media(media_url, media_filename) 
+                media_content_blob = download_media(media_url)
             elif "Photo" in media_type:
                 media_url = media_content.fullUrl
                 media_filename = str(username) + "_" + str(tweet_or_user_id) + ".jpg"
-                media_content = download_media(media_url, media_filename)
+                media_content_blob = download_media(media_url)
             elif "Gif" in media_type:
                 media_url = (media_content.variants)[0].url
                 media_filename = str(username) + "_" + str(tweet_or_user_id) + ".mp4"
-                media_content = download_media(media_url, media_filename)        
+                media_content_blob = download_media(media_url)
 
-    if media_content is None:
-        media_content_blob = None
-    else:
-        media_content_blob = convert_to_binary_data(media_content[0])
-        if media_content_blob is not None:
-            try:
-                os.remove(media_filename) #a file's not created if the media resource no longer exists
-            except Exception as e:
-                # error_handling(e)
-                pass
-    
     return media_content_blob, media_duration, media_views, media_url, media_filename 
 
 def archive_user(user_data):
@@ -423,7 +613,8 @@ def archive_user(user_data):
 
     if check_if_artifact_exists_in_db("users", user_id) is True:
         return
-    else:
+    queued = False
+    try:
         # logging.info("Data for user with ID " + str(user_id) + " has been pulled. Compiling data...")
         user_username = user_data.username
         user_display_name = user_data.displayname
@@ -446,7 +637,11 @@ def archive_user(user_data):
             user_label = user_data.label.description
         user_twitter_url = user_data.url
         insert_into_users_table(user_id, user_username, user_display_name, user_description, user_verified, user_account_datetime_created, user_followers_count, user_friends_count, user_status_count, user_favorites_count, user_listed_count, user_media_count, user_location, user_account_protected, user_linked_url, user_profile_picture, user_profile_banner_picture, user_label, user_twitter_url)
-        
+        queued = True
+    finally:
+        if not queued:
+            release_claim("users", user_id)
+
 def archive_tweet(original_tweet_id=None, new_tweet_id=None, tweet=None):
     # this utilizes recursion to archive the entire chain of retweets, quoted tweets and replied to tweets
     
@@ -458,7 +653,8 @@ def archive_tweet(original_tweet_id=None, new_tweet_id=None, tweet=None):
     
     if check_if_artifact_exists_in_db("tweets", _tmp_tweet_id) is True:
         return
-    else:
+    queued = False
+    try:
         if tweet is None:
             # logging.info("Checking if tweet with id " + str(new_tweet_id) + " exists on Twitter")
             try:
@@ -538,15 +734,31 @@ def archive_tweet(original_tweet_id=None, new_tweet_id=None, tweet=None):
         tweet_source_app = tweet.sourceLabel
         tweet_url = tweet.url
         
-        insert_into_tweets_table(tweet_id, tweet_user_name, tweet_datetime, tweet_content, tweet_media_content_blob, tweet_latitude, tweet_longitude, tweet_conversation_id, tweet_hashtags, tweet_like_count, tweet_language, tweet_media_filename, tweet_media_duration, tweet_media_views, tweet_media_url, tweet_mentioned_users, tweet_place_full_name, tweet_place_name, tweet_place_type, tweet_place_country, tweet_place_country_code, tweet_quote_count, tweet_quoted_tweet_id, tweet_replied_to_tweet_id, tweet_reply_count, tweet_retweet_count, tweet_retweeted_tweet_id, tweet_source_app, tweet_url, tweet_user_id)     
+        insert_into_tweets_table(tweet_id, tweet_user_name, tweet_datetime, tweet_content, tweet_media_content_blob, tweet_latitude, tweet_longitude, tweet_conversation_id, tweet_hashtags, tweet_like_count, tweet_language, tweet_media_filename, tweet_media_duration, tweet_media_views, tweet_media_url, tweet_mentioned_users, tweet_place_full_name, tweet_place_name, tweet_place_type, tweet_place_country, tweet_place_country_code, tweet_quote_count, tweet_quoted_tweet_id, tweet_replied_to_tweet_id, tweet_reply_count, tweet_retweet_count, tweet_retweeted_tweet_id, tweet_source_app, tweet_url, tweet_user_id)
+        queued = True
+    finally:
+        if not queued:
+            release_claim("tweets", _tmp_tweet_id)
+
+def archive_account(account):
+    try:
+        for _tmp,tweet in enumerate(sntwitter.TwitterSearchScraper(f'''from:{account} include:nativeretweets''', top=True).get_items()):
+            archive_tweet(None, None, tweet)
+    except Exception as e:
+        print("\n>>> Could not finish archiving the following account: {} ({})".format(account, e))
+        error_handling(e)
+        return
+    print("\n>>> Completed archiving the following account: {}".format(account))
 
 def main():
+    global WRITER
     create_global_vars()
     initialize_database()
-    for account in TWITTER_ACCOUNTS:
-        for _tmp,tweet in enumerate(sntwitter.TwitterSearchScraper(f'''from:{account} include:nativeretweets''', top=True).get_items()):
-            archive_tweet(None, None, tweet)
-        print("\n>>> Completed archiving the following account: {}".format(account))
+    WRITER = BatchWriter(DB_FILE, ARCHIVER_BATCH_SIZE, ARCHIVER_FLUSH_SECONDS, ARCHIVER_WRITER_MAX_BYTES)
+    with ThreadPoolExecutor(max_workers=ARCHIVER_WORKERS) as executor:
+        for account in TWITTER_ACCOUNTS:
+            executor.submit(archive_account, account)
+    WRITER.close()
     count = 0
     print("\n>>> Finished archiving the following accounts:")
     for account in TWITTER_ACCOUNTS: 